@@ -1,5 +1,5 @@
 import streamlit as st
-from calango.database import ConfigManager
+from calango.database import ConfigManager, archive_old_sessions
 from calango.themes import apply_theme
 
 st.set_page_config(page_title="Calango AI", page_icon="🦎", layout="wide")
@@ -11,6 +11,11 @@ try:
 except Exception as e:
     print(f"Theme load error: {e}")
 
+try:
+    archive_old_sessions()
+except Exception as e:
+    print(f"Archival error: {e}")
+
 home_page = st.Page("ui/home.py", title="Chats", icon="💬")
 rinha_page = st.Page("ui/rinha.py", title="A Rinha", icon="🥊")
 cuca_page = st.Page("ui/dashboard.py", title="A Cuca", icon="🧠")
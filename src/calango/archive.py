@@ -0,0 +1,131 @@
+"""
+Compressed archival tier for old sessions.
+
+Archived sessions live in per-month segment files (<archive dir>/<YYYY-MM>.jsonl.gz), one
+line per archival of a session: "<session id>\\t<json>". The JSON holds the session document
+and its history records; records added to a session after it was archived are archived later
+as another line of the same segment. Segments are append-only gzip streams (every archival
+run adds a gzip member), so archiving never rewrites old data, and opening a session only
+decompresses its month and parses the matching lines.
+
+The archival itself is driven by SessionManager.archive_sessions(); this module only knows
+about segment files.
+
+Usage:
+    python -m calango.archive [--older-than-days N]
+"""
+
+import argparse
+import gzip
+import json
+import os
+import sys
+from pathlib import Path
+
+SEGMENT_SUFFIX = ".jsonl.gz"
+
+
+def segment_name(created_at):
+    """Month segment ("YYYY-MM") a session belongs to, from its ISO created_at."""
+    month = str(created_at or "")[:7]
+    return month if len(month) == 7 and month[4] == "-" else "undated"
+
+
+def segment_path(archive_dir, segment):
+    return Path(archive_dir) / f"{segment}{SEGMENT_SUFFIX}"
+
+
+def append_entries(path, entries):
+    """Appends {"session": {...}, "interactions": [...]} entries to a segment."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with gzip.open(path, "at", encoding="utf-8") as f:
+        for entry in entries:
+            f.write(f"{entry['session']['id']}\t{json.dumps(entry, ensure_ascii=False)}\n")
+
+
+def _lines(path):
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            session_id, _, payload = line.rstrip("\n").partition("\t")
+            yield session_id, payload
+
+
+def read_entries(path, session_ids):
+    """
+    Returns {session id: entry} for the archived sessions of a segment among session_ids.
+    Only the matching lines are parsed; a session archived in several runs gets one entry
+    holding all of its records.
+    """
+    path = Path(path)
+    session_ids = set(session_ids)
+    entries = {}
+    if not path.exists():
+        return entries
+    for line_id, payload in _lines(path):
+        if line_id not in session_ids:
+            continue
+        entry = json.loads(payload)
+        if line_id in entries:
+            entries[line_id]["interactions"].extend(entry["interactions"])
+        else:
+            entries[line_id] = entry
+    return entries
+
+
+def read_entry(path, session_id):
+    """Returns the archived entry of a session, or None."""
+    return read_entries(path, [session_id]).get(session_id)
+
+
+def iter_entries(archive_dir):
+    """Streams every archived entry of every segment (used to rebuild aggregates)."""
+    for path in sorted(Path(archive_dir).glob(f"*{SEGMENT_SUFFIX}")):
+        for _, payload in _lines(path):
+            yield json.loads(payload)
+
+
+def iter_interactions(archive_dir):
+    """Streams every archived history record."""
+    for entry in iter_entries(archive_dir):
+        yield from entry["interactions"]
+
+
+def drop_entry(path, session_id):
+    """Rewrites a segment without one session (used when an archived session is deleted)."""
+    path = Path(path)
+    if not path.exists():
+        return
+    tmp_path = path.with_name(path.name + ".tmp")
+    kept = 0
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as out:
+        for line_id, payload in _lines(path):
+            if line_id != session_id:
+                out.write(f"{line_id}\t{payload}\n")
+                kept += 1
+    if kept:
+        os.replace(tmp_path, path)
+    else:
+        tmp_path.unlink()
+        path.unlink()
+
+
+def main(argv=None):
+    from calango.database import ARCHIVE_AFTER_DAYS, SessionManager
+
+    parser = argparse.ArgumentParser(description="Move old Calango sessions into compressed monthly archives.")
+    parser.add_argument(
+        "--older-than-days",
+        type=int,
+        default=ARCHIVE_AFTER_DAYS or 90,
+        help="Archive sessions last active more than this many days ago",
+    )
+    args = parser.parse_args(argv)
+
+    archived = SessionManager().archive_sessions(args.older_than_days)
+    print(f"🦎 Archived {archived:,} sessions inactive for {args.older_than_days} days.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
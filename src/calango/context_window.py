@@ -0,0 +1,195 @@
+"""
+Context-window management for chat requests.
+
+Instead of the whole conversation, each turn sends the system prompt plus the newest turns
+that fit a token budget: CALANGO_CONTEXT_BUDGET, capped by the model's context limit (from
+litellm's model map, CALANGO_CONTEXT_LIMIT for unknown models) minus room for the reply.
+Token counts are cached on the messages, so fitting a turn only encodes the new ones.
+
+With a summarizer (opt-in, CALANGO_CONTEXT_SUMMARY=1) older turns are not simply dropped:
+they are folded into a rolling summary appended to the system prompt. The summary is cached
+on the session and only refreshed once SUMMARY_BATCH more messages have left the window, so
+most turns make no extra call.
+"""
+
+import hashlib
+import os
+from functools import lru_cache
+
+from calango.tokenizer import count_tokens_cached, message_tokens
+
+# Most tokens of history sent per turn (0: as much as the model accepts)
+CONTEXT_BUDGET = int(os.getenv("CALANGO_CONTEXT_BUDGET", "16000"))
+# Context size assumed for models missing from litellm's map (e.g. most local models)
+DEFAULT_CONTEXT_LIMIT = int(os.getenv("CALANGO_CONTEXT_LIMIT", "8192"))
+# Tokens left free for the reply (at most a quarter of the model's context)
+REPLY_RESERVE = int(os.getenv("CALANGO_CONTEXT_REPLY_RESERVE", "2048"))
+CONTEXT_SUMMARY_ENABLED = os.getenv("CALANGO_CONTEXT_SUMMARY", "0") == "1"
+# Messages that must have left the window before the summary is refreshed
+SUMMARY_BATCH = int(os.getenv("CALANGO_CONTEXT_SUMMARY_BATCH", "6"))
+SUMMARY_MAX_TOKENS = int(os.getenv("CALANGO_CONTEXT_SUMMARY_TOKENS", "400"))
+
+SUMMARY_HEADER = "Summary of the earlier part of this conversation:"
+
+
+@lru_cache(maxsize=256)
+def context_limit(provider, model):
+    """Input token limit of a model from litellm's model map (DEFAULT_CONTEXT_LIMIT when unknown)."""
+    try:
+        from litellm import model_cost
+    except ImportError:
+        return DEFAULT_CONTEXT_LIMIT
+
+    provider = (provider or "").strip().lower()
+    model = (model or "").strip().lower()
+    prefix = "gemini" if provider == "google" else provider
+    for key in (f"{prefix}/{model}", model):
+        info = model_cost.get(key)
+        if not isinstance(info, dict):
+            continue
+        limit = info.get("max_input_tokens") or info.get("max_tokens")
+        if isinstance(limit, int) and limit > 0:
+            return limit
+    return DEFAULT_CONTEXT_LIMIT
+
+
+def token_budget(provider, model, budget=CONTEXT_BUDGET, reply_reserve=REPLY_RESERVE):
+    """Tokens of history that may be sent to a model: the budget, capped by its limit minus the reply reserve."""
+    limit = context_limit(provider, model)
+    available = limit - min(reply_reserve, limit // 4)
+    return min(budget, available) if budget > 0 else available
+
+
+def with_summary(system_prompt, summary):
+    """Appends a conversation summary to a system prompt."""
+    if not summary:
+        return system_prompt
+    return f"{system_prompt}\n\n{SUMMARY_HEADER}\n{summary}" if system_prompt else f"{SUMMARY_HEADER}\n{summary}"
+
+
+def _fits_uncounted(chat_history, budget):
+    """
+    True when the history surely fits without tokenizing it: no token is shorter than one
+    byte, so a history of at most `budget` UTF-8 bytes is at most `budget` tokens.
+    """
+    size = 0
+    for message in chat_history:
+        size += len((message.get("content") or "").encode("utf-8"))
+        if size > budget:
+            return False
+    return True
+
+
+def _fingerprint(message):
+    text = f"{message.get('role')}\n{message.get('content') or ''}"
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _window_start(turns, sizes, floor, available):
+    """
+    First turn of the newest run that fits `available` tokens. The last turn is always kept,
+    and the window never opens with a reply whose question was cut.
+    """
+    start = len(sizes)
+    used = 0
+    while start > floor and (start == len(sizes) or used + sizes[start - 1] <= available):
+        start -= 1
+        used += sizes[start]
+    while start < len(turns) - 1 and turns[start].get("role") == "assistant":
+        start += 1
+    return start
+
+
+class ContextWindow:
+    def __init__(self, budget=CONTEXT_BUDGET, summarizer=None, summaries=None, batch=SUMMARY_BATCH):
+        """
+        budget: most tokens of history per turn (0: the model's whole context).
+        summarizer: optional callable(provider, model, messages, previous_summary) -> str that
+            condenses turns leaving the window (see CalangoEngine.summarize).
+        summaries: where rolling summaries are cached per session; an object with
+            get_context_summary(session_id) and save_context_summary(session_id, summary),
+            e.g. the SessionManager.
+        """
+        self.budget = budget
+        self.summarizer = summarizer
+        self.summaries = summaries
+        self.batch = max(batch, 1)
+
+    def _cached_summary(self, session_id, turns):
+        """The session's summary if it still describes the start of these turns, else None."""
+        summary = self.summaries.get_context_summary(session_id)
+        if not summary:
+            return None
+        covered = summary.get("covered", 0)
+        if not 0 < covered <= len(turns) or summary.get("anchor") != _fingerprint(turns[covered - 1]):
+            return None
+        return summary
+
+    def _refresh_summary(self, provider, model, session_id, turns, summary, start):
+        """Folds turns[covered:start] into the summary; keeps the previous one when the call fails."""
+        covered = summary["covered"] if summary else 0
+        previous = summary["text"] if summary else ""
+        try:
+            text = self.summarizer(provider, model, turns[covered:start], previous)
+        except Exception as e:
+            print(f"⚠️ Context Summary Failed: {e}")
+            return summary
+        if not text:
+            return summary
+
+        summary = {"covered": start, "anchor": _fingerprint(turns[start - 1]), "text": text.strip()}
+        try:
+            self.summaries.save_context_summary(session_id, summary)
+        except Exception as e:
+            print(f"⚠️ Context Summary Not Saved: {e}")
+        return summary
+
+    def fit(self, provider, model, chat_history, session_id=None):
+        """
+        Cuts chat_history (the system messages, e.g. the system prompt and retrieved context,
+        followed by the turns, the newest last) down to the token budget; the system messages
+        are always sent. Returns (messages, info) where info holds the "limit",
+        "budget" and "tokens" sent (None when a short history was sent without counting), and
+        how many turns were "sent", "dropped" and "summarized".
+        """
+        prefix = 0
+        while prefix < len(chat_history) and chat_history[prefix].get("role") == "system":
+            prefix += 1
+        system = chat_history[0] if prefix else None
+        extra_system = chat_history[1:prefix]
+        turns = chat_history[prefix:]
+        budget = token_budget(provider, model, self.budget)
+        if _fits_uncounted(chat_history, budget):
+            info = {"limit": context_limit(provider, model), "budget": budget, "tokens": None}
+            return list(chat_history), {**info, "sent": len(turns), "dropped": 0, "summarized": 0}
+        system_tokens = sum(count_tokens_cached(m["content"], model) for m in chat_history[:prefix])
+        sizes = [message_tokens(m, model) for m in turns]
+
+        summarize = self.summarizer is not None and self.summaries is not None and session_id is not None
+        summary = self._cached_summary(session_id, turns) if summarize else None
+
+        def window(summary):
+            summary_tokens = count_tokens_cached(summary["text"], model) if summary else 0
+            floor = summary["covered"] if summary else 0
+            return _window_start(turns, sizes, floor, budget - system_tokens - summary_tokens), summary_tokens
+
+        start, summary_tokens = window(summary)
+        if summarize and start - (summary["covered"] if summary else 0) >= self.batch:
+            summary = self._refresh_summary(provider, model, session_id, turns, summary, start)
+            start, summary_tokens = window(summary)
+
+        messages = turns[start:]
+        if system or summary:
+            content = with_summary(system["content"] if system else "", summary and summary["text"])
+            messages = [{**(system or {"role": "system"}), "content": content}, *extra_system, *messages]
+
+        covered = summary["covered"] if summary else 0
+        info = {
+            "limit": context_limit(provider, model),
+            "budget": budget,
+            "tokens": system_tokens + summary_tokens + sum(sizes[start:]),
+            "sent": len(turns) - start,
+            "dropped": start - covered,
+            "summarized": covered,
+        }
+        return messages, info
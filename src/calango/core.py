@@ -1,18 +1,67 @@
+import asyncio
 import os
 
 from dotenv import load_dotenv
-from litellm import completion
+from litellm import acompletion, completion
 
+from calango.context_window import SUMMARY_MAX_TOKENS
 from calango.database import ConfigManager, InteractionManager, SessionManager
+from calango.response_cache import RESPONSE_CACHE_ENABLED, ResponseCache, cache_key, replay_chunks
+from calango.semantic_cache import SEMANTIC_CACHE_ENABLED, cache_scope, get_semantic_cache, semantic_query
+from calango.tokenizer import count_tokens
 
 load_dotenv()
 
+# Ask providers to report real token usage in the final stream chunk
+STREAM_OPTIONS = {"include_usage": True}
+# Parameters of every completion call (also part of the response cache key)
+COMPLETION_PARAMS = {"stream": True, "stream_options": STREAM_OPTIONS, "drop_params": True}
+# Usage reported for replies served from the response cache: no tokens were billed
+CACHED_USAGE = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "cached": True}
+SUMMARY_INSTRUCTIONS = (
+    "Summarize the conversation below for your own future reference. Keep facts, decisions, names, "
+    "numbers and open questions; drop pleasantries. Write in the conversation's language, at most {words} words."
+)
+
+
+class MockUsage:
+    def __init__(self, prompt_tokens=0, completion_tokens=0):
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+
+
+class MockMessage:
+    def __init__(self, content):
+        self.content = content
+
+
+class MockChoice:
+    def __init__(self, content):
+        self.message = MockMessage(content)
+
+
+class MockResponse:
+    """Mimics a litellm response so streamed replies can be logged like regular ones."""
+
+    def __init__(self, content, model, usage=None):
+        self.usage = MockUsage(usage["prompt_tokens"], usage["completion_tokens"]) if usage else MockUsage()
+        self.choices = [MockChoice(content)]
+        self.model = model
+
 
 class CalangoEngine:
-    def __init__(self):
+    def __init__(self, response_cache=None, semantic_cache=None):
         self.config = ConfigManager()
         self.memory = InteractionManager()
         self.sessions = SessionManager()
+        # Opt-in (CALANGO_RESPONSE_CACHE=1): identical requests are answered from disk
+        if response_cache is None and RESPONSE_CACHE_ENABLED:
+            response_cache = ResponseCache()
+        self.response_cache = response_cache
+        # Opt-in (CALANGO_SEMANTIC_CACHE=1): near-identical opening questions reuse a reply
+        if semantic_cache is None and SEMANTIC_CACHE_ENABLED:
+            semantic_cache = get_semantic_cache()
+        self.semantic_cache = semantic_cache
 
     def get_configured_providers(self):
         return [p["name"] for p in self.config.config_table.all()]
@@ -21,7 +70,11 @@ class CalangoEngine:
         provider = self.config.get_provider(provider_name)
         return provider.get("models", []) if provider else []
 
-    def run_chat(self, provider_name, model_name, messages, session_id, persona_name, is_new_session=False):
+    def _resolve_provider(self, provider_name, model_name):
+        """
+        Resolves the litellm model string and API key for a provider.
+        Environment variables take precedence over keys stored in the config table.
+        """
         provider_data = self.config.get_provider(provider_name)
 
         if provider_name.lower() in ["google", "gemini"]:
@@ -36,13 +89,188 @@ class CalangoEngine:
             if provider_data:
                 api_key = provider_data.get("api_key")
 
-        api_messages = [
-            {"role": m["role"], "content": m["content"]} for m in messages if "role" in m and "content" in m
-        ]
+        return f"{prefix}/{model_name}", api_key
+
+    @staticmethod
+    def _api_messages(messages):
+        return [{"role": m["role"], "content": m["content"]} for m in messages if "role" in m and "content" in m]
+
+    @staticmethod
+    def _error_message(error, provider_name, model_name):
+        """Provide user-friendly error messages."""
+        err_str = str(error).lower()
+
+        if "model" in err_str and "not found" in err_str and provider_name.lower() == "ollama":
+            return f"Error: Modelo local '{model_name}' não encontrado.\n"
+        elif any(k in err_str for k in ["quota", "429", "rate limit"]):
+            return f"Error: Cota excedida. Limite de uso atingido para {provider_name}/{model_name}."
+        elif "connection" in err_str.lower() and provider_name.lower() == "ollama":
+            return "Error: Não foi possível conectar ao Ollama.\n\nCertifique-se de que o Ollama está rodando:\n"
+        return f"Error: {str(error)}"
+
+    @staticmethod
+    def _chunk_content(chunk):
+        # The usage-only chunk at the end of a stream may carry no choices
+        return (chunk.choices[0].delta.content or "") if chunk.choices else ""
+
+    @staticmethod
+    def _reported_usage(chunk):
+        """Returns the provider-reported usage carried by a stream chunk, if any."""
+        usage = getattr(chunk, "usage", None)
+        prompt_tokens = getattr(usage, "prompt_tokens", None)
+        completion_tokens = getattr(usage, "completion_tokens", None)
+        if not isinstance(prompt_tokens, int) or not isinstance(completion_tokens, int):
+            return None
+        if not (prompt_tokens or completion_tokens):
+            return None
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+
+    def _update_title(self, messages, session_id):
+        if len(messages) > 0:
+            first_prompt = messages[-1]["content"]
+            new_title = (first_prompt[:30] + "..") if len(first_prompt) > 30 else first_prompt
+            self.sessions.update_session_title(session_id, new_title)
+
+    def _semantic_query(self, api_messages, opening_turn=None):
+        """
+        The question to look up in the semantic cache, if any. opening_turn=False vetoes
+        requests whose messages were cut from a longer conversation: a follow-up may look
+        like an opening question once the turns before it are trimmed.
+        """
+        if self.semantic_cache is None or opening_turn is False:
+            return None
+        return semantic_query(api_messages)
+
+    def _cache_lookup(self, provider_name, model_name, persona_name, api_messages, opening_turn=None):
+        """
+        Returns (key, cached entry or None). The exact response cache is tried first, then
+        the semantic cache; the key is None when the response cache is disabled. A cache that
+        fails to read counts as a miss, so the request still goes to the provider.
+        """
+        key = None
+        if self.response_cache is not None:
+            key = cache_key(provider_name, model_name, api_messages, COMPLETION_PARAMS)
+            try:
+                cached = self.response_cache.get(key)
+            except Exception as e:
+                print(f"⚠️ Response cache lookup failed: {e}")
+                cached = None
+            if cached:
+                return key, cached
+
+        query = self._semantic_query(api_messages, opening_turn)
+        if query:
+            try:
+                return key, self.semantic_cache.lookup(cache_scope(provider_name, model_name, persona_name), query)
+            except Exception as e:
+                print(f"⚠️ Semantic cache lookup failed: {e}")
+        return key, None
+
+    def _cache_store(
+        self, key, provider_name, model_name, persona_name, api_messages, content, usage, opening_turn=None
+    ):
+        """Stores a streamed reply; a failed write only costs the next cache hit, never the reply."""
+        if key:
+            try:
+                self.response_cache.put(key, provider_name, model_name, content, usage)
+            except Exception as e:
+                print(f"⚠️ Response cache store failed: {e}")
+
+        query = self._semantic_query(api_messages, opening_turn)
+        if query:
+            if usage:
+                saved_tokens = usage["total_tokens"]
+            else:
+                prompt = "".join(m["content"] for m in api_messages)
+                saved_tokens = count_tokens(prompt, model_name) + count_tokens(content, model_name)
+            scope = cache_scope(provider_name, model_name, persona_name)
+            try:
+                self.semantic_cache.add(scope, query, content, saved_tokens)
+            except Exception as e:
+                print(f"⚠️ Semantic cache store failed: {e}")
+
+    def summarize(self, provider_name, model_name, messages, previous_summary="", max_tokens=SUMMARY_MAX_TOKENS):
+        """
+        Condenses chat turns (extending previous_summary) with a non-streaming call to the
+        same model; used by the context window for turns that no longer fit. Raises on errors.
+        The call is not logged as an interaction.
+        """
+        full_model_string, api_key = self._resolve_provider(provider_name, model_name)
+        if not api_key:
+            raise ValueError(f"No API key found for {provider_name}.")
+
+        transcript = "\n\n".join(f"{m['role']}: {m['content']}" for m in self._api_messages(messages))
+        if previous_summary:
+            transcript = f"Summary so far:\n{previous_summary}\n\nContinuation:\n{transcript}"
+        response = completion(
+            model=full_model_string,
+            messages=[
+                {"role": "system", "content": SUMMARY_INSTRUCTIONS.format(words=max_tokens * 3 // 4)},
+                {"role": "user", "content": transcript},
+            ],
+            api_key=api_key,
+            max_tokens=max_tokens,
+            drop_params=True,
+        )
+        return response.choices[0].message.content or ""
 
-        full_model_string = f"{prefix}/{model_name}"
+    def _log(
+        self,
+        provider_name,
+        model_name,
+        messages,
+        full_content,
+        session_id,
+        persona_name,
+        interaction_id,
+        usage,
+        cached=False,
+    ):
+        # Always log interaction, even on errors
+        if full_content:  # Only log if there's content (success or error)
+            self.memory.log_interaction(
+                provider=provider_name,
+                model=model_name,
+                messages=messages,
+                response=MockResponse(full_content, model_name, usage),
+                session_id=session_id,
+                persona=persona_name,
+                cost=0.0,
+                record_id=interaction_id,
+                cached=cached,
+            )
+
+    def run_chat(
+        self,
+        provider_name,
+        model_name,
+        messages,
+        session_id,
+        persona_name,
+        is_new_session=False,
+        interaction_id=None,
+        on_usage=None,
+        opening_turn=None,
+    ):
+        """
+        Streams a reply and logs the interaction when the stream ends.
+        Callers may pass interaction_id to know which history record to patch afterwards.
+        When the provider reports token usage, it is logged and handed to on_usage(usage),
+        so callers can skip counting tokens locally. Replies served from the response or
+        semantic cache are replayed as a stream and reported with CACHED_USAGE. Callers that
+        trimmed the conversation pass opening_turn=False so a follow-up never goes through the
+        semantic cache; by default it is judged from the messages.
+        """
+        full_model_string, api_key = self._resolve_provider(provider_name, model_name)
+        api_messages = self._api_messages(messages)
 
         full_content = ""
+        usage = None
+        cached = None
 
         try:
             # Check for API key and handle as an error (so it gets logged)
@@ -50,64 +278,141 @@ class CalangoEngine:
                 full_content = f"Error: No API key found for {provider_name}."
                 yield full_content
             else:
-                stream = completion(model=full_model_string, messages=api_messages, api_key=api_key, stream=True)
-                for chunk in stream:
-                    content = chunk.choices[0].delta.content or ""
-                    if content:
+                key, cached = self._cache_lookup(provider_name, model_name, persona_name, api_messages, opening_turn)
+                if cached:
+                    usage = dict(CACHED_USAGE)
+                    for content in replay_chunks(cached["content"]):
                         full_content += content
                         yield content
+                else:
+                    stream = completion(
+                        model=full_model_string, messages=api_messages, api_key=api_key, **COMPLETION_PARAMS
+                    )
+                    for chunk in stream:
+                        usage = self._reported_usage(chunk) or usage
+                        content = self._chunk_content(chunk)
+                        if content:
+                            full_content += content
+                            yield content
+
+                    if full_content:
+                        self._cache_store(
+                            key,
+                            provider_name,
+                            model_name,
+                            persona_name,
+                            api_messages,
+                            full_content,
+                            usage,
+                            opening_turn,
+                        )
+
+                if usage and on_usage:
+                    on_usage(usage)
 
-                if is_new_session and len(messages) > 0:
-                    first_prompt = messages[-1]["content"]
-                    new_title = (first_prompt[:30] + "..") if len(first_prompt) > 30 else first_prompt
-                    self.sessions.update_session_title(session_id, new_title)
+                if is_new_session:
+                    self._update_title(messages, session_id)
 
         except Exception as e:
-            err_str = str(e).lower()
-
-            # Provide user-friendly error messages
-            if "model" in err_str and "not found" in err_str and provider_name.lower() == "ollama":
-                error_msg = f"Error: Modelo local '{model_name}' não encontrado.\n"
-            elif any(k in err_str for k in ["quota", "429", "rate limit"]):
-                error_msg = f"Error: Cota excedida. Limite de uso atingido para {provider_name}/{model_name}."
-            elif "connection" in err_str.lower() and provider_name.lower() == "ollama":
-                error_msg = (
-                    "Error: Não foi possível conectar ao Ollama.\n\nCertifique-se de que o Ollama está rodando:\n"
-                )
+            error_msg = self._error_message(e, provider_name, model_name)
+            full_content = error_msg
+            yield error_msg
+
+        finally:
+            self._log(
+                provider_name,
+                model_name,
+                messages,
+                full_content,
+                session_id,
+                persona_name,
+                interaction_id,
+                usage,
+                cached=bool(cached),
+            )
+
+    async def run_chat_async(
+        self,
+        provider_name,
+        model_name,
+        messages,
+        session_id,
+        persona_name,
+        is_new_session=False,
+        interaction_id=None,
+        on_usage=None,
+        opening_turn=None,
+    ):
+        """
+        Async counterpart of run_chat, built on litellm's acompletion.
+        Yields the same chunks and error strings, so many chats can share one event loop.
+        Database writes are pushed to a worker thread to keep the loop responsive.
+        """
+        full_model_string, api_key = await asyncio.to_thread(self._resolve_provider, provider_name, model_name)
+        api_messages = self._api_messages(messages)
+
+        full_content = ""
+        usage = None
+        cached = None
+
+        try:
+            if not api_key:
+                full_content = f"Error: No API key found for {provider_name}."
+                yield full_content
             else:
-                error_msg = f"Error: {str(e)}"
+                key, cached = await asyncio.to_thread(
+                    self._cache_lookup, provider_name, model_name, persona_name, api_messages, opening_turn
+                )
+                if cached:
+                    usage = dict(CACHED_USAGE)
+                    for content in replay_chunks(cached["content"]):
+                        full_content += content
+                        yield content
+                else:
+                    stream = await acompletion(
+                        model=full_model_string, messages=api_messages, api_key=api_key, **COMPLETION_PARAMS
+                    )
+                    async for chunk in stream:
+                        usage = self._reported_usage(chunk) or usage
+                        content = self._chunk_content(chunk)
+                        if content:
+                            full_content += content
+                            yield content
+
+                    if full_content:
+                        await asyncio.to_thread(
+                            self._cache_store,
+                            key,
+                            provider_name,
+                            model_name,
+                            persona_name,
+                            api_messages,
+                            full_content,
+                            usage,
+                            opening_turn,
+                        )
+
+                if usage and on_usage:
+                    on_usage(usage)
 
+                if is_new_session:
+                    await asyncio.to_thread(self._update_title, messages, session_id)
+
+        except Exception as e:
+            error_msg = self._error_message(e, provider_name, model_name)
             full_content = error_msg
             yield error_msg
 
         finally:
-            # Always log interaction, even on errors
-            class MockUsage:
-                def __init__(self):
-                    self.prompt_tokens = 0
-                    self.completion_tokens = 0
-
-            class MockMessage:
-                def __init__(self, content):
-                    self.content = content
-
-            class MockChoice:
-                def __init__(self, content):
-                    self.message = MockMessage(content)
-
-            class MockResponse:
-                def __init__(self, content, model):
-                    self.usage = MockUsage()
-                    self.choices = [MockChoice(content)]
-                    self.model = model
-
-            if full_content:  # Only log if there's content (success or error)
-                self.memory.log_interaction(
-                    provider=provider_name,
-                    model=model_name,
-                    messages=messages,
-                    response=MockResponse(full_content, model_name),
-                    session_id=session_id,
-                    persona=persona_name,
-                    cost=0.0,
-                )
+            await asyncio.to_thread(
+                self._log,
+                provider_name,
+                model_name,
+                messages,
+                full_content,
+                session_id,
+                persona_name,
+                interaction_id,
+                usage,
+                cached=bool(cached),
+            )
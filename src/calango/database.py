@@ -1,14 +1,29 @@
+import atexit
+import hashlib
+import heapq
+import itertools
 import json
 import os
+import queue
 import re
+import sqlite3
+import threading
 import uuid
-from datetime import datetime
+from collections import Counter, OrderedDict
+from datetime import datetime, timedelta
 from pathlib import Path
 
 import yaml
 from dotenv import load_dotenv
 from pydantic import BaseModel, ValidationError
 from tinydb import Query, TinyDB
+from tinydb.storages import JSONStorage
+from tinydb.table import Document, Table
+
+from calango import archive
+from calango.search import HistorySearchIndex
+
+load_dotenv()
 
 APP_NAME = ".calango"
 
@@ -17,10 +32,61 @@ APP_DIR = BASE_DIR / APP_NAME
 APP_DIR.mkdir(parents=True, exist_ok=True)
 DB_PATH = Path(APP_DIR, "calango.json")
 
+# Storage engine for the app databases: "tinydb" (default, JSON files) or "sqlite"
+STORAGE_BACKEND = os.getenv("CALANGO_STORAGE", "tinydb").lower()
+
 # Project root directory (where sample_config.yaml is located)
 PROJECT_ROOT = Path(__file__).parent.parent.parent
 SAMPLE_CONFIG_PATH = PROJECT_ROOT / "sample_config.yaml"
 
+# Shared database handles, one per file (see open_database)
+_DATABASES = {}
+_WRITERS = {}
+_ROLLUPS = {}
+_TRANSCRIPTS = {}
+_BLOBS = {}
+_SEARCH = {}
+# SQLite files of the side caches (e.g. the response cache): path -> (connection, lock)
+_CONNECTIONS = {}
+_REGISTRY_LOCK = threading.RLock()
+
+# Interaction logging is buffered and written by a background thread unless disabled
+WRITE_BEHIND = os.getenv("CALANGO_WRITE_BEHIND", "1") != "0"
+WRITE_BEHIND_MAX_QUEUE = int(os.getenv("CALANGO_WRITE_BEHIND_QUEUE", "1000"))
+# Failed attempts at storing a buffered record before it is given up
+WRITE_BEHIND_ATTEMPTS = int(os.getenv("CALANGO_WRITE_BEHIND_ATTEMPTS", "3"))
+# Recently written records whose doc_id is remembered so usage patches are keyed lookups
+RECENT_DOC_IDS = 1024
+
+# Sessions listed per page in the sidebar
+SESSION_PAGE_SIZE = int(os.getenv("CALANGO_SESSION_PAGE_SIZE", "30"))
+
+# History records written by log_interaction. Version 2 stores only the new user turn and a
+# reference to its context (system prompt id + number of earlier turns) instead of the full
+# "messages" list, which made every record as large as the conversation so far.
+HISTORY_SCHEMA_VERSION = 2
+
+# Texts stored once in the blobs table and referenced by hash: system prompts always,
+# user turns from this length on (shorter ones are cheaper inline than as a reference)
+BLOB_MIN_CHARS = 256
+BLOB_CACHE_SIZE = 256
+
+# Sessions last active more than this many days ago are moved to compressed monthly archives
+# on startup (0 disables it; `python -m calango.archive` runs it on demand)
+ARCHIVE_AFTER_DAYS = int(os.getenv("CALANGO_ARCHIVE_AFTER_DAYS", "0"))
+
+# Formatted transcripts of recently opened sessions kept in memory
+TRANSCRIPT_CACHE_SIZE = int(os.getenv("CALANGO_TRANSCRIPT_CACHE", "32"))
+
+# Usage rollups (day x provider x model x persona) kept next to the history table
+ROLLUP_TABLE = "usage_rollup"
+ROLLUP_DIMENSIONS = ("day", "provider", "model", "persona")
+ROLLUP_METRICS = ("count", "prompt_tokens", "completion_tokens", "total_tokens", "cost_usd")
+# History fields the rollup is computed from
+ROLLUP_SOURCE_FIELDS = ("timestamp", "provider", "model", "persona", "usage", "total_tokens", "cost_usd")
+ROLLUP_META_KEY = "__meta__"
+ROLLUP_VERSION = 1
+
 
 # --- Data Models (Pydantic) ---
 class ProviderModel(BaseModel):
@@ -32,26 +98,1159 @@ class ConfigFileModel(BaseModel):
     providers: dict[str, ProviderModel]
 
 
+class SharedJSONStorage(JSONStorage):
+    """
+    JSON storage that keeps the parsed file in memory and writes through on every change.
+    The file is only parsed again when another process modifies it (mtime/size change).
+    """
+
+    def __init__(self, path, **kwargs):
+        super().__init__(path, **kwargs)
+        self.lock = threading.RLock()
+        self.generation = 0
+        self._data = None
+        self._stamp = None
+
+    def _file_stamp(self):
+        stat = os.fstat(self._handle.fileno())
+        return stat.st_mtime_ns, stat.st_size
+
+    def read(self):
+        with self.lock:
+            stamp = self._file_stamp()
+            # Compare stamps only: an empty file parses to None and must not count as unloaded
+            if self._stamp is None or stamp != self._stamp:
+                self._data = super().read()
+                self._stamp = stamp
+                self.generation += 1
+            return self._data
+
+    def write(self, data):
+        with self.lock:
+            try:
+                super().write(data)
+            except Exception:
+                self._stamp = None
+                raise
+            self._data = data
+            self._stamp = self._file_stamp()
+
+
+class LockedTable(Table):
+    """
+    TinyDB table that is safe to share between threads.
+    Reads return a snapshot and writes are serialized on the storage lock.
+    """
+
+    # Results can't be cached safely when other processes may write to the same file
+    default_query_cache_capacity = 0
+
+    def __init__(self, storage, name, **kwargs):
+        super().__init__(storage, name, **kwargs)
+        self._generation = None
+
+    def _read_table(self):
+        with self._storage.lock:
+            return dict(super()._read_table())
+
+    def _update_table(self, updater):
+        with self._storage.lock:
+            super()._update_table(updater)
+
+    def _get_next_id(self):
+        with self._storage.lock:
+            # Another process may have inserted documents since the last cached id
+            self._storage.read()
+            if self._generation != self._storage.generation:
+                self._generation = self._storage.generation
+                self._next_id = None
+            return super()._get_next_id()
+
+    def insert(self, document):
+        with self._storage.lock:
+            return super().insert(document)
+
+    def insert_multiple(self, documents):
+        with self._storage.lock:
+            return super().insert_multiple(documents)
+
+    def upsert(self, document, cond=None):
+        with self._storage.lock:
+            return super().upsert(document, cond)
+
+    def search_page(self, cond=None, order_by=None, descending=False, limit=None, offset=0):
+        """One page of matching documents sorted by a field (doc_id breaks ties); see SQLiteTable."""
+        docs = self.search(cond) if cond is not None else self.all()
+
+        def sort_key(doc):
+            return (str(doc.get(order_by) or "") if order_by else "", doc.doc_id)
+
+        if limit is None:
+            return sorted(docs, key=sort_key, reverse=descending)[offset:]
+        pick = heapq.nlargest if descending else heapq.nsmallest
+        return pick(offset + limit, docs, key=sort_key)[offset:]
+
+
+class SharedTinyDB(TinyDB):
+    table_class = LockedTable
+    default_storage_class = SharedJSONStorage
+
+
 def _safe_tinydb_init(db_path):
     """
     Safely initialize TinyDB, handling corrupted database files.
     If the database file is corrupted, it will be reset.
     """
+    db = SharedTinyDB(db_path)
     try:
-        db = TinyDB(db_path)
         # Test reading the database to catch corruption errors early
         db.tables()
         return db
     except json.JSONDecodeError:
         # Database file is corrupted, reset it
+        db.close()
         if db_path.exists():
             db_path.unlink()
-        return TinyDB(db_path)
+        return SharedTinyDB(db_path)
+
+
+# --- Storage Backends ---
+# The managers only rely on the TinyDB table API (insert/search/get/update/upsert/remove),
+# so the SQLite backend implements that same surface on top of a JSON document column.
+# Equality/range queries on indexed fields are pushed down to SQL; anything else falls
+# back to evaluating the TinyDB query in Python.
+
+# Fields with an expression index per table (json_extract on the document column)
+INDEXED_FIELDS = {
+    "history": ("id", "session_id", "timestamp", "model", "provider", "persona"),
+    "sessions": ("id", "created_at"),
+    "config": ("name",),
+    "personas": ("name",),
+    "settings": ("section",),
+    "blobs": ("id",),
+    "archived_sessions": ("id", "created_at"),
+    ROLLUP_TABLE: ("key",),
+}
+
+_SQL_OPERATORS = {"==": "=", "<": "<", "<=": "<=", ">": ">", ">=": ">="}
+_SIMPLE_FIELD = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+def _json_path(fields):
+    """Builds the json_extract expression for a document path, or None if it can't be inlined safely."""
+    if not fields or not all(isinstance(f, str) and _SIMPLE_FIELD.match(f) for f in fields):
+        return None
+    return "json_extract(data, '$." + ".".join(fields) + "')"
+
+
+def _compile_query(query_hash):
+    """
+    Translates a TinyDB query hash into a SQL WHERE clause that selects a superset of
+    the matching documents. Returns (clause, params) or None when it can't be translated.
+    """
+    if not query_hash:
+        return None
+
+    op = query_hash[0]
+    if op in _SQL_OPERATORS:
+        _, fields, value = query_hash
+        expr = _json_path(fields)
+        if expr is None or isinstance(value, bool) or not isinstance(value, str | int | float):
+            return None
+        return f"{expr} {_SQL_OPERATORS[op]} ?", [value]
+
+    if op == "one_of":
+        _, fields, values = query_hash
+        expr = _json_path(fields)
+        if expr is None or not values or not all(isinstance(v, str | int | float) for v in values):
+            return None
+        if any(isinstance(v, bool) for v in values):
+            return None
+        return f"{expr} IN ({', '.join('?' for _ in values)})", list(values)
+
+    if op == "exists":
+        expr = _json_path(query_hash[1])
+        return (f"json_type(data, '$.{'.'.join(query_hash[1])}') IS NOT NULL", []) if expr else None
+
+    if op in ("and", "or"):
+        compiled = [_compile_query(sub) for sub in query_hash[1]]
+        if op == "and":
+            # Any translatable branch narrows the candidates; the rest is checked in Python
+            compiled = [c for c in compiled if c is not None]
+            if not compiled:
+                return None
+        elif any(c is None for c in compiled):
+            return None
+        joiner = " AND " if op == "and" else " OR "
+        clause = joiner.join(f"({c[0]})" for c in compiled)
+        params = [p for c in compiled for p in c[1]]
+        return clause, params
+
+    return None
+
+
+def _is_exact(query_hash):
+    """True when the SQL translation of a query matches exactly the documents the query would."""
+    if not query_hash:
+        return False
+    op = query_hash[0]
+    if op == "==":
+        return _compile_query(query_hash) is not None and isinstance(query_hash[2], str)
+    if op == "one_of":
+        return _compile_query(query_hash) is not None and all(isinstance(v, str) for v in query_hash[2])
+    if op in ("and", "or"):
+        return all(_is_exact(sub) for sub in query_hash[1])
+    return False
+
+
+class SQLiteTable:
+    """TinyDB-compatible table stored as JSON documents in a SQLite table."""
+
+    def __init__(self, database, name):
+        self._db = database
+        self.name = name
+        self._sql_name = '"' + name.replace('"', '""') + '"'
+
+        with self._db.lock, self._db.conn:
+            self._db.conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self._sql_name} "
+                "(doc_id INTEGER PRIMARY KEY AUTOINCREMENT, data TEXT NOT NULL)"
+            )
+            for field in INDEXED_FIELDS.get(name, ()):
+                index_name = '"' + f"ix_{name}_{field}".replace('"', '""') + '"'
+                self._db.conn.execute(
+                    f"CREATE INDEX IF NOT EXISTS {index_name} ON {self._sql_name} ({_json_path((field,))})"
+                )
+
+    def __repr__(self):
+        return f"<SQLiteTable name={self.name!r}, total={len(self)}>"
+
+    # --- Internal helpers ---
+    def _select(self, cond=None, doc_ids=None):
+        sql = f"SELECT doc_id, data FROM {self._sql_name}"
+        params = []
+        clauses = []
+
+        if doc_ids is not None:
+            doc_ids = list(doc_ids)
+            if not doc_ids:
+                return []
+            clauses.append(f"doc_id IN ({', '.join('?' for _ in doc_ids)})")
+            params.extend(doc_ids)
+
+        if cond is not None:
+            compiled = _compile_query(getattr(cond, "_hash", None))
+            if compiled:
+                clauses.append(compiled[0])
+                params.extend(compiled[1])
+
+        if clauses:
+            sql += " WHERE " + " AND ".join(f"({c})" for c in clauses)
+        sql += " ORDER BY doc_id"
+
+        with self._db.lock:
+            rows = self._db.conn.execute(sql, params).fetchall()
+
+        docs = [Document(json.loads(data), doc_id) for doc_id, data in rows]
+        if cond is not None:
+            docs = [doc for doc in docs if cond(doc)]
+        return docs
+
+    def _write(self, docs):
+        with self._db.lock, self._db.conn:
+            self._db.conn.executemany(
+                f"UPDATE {self._sql_name} SET data = ? WHERE doc_id = ?",
+                [(json.dumps(dict(doc), ensure_ascii=False), doc.doc_id) for doc in docs],
+            )
+
+    # --- TinyDB Table API ---
+    def insert(self, document):
+        return self.insert_multiple([document])[0]
+
+    def insert_multiple(self, documents):
+        doc_ids = []
+        with self._db.lock, self._db.conn:
+            for document in documents:
+                payload = json.dumps(dict(document), ensure_ascii=False)
+                explicit_id = getattr(document, "doc_id", None)
+                if explicit_id is not None:
+                    self._db.conn.execute(
+                        f"INSERT INTO {self._sql_name} (doc_id, data) VALUES (?, ?)", (explicit_id, payload)
+                    )
+                    doc_ids.append(explicit_id)
+                else:
+                    cursor = self._db.conn.execute(f"INSERT INTO {self._sql_name} (data) VALUES (?)", (payload,))
+                    doc_ids.append(cursor.lastrowid)
+        return doc_ids
+
+    def all(self):
+        return self._select()
+
+    def __iter__(self):
+        return iter(self.all())
+
+    def iter_documents(self, batch_size=1000):
+        """Streams documents in doc_id order without materializing the whole table."""
+        last_id = 0
+        while True:
+            with self._db.lock:
+                rows = self._db.conn.execute(
+                    f"SELECT doc_id, data FROM {self._sql_name} WHERE doc_id > ? ORDER BY doc_id LIMIT ?",
+                    (last_id, batch_size),
+                ).fetchall()
+            if not rows:
+                return
+            for doc_id, data in rows:
+                yield Document(json.loads(data), doc_id)
+            last_id = rows[-1][0]
+
+    def __len__(self):
+        with self._db.lock:
+            return self._db.conn.execute(f"SELECT COUNT(*) FROM {self._sql_name}").fetchone()[0]
+
+    def search(self, cond):
+        return self._select(cond)
+
+    def get(self, cond=None, doc_id=None, doc_ids=None):
+        if doc_id is not None:
+            docs = self._select(doc_ids=[doc_id])
+            return docs[0] if docs else None
+        if doc_ids is not None:
+            return self._select(doc_ids=doc_ids)
+        if cond is None:
+            raise RuntimeError("You have to pass either cond or doc_id or doc_ids")
+        docs = self._select(cond)
+        return docs[0] if docs else None
+
+    def contains(self, cond=None, doc_id=None):
+        if doc_id is not None:
+            return self.get(doc_id=doc_id) is not None
+        if cond is None:
+            raise RuntimeError("You have to pass either cond or doc_id")
+        return self.get(cond) is not None
+
+    def count(self, cond):
+        query_hash = getattr(cond, "_hash", None)
+        if not _is_exact(query_hash):
+            return len(self.search(cond))
+        clause, params = _compile_query(query_hash)
+        with self._db.lock:
+            return self._db.conn.execute(f"SELECT COUNT(*) FROM {self._sql_name} WHERE {clause}", params).fetchone()[0]
+
+    def search_page(self, cond=None, order_by=None, descending=False, limit=None, offset=0):
+        """
+        One page of matching documents sorted by a field (doc_id breaks ties).
+        When SQL selects exactly the matches, the page is cut by LIMIT/OFFSET and only its
+        rows are decoded. Otherwise rows are streamed in index order, checked in Python and
+        stop as soon as the page is full, so offset + limit matches are decoded at most.
+        """
+        sql = f"SELECT doc_id, data FROM {self._sql_name}"
+        params = []
+        query_hash = getattr(cond, "_hash", None) if cond is not None else None
+        exact = cond is None or _is_exact(query_hash)
+        if cond is not None:
+            compiled = _compile_query(query_hash)
+            if compiled:
+                sql += f" WHERE {compiled[0]}"
+                params.extend(compiled[1])
+
+        direction = "DESC" if descending else "ASC"
+        order_expr = _json_path((order_by,)) if order_by else None
+        if order_expr:
+            sql += f" ORDER BY {order_expr} {direction}, doc_id {direction}"
+        else:
+            sql += f" ORDER BY doc_id {direction}"
+
+        if exact:
+            sql += " LIMIT ? OFFSET ?"
+            params.extend([-1 if limit is None else limit, offset])
+            with self._db.lock:
+                rows = self._db.conn.execute(sql, params).fetchall()
+            return [Document(json.loads(data), doc_id) for doc_id, data in rows]
+
+        page = []
+        skipped = 0
+        with self._db.lock:
+            cursor = self._db.conn.execute(sql, params)
+            while limit is None or len(page) < limit:
+                rows = cursor.fetchmany(256)
+                if not rows:
+                    break
+                for doc_id, data in rows:
+                    doc = Document(json.loads(data), doc_id)
+                    if not cond(doc):
+                        continue
+                    if skipped < offset:
+                        skipped += 1
+                        continue
+                    page.append(doc)
+                    if limit is not None and len(page) >= limit:
+                        break
+            cursor.close()
+        return page
+
+    def update(self, fields, cond=None, doc_ids=None):
+        with self._db.lock:
+            docs = self._select(cond, doc_ids)
+            for doc in docs:
+                if callable(fields):
+                    fields(doc)
+                else:
+                    doc.update(fields)
+            self._write(docs)
+        return [doc.doc_id for doc in docs]
+
+    def upsert(self, document, cond=None):
+        with self._db.lock:
+            doc_id = getattr(document, "doc_id", None)
+            if doc_id is not None and self.contains(doc_id=doc_id):
+                return self.update(document, doc_ids=[doc_id])
+            if cond is None:
+                if doc_id is None:
+                    raise ValueError("If you don't specify a search query, you must specify a doc_id.")
+            else:
+                updated = self.update(document, cond)
+                if updated:
+                    return updated
+            return [self.insert(document)]
+
+    def remove(self, cond=None, doc_ids=None):
+        if cond is None and doc_ids is None:
+            raise RuntimeError("Use truncate() to remove all documents")
+        with self._db.lock, self._db.conn:
+            removed = [doc.doc_id for doc in self._select(cond, doc_ids)]
+            if removed:
+                self._db.conn.execute(
+                    f"DELETE FROM {self._sql_name} WHERE doc_id IN ({', '.join('?' for _ in removed)})", removed
+                )
+        return removed
+
+    def truncate(self):
+        with self._db.lock, self._db.conn:
+            self._db.conn.execute(f"DELETE FROM {self._sql_name}")
+
+    def clear_cache(self):
+        """No-op, kept for TinyDB API compatibility (SQLite does its own caching)."""
+
+
+class SQLiteDatabase:
+    """
+    TinyDB-compatible database backed by SQLite in WAL mode.
+    Unknown attributes are forwarded to the default table, like TinyDB does.
+    """
+
+    default_table_name = "_default"
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._tables = {}
+
+    def table(self, name):
+        with self.lock:
+            if name not in self._tables:
+                self._tables[name] = SQLiteTable(self, name)
+            return self._tables[name]
+
+    def tables(self):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def drop_table(self, name):
+        with self.lock, self.conn:
+            self.conn.execute('DROP TABLE IF EXISTS "' + name.replace('"', '""') + '"')
+            self._tables.pop(name, None)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def __getattr__(self, name):
+        return getattr(self.table(self.default_table_name), name)
+
+    def __len__(self):
+        return len(self.table(self.default_table_name))
+
+    def __iter__(self):
+        return iter(self.table(self.default_table_name))
+
+
+def open_database(name="calango"):
+    """
+    Returns the process-wide handle for one of the app's document stores.
+    CALANGO_STORAGE=sqlite selects SQLite (<name>.db), anything else TinyDB (<name>.json).
+    Every manager asking for the same store shares one handle, so a page render parses
+    the file at most once instead of once per manager.
+    """
+    suffix = "db" if STORAGE_BACKEND == "sqlite" else "json"
+    path = APP_DIR / f"{name}.{suffix}"
+
+    with _REGISTRY_LOCK:
+        db = _DATABASES.get(path)
+        if db is None:
+            db = SQLiteDatabase(path) if STORAGE_BACKEND == "sqlite" else _safe_tinydb_init(path)
+            _DATABASES[path] = db
+        return db
+
+
+def get_sqlite_connection(path):
+    """
+    Returns the process-wide connection to an SQLite file and the lock that serializes its
+    use. Objects rebuilt on every Streamlit rerun share it instead of opening one each time.
+    """
+    key = Path(path).resolve()
+    with _REGISTRY_LOCK:
+        shared = _CONNECTIONS.get(key)
+        if shared is None:
+            shared = (sqlite3.connect(str(key), check_same_thread=False), threading.Lock())
+            _CONNECTIONS[key] = shared
+        return shared
+
+
+def close_sqlite_connection(path):
+    """Closes the shared connection to an SQLite file, if open."""
+    with _REGISTRY_LOCK:
+        shared = _CONNECTIONS.pop(Path(path).resolve(), None)
+    if shared is not None:
+        conn, lock = shared
+        with lock:
+            conn.close()
+
+
+def close_databases():
+    """Flushes pending writes and closes every shared handle (used on shutdown and by tests)."""
+    with _REGISTRY_LOCK:
+        for writer in _WRITERS.values():
+            writer.close()
+        _WRITERS.clear()
+        _ROLLUPS.clear()
+        _TRANSCRIPTS.clear()
+        _BLOBS.clear()
+        for index in _SEARCH.values():
+            index.close()
+        _SEARCH.clear()
+        for db in _DATABASES.values():
+            db.close()
+        _DATABASES.clear()
+        for path in list(_CONNECTIONS):
+            close_sqlite_connection(path)
+
+
+def usage_tokens(record):
+    """
+    (prompt, completion, total) tokens of a history record. Reads the patched usage
+    (prompt_tokens/completion_tokens/total_tokens) and falls back to the input_tokens/
+    output_tokens that records logged before were written with.
+    """
+    usage = record.get("usage") or {}
+    prompt = usage.get("prompt_tokens") or usage.get("input_tokens") or 0
+    completion = usage.get("completion_tokens") or usage.get("output_tokens") or 0
+    total = usage.get("total_tokens") or record.get("total_tokens") or prompt + completion
+    return prompt, completion, total
+
+
+def usage_contribution(record):
+    """
+    What one history record adds to its rollup bucket.
+    Returns (key, dimensions, metrics); tokens are the reported usage until patched, cost 0 until then.
+    """
+    prompt_tokens, completion_tokens, total_tokens = usage_tokens(record)
+    dimensions = {
+        "day": str(record.get("timestamp") or "")[:10],
+        "provider": record.get("provider") or "",
+        "model": record.get("model") or "",
+        "persona": record.get("persona") or "",
+    }
+    metrics = {
+        "count": 1,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": total_tokens,
+        "cost_usd": float(record.get("cost_usd") or 0.0),
+    }
+    key = "|".join(dimensions[d] for d in ROLLUP_DIMENSIONS)
+    return key, dimensions, metrics
+
+
+class UsageRollup:
+    """
+    Pre-aggregated usage per day x provider x model x persona (tokens, cost, count).
+    Kept up to date incrementally by every history write, patch and delete, so the dashboard
+    reads a few rows per day instead of the whole history. History written before rollups
+    existed is aggregated once by ensure_backfilled().
+    """
+
+    def __init__(self, db):
+        self.table = db.table(ROLLUP_TABLE)
+        # Held around history writes + rollup updates, so a backfill never counts a record twice
+        self.lock = threading.RLock()
+
+    def apply(self, added=(), removed=()):
+        """Adds the contribution of `added` records and subtracts the one of `removed` records."""
+        deltas = {}
+        for sign, records in ((1, added), (-1, removed)):
+            for record in records:
+                key, dimensions, metrics = usage_contribution(record)
+                bucket = deltas.setdefault(key, (dimensions, dict.fromkeys(ROLLUP_METRICS, 0)))[1]
+                for metric, value in metrics.items():
+                    bucket[metric] += sign * value
+
+        Rollup = Query()
+        with self.lock:
+            for key, (dimensions, metrics) in deltas.items():
+                if not any(metrics.values()):
+                    continue
+                row = self.table.get(Rollup.key == key)
+                if row is None:
+                    if metrics["count"] > 0:
+                        self.table.insert({"key": key, **dimensions, **metrics})
+                    continue
+                totals = {metric: row.get(metric, 0) + value for metric, value in metrics.items()}
+                if totals["count"] <= 0:
+                    # Every record of the bucket was deleted
+                    self.table.remove(doc_ids=[row.doc_id])
+                else:
+                    self.table.update(totals, doc_ids=[row.doc_id])
+
+    def rebuild(self, history_table):
+        """Recomputes every bucket from the raw history and the archived sessions (one pass)."""
+        with self.lock:
+            # Writers apply their batches under the same lock, so nothing is counted twice
+            docs = history_table.iter_documents() if hasattr(history_table, "iter_documents") else history_table
+            archived = archive.iter_interactions(APP_DIR / "archive")
+            buckets = {}
+            for record in itertools.chain(docs, archived):
+                key, dimensions, metrics = usage_contribution(record)
+                bucket = buckets.setdefault(key, {"key": key, **dimensions, **dict.fromkeys(ROLLUP_METRICS, 0)})
+                for metric, value in metrics.items():
+                    bucket[metric] += value
+
+            self.table.truncate()
+            self.table.insert_multiple([*buckets.values(), {"key": ROLLUP_META_KEY, "version": ROLLUP_VERSION}])
+
+    def ensure_backfilled(self, history_table):
+        Rollup = Query()
+        with self.lock:
+            meta = self.table.get(Rollup.key == ROLLUP_META_KEY)
+            if meta is None or meta.get("version") != ROLLUP_VERSION:
+                self.rebuild(history_table)
+
+    def rows(self):
+        return [row for row in self.table.all() if row.get("key") != ROLLUP_META_KEY]
+
+
+def get_usage_rollup(db):
+    """Returns the shared rollup maintainer for a database handle."""
+    with _REGISTRY_LOCK:
+        rollup = _ROLLUPS.get(id(db))
+        if rollup is None:
+            rollup = UsageRollup(db)
+            _ROLLUPS[id(db)] = rollup
+        return rollup
+
+
+def blob_id(text):
+    """Content address of a text in the blobs table."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class BlobStore:
+    """
+    Content-addressed text store (sha256 -> text) for prompts repeated across records, such
+    as persona system prompts and Rinha prompts sent to every fighter. New texts are kept in
+    memory until flush(), which the interaction writer calls right before writing the records
+    that reference them. Reads go through a small LRU since stored texts never change.
+    """
+
+    def __init__(self, db, cache_size=BLOB_CACHE_SIZE):
+        self.table = db.table("blobs")
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = {}  # id -> text not written yet
+        self._cache = OrderedDict()  # id -> text
+
+    def put(self, text):
+        """Registers a text and returns its id. Writing is deferred to flush()."""
+        key = blob_id(text)
+        with self._lock:
+            if key not in self._cache and key not in self._pending:
+                self._pending[key] = text
+        return key
+
+    def flush(self):
+        """Writes pending texts that the table doesn't already hold (one query, one insert)."""
+        with self._flush_lock:
+            with self._lock:
+                pending = dict(self._pending)
+            if not pending:
+                return
+
+            Blob = Query()
+            existing = {doc["id"] for doc in self.table.search(Blob.id.one_of(list(pending)))}
+            new_blobs = [{"id": key, "text": text} for key, text in pending.items() if key not in existing]
+            if new_blobs:
+                self.table.insert_multiple(new_blobs)
+            # Texts stay readable from _pending until they are in the table
+            with self._lock:
+                for key, text in pending.items():
+                    self._pending.pop(key, None)
+                    self._remember(key, text)
+
+    def get(self, key):
+        """Returns the text stored under an id, or None."""
+        self.prefetch([key])
+        with self._lock:
+            return self._pending.get(key) or self._cache.get(key)
+
+    def prefetch(self, keys):
+        """Loads the texts of many ids with a single query."""
+        with self._lock:
+            missing = [k for k in set(keys) if k and k not in self._cache and k not in self._pending]
+        if not missing:
+            return
+        Blob = Query()
+        docs = self.table.search(Blob.id.one_of(missing))
+        with self._lock:
+            for doc in docs:
+                self._remember(doc["id"], doc["text"])
+
+    def _remember(self, key, text):
+        self._cache[key] = text
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+
+def get_blob_store(db):
+    """Returns the shared blob store for a database handle."""
+    with _REGISTRY_LOCK:
+        blobs = _BLOBS.get(id(db))
+        if blobs is None:
+            blobs = BlobStore(db)
+            _BLOBS[id(db)] = blobs
+        return blobs
+
+
+def record_user_message(record, blobs=None):
+    """
+    The user turn of a history record, for compact (v2) and legacy full-history records.
+    Contents stored as a blob reference are rehydrated from `blobs`.
+    """
+    message = record.get("user_message")
+    if not message:
+        messages = record.get("messages")
+        return messages[-1] if messages else None
+    if "content_ref" in message and blobs is not None:
+        message = {k: v for k, v in message.items() if k != "content_ref"}
+        message["content"] = blobs.get(record["user_message"]["content_ref"]) or ""
+    return message
+
+
+def format_interaction(ix, blobs=None):
+    """Turns one history record into the user/assistant messages shown in the chat."""
+    timestamp = ix.get("timestamp", "")
+    model_info = ix.get("model", "Unknown")
+    provider_info = ix.get("provider", "Unknown")  # Metadata: Retrieve provider
+    persona_info = ix.get("persona") or "Default"
+
+    formatted_messages = []
+    user_msg = record_user_message(ix, blobs)
+    if user_msg:
+        user_entry = {
+            "role": "user",
+            "content": user_msg["content"],
+            "time": timestamp,
+            "model": model_info,
+            "provider": provider_info,  # Added provider
+            "persona": persona_info,
+        }
+        # Cached token counts let the next turn skip re-encoding old messages. They are
+        # snapshotted with the message, or patched in later (user_tokens) when counted after logging
+        user_tokens = user_msg.get("tokens") or ix.get("user_tokens")
+        if user_tokens:
+            user_entry["tokens"] = user_tokens
+        formatted_messages.append(user_entry)
+
+    assistant_entry = {
+        "role": "assistant",
+        "content": ix.get("reply", ""),
+        "time": timestamp,
+        "model": model_info,
+        "provider": provider_info,  # Added provider
+        "persona": persona_info,
+    }
+    if ix.get("reply_tokens"):
+        assistant_entry["tokens"] = ix["reply_tokens"]
+    formatted_messages.append(assistant_entry)
+    return formatted_messages
+
+
+def search_entries(record, blobs=None):
+    """The (record_id, role, session_id, timestamp, content) rows a history record adds to the search index."""
+    user_msg = record_user_message(record, blobs)
+    base = (record.get("session_id"), record.get("timestamp"))
+    if user_msg and user_msg.get("content"):
+        yield (record["id"], "user", *base, user_msg["content"])
+    if record.get("reply"):
+        yield (record["id"], "assistant", *base, record["reply"])
+
+
+def get_search_index(db):
+    """
+    Returns the shared full-text index of a database's history. It lives next to the database
+    file (e.g. calango.json.search.db), so each backend and store gets its own.
+    """
+    with _REGISTRY_LOCK:
+        index = _SEARCH.get(id(db))
+        if index is None:
+            path = next((path for path, known in _DATABASES.items() if known is db), APP_DIR / "calango")
+            path.parent.mkdir(parents=True, exist_ok=True)
+            index = HistorySearchIndex(path.with_name(f"{path.name}.search.db"))
+            _SEARCH[id(db)] = index
+        return index
+
+
+def index_records(index, records, blobs):
+    """
+    Adds history records to a search index. A failure never fails the write that stored them:
+    the index is flagged for a rebuild instead.
+    """
+    try:
+        index.add(entry for record in records for entry in search_entries(record, blobs))
+    except Exception as e:
+        print(f"⚠️ Search index update failed, it will be rebuilt: {e}")
+        index.mark_dirty()
+
+
+def ensure_search_index(db):
+    """The search index of db, built from the history and the archive on first use."""
+    index = get_search_index(db)
+    if not index.is_built():
+        history = db.table("history")
+        flush_interactions(history)
+        blobs = get_blob_store(db)
+        docs = history.iter_documents() if hasattr(history, "iter_documents") else history
+        archived = archive.iter_interactions(APP_DIR / "archive")
+        index.rebuild(entry for record in itertools.chain(docs, archived) for entry in search_entries(record, blobs))
+    return index
+
+
+class TranscriptCache:
+    """
+    LRU of formatted session transcripts (the output of SessionManager.get_messages).
+    New interactions extend a cached transcript in place and session deletes drop it, so
+    reopening a recent conversation doesn't touch the history table.
+    """
+
+    def __init__(self, maxsize=TRANSCRIPT_CACHE_SIZE, blobs=None):
+        self.maxsize = maxsize
+        self.blobs = blobs
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()  # session id -> formatted messages
+        # Guards against stale fills: every change ticks the clock. The last change of at most
+        # maxsize sessions is remembered; older ones only raise the floor.
+        self._clock = 0
+        self._changes = OrderedDict()  # session id -> clock of its last change, most recent last
+        self._floor = 0
+        self._replies = {}  # record id -> (session id, cached entries of the turn), for usage patches
+
+    def version(self, session_id):
+        """Ticket to pass to put() for a transcript of session_id read from storage after this call."""
+        with self._lock:
+            return self._clock
+
+    def _changed(self, session_id):
+        self._clock += 1
+        self._changes[session_id] = self._clock
+        self._changes.move_to_end(session_id)
+        while len(self._changes) > max(self.maxsize, 1):
+            _, self._floor = self._changes.popitem(last=False)
+
+    def get(self, session_id):
+        """Returns a copy of the cached transcript, or None."""
+        with self._lock:
+            messages = self._sessions.get(session_id)
+            if messages is None:
+                return None
+            self._sessions.move_to_end(session_id)
+            return [dict(m) for m in messages]
+
+    def put(self, session_id, messages, version):
+        """Caches a transcript read from storage, unless the session changed while it was read."""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            if self._changes.get(session_id, self._floor) > version:
+                return
+            self._sessions[session_id] = [dict(m) for m in messages]
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.maxsize:
+                evicted, _ = self._sessions.popitem(last=False)
+                self._forget_replies(evicted)
+
+    def append(self, record):
+        """Extends the transcript of the record's session if it is cached."""
+        session_id = record.get("session_id")
+        with self._lock:
+            self._changed(session_id)
+            messages = self._sessions.get(session_id)
+            if messages is None:
+                return
+            entries = format_interaction(record, self.blobs)
+            messages.extend(entries)
+            self._replies[record["id"]] = (session_id, entries)
+
+    def patch(self, record_id, fields):
+        """Mirrors usage patches that change what get_messages returns (user/reply token counts)."""
+        if not (fields.get("user_tokens") or fields.get("reply_tokens")):
+            return
+        with self._lock:
+            cached = self._replies.get(record_id)
+            if cached is None or cached[0] not in self._sessions:
+                return
+            for entry in cached[1]:
+                tokens = fields.get("user_tokens" if entry["role"] == "user" else "reply_tokens")
+                if tokens:
+                    entry["tokens"] = tokens
+
+    def invalidate(self, session_id):
+        with self._lock:
+            self._changed(session_id)
+            self._sessions.pop(session_id, None)
+            self._forget_replies(session_id)
+
+    def _forget_replies(self, session_id):
+        for record_id in [rid for rid, (sid, _) in self._replies.items() if sid == session_id]:
+            del self._replies[record_id]
+
+
+def get_transcript_cache(db):
+    """Returns the shared transcript cache for a database handle."""
+    with _REGISTRY_LOCK:
+        cache = _TRANSCRIPTS.get(id(db))
+        if cache is None:
+            cache = TranscriptCache(blobs=get_blob_store(db))
+            _TRANSCRIPTS[id(db)] = cache
+        return cache
+
+
+class InteractionWriter:
+    """
+    Write-behind buffer for the history table.
+    Records and usage patches are queued in memory and written in batches by a background
+    thread, so finishing a reply never waits on disk I/O. The queue is bounded (producers
+    block when it is full) and everything pending is flushed on interpreter exit.
+    Records leave the buffer only once the storage accepted them: records of a failed write
+    are kept (still receiving patches) and retried with the next batch and on flush().
+    """
+
+    def __init__(self, table, rollup=None, blobs=None, search=None, max_queue=WRITE_BEHIND_MAX_QUEUE, batch_size=100):
+        self.table = table
+        self.rollup = rollup
+        self.blobs = blobs
+        self.search = search
+        self.batch_size = batch_size
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._pending = {}  # record id -> record not yet handed to the storage
+        self._failures = {}  # record id -> failed writes of a pending record
+        # record id -> (doc_id, rollup-relevant fields) of recently written records
+        self._written = OrderedDict()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="calango-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit_record(self, record):
+        with self._lock:
+            self._pending[record["id"]] = record
+        self._queue.put(("insert", record["id"]))
+
+    def submit_patch(self, record_id, fields):
+        with self._lock:
+            pending = self._pending.get(record_id)
+            if pending is not None:
+                # Not written yet: fold the patch into the queued record
+                pending.update(fields)
+                return
+        self._queue.put(("patch", record_id, fields))
+
+    def flush(self):
+        """Blocks until every queued operation has reached the storage (or failed to)."""
+        self._queue.join()
+        with self._lock:
+            retry = bool(self._failures)
+        if retry:
+            # One more attempt at records whose write failed, synchronous for the caller
+            self._queue.put(("retry",))
+            self._queue.join()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self.flush()
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+
+            batch = [item]
+            while len(batch) < self.batch_size:
+                try:
+                    next_item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if next_item is None:
+                    # Keep the stop marker for the next loop iteration
+                    self._queue.task_done()
+                    self._queue.put(None)
+                    break
+                batch.append(next_item)
+
+            try:
+                self._write(batch)
+            except Exception as e:
+                print(f"⚠️ Interaction write failed: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write(self, batch):
+        # Texts referenced by the records must be stored before the records themselves
+        if self.blobs is not None:
+            self.blobs.flush()
+        if self.rollup is None:
+            inserted, _, _ = self._write_batch(batch)
+        else:
+            with self.rollup.lock:
+                inserted, added, removed = self._write_batch(batch)
+                self.rollup.apply(added, removed)
+        if self.search is not None and inserted:
+            index_records(self.search, inserted, self.blobs)
+
+    def _write_batch(self, batch):
+        """
+        Writes a batch. Returns the inserted records and the (added, removed) record states
+        for the usage rollup.
+        """
+        with self._lock:
+            ids = [*self._failures, *(op[1] for op in batch if op[0] == "insert" and op[1] not in self._failures)]
+            # Snapshots: queued records stay patchable until the storage accepted them
+            records = [dict(self._pending[record_id]) for record_id in ids if record_id in self._pending]
+        doc_ids = self._insert(records) if records else []
+
+        inserted, added, removed, late = [], [], [], []
+        with self._lock:
+            for record, doc_id in zip(records, doc_ids, strict=True):
+                if doc_id is None:
+                    continue
+                current = self._pending.pop(record["id"], record)
+                self._failures.pop(record["id"], None)
+                self._remember(record["id"], doc_id, record)
+                inserted.append(record)
+                # Patches folded in while the snapshot was being written
+                changed = {field: value for field, value in current.items() if record.get(field) != value}
+                if changed:
+                    late.append(("patch", record["id"], changed))
+        added.extend(inserted)
+
+        Log = Query()
+        for op in [*batch, *late]:
+            if op[0] != "patch":
+                continue
+            record_id, fields = op[1], op[2]
+            doc_id, summary = self._written.get(record_id, (None, None))
+            if summary is None and self.rollup is not None:
+                # Not remembered anymore: read the previous state to compute the rollup delta
+                summary = self.table.get(Log.id == record_id)
+                doc_id = getattr(summary, "doc_id", None)
+
+            if doc_id is not None:
+                self.table.update(fields, doc_ids=[doc_id])
+            else:
+                self.table.update(fields, Log.id == record_id)
+
+            if summary is not None:
+                patched = {**summary, **fields}
+                self._remember(record_id, doc_id, patched)
+                removed.append(summary)
+                added.append(patched)
+        return inserted, added, removed
+
+    def _insert(self, records):
+        """
+        Inserts records, one by one when the batch fails so a single bad record doesn't hold
+        back the others. Returns their doc_ids, None for records that could not be written.
+        """
+        try:
+            return self.table.insert_multiple(records)
+        except Exception as e:
+            print(f"⚠️ Interaction batch write failed, retrying one by one: {e}")
+
+        doc_ids = []
+        for record in records:
+            try:
+                doc_ids.append(self.table.insert(record))
+            except Exception as e:
+                doc_ids.append(None)
+                self._insert_failed(record, e)
+        return doc_ids
+
+    def _insert_failed(self, record, error):
+        """Keeps a record that could not be written for a later attempt, or gives it up."""
+        with self._lock:
+            attempts = self._failures.get(record["id"], 0) + 1
+            if attempts < WRITE_BEHIND_ATTEMPTS:
+                self._failures[record["id"]] = attempts
+                return
+            self._failures.pop(record["id"], None)
+            self._pending.pop(record["id"], None)
+        print(f"⚠️ Interaction {record['id']} dropped after {attempts} failed writes: {error}")
+
+    def _remember(self, record_id, doc_id, record):
+        if doc_id is None:
+            return
+        summary = {field: record[field] for field in ROLLUP_SOURCE_FIELDS if field in record}
+        self._written[record_id] = (doc_id, summary)
+        self._written.move_to_end(record_id)
+        while len(self._written) > RECENT_DOC_IDS:
+            self._written.popitem(last=False)
+
+
+def get_interaction_writer(table, rollup=None, blobs=None, search=None):
+    """Returns the shared write-behind writer for a history table."""
+    with _REGISTRY_LOCK:
+        writer = _WRITERS.get(id(table))
+        if writer is None:
+            writer = InteractionWriter(table, rollup=rollup, blobs=blobs, search=search)
+            _WRITERS[id(table)] = writer
+        return writer
+
+
+def flush_interactions(table):
+    """Makes buffered interactions visible to readers of a history table."""
+    with _REGISTRY_LOCK:
+        writer = _WRITERS.get(id(table))
+    if writer:
+        writer.flush()
 
 
 class ConfigManager:
     def __init__(self):
-        self.db = _safe_tinydb_init(DB_PATH)
+        self.db = open_database()
         self.config_table = self.db.table("config")
         self.settings_table = self.db.table("settings")
 
@@ -133,7 +1332,7 @@ class ConfigManager:
 
 class PersonaManager:
     def __init__(self):
-        self.db = _safe_tinydb_init(DB_PATH)
+        self.db = open_database()
         self.personas_table = self.db.table("personas")
         if not self.personas_table.all():
             self._seed_defaults()
@@ -163,11 +1362,38 @@ class PersonaManager:
         return res["prompt"] if res else "You are a helpful assistant."
 
 
+def activity_time(value):
+    """Comparable "YYYY-MM-DD HH:MM:SS" form of a session created_at (ISO) or a record timestamp."""
+    return str(value or "")[:19].replace("T", " ")
+
+
+def archive_dimensions(interactions):
+    """
+    [provider, model, persona, count] rows of archived records, kept in the archive index so
+    filtered log counts never decompress a segment.
+    """
+    counts = Counter((ix.get("provider"), ix.get("model"), ix.get("persona")) for ix in interactions)
+    return [[provider, model, persona, count] for (provider, model, persona), count in counts.items()]
+
+
+def merge_dimensions(*dimensions):
+    counts = Counter()
+    for rows in dimensions:
+        for provider, model, persona, count in rows:
+            counts[provider, model, persona] += count
+    return [[provider, model, persona, count] for (provider, model, persona), count in counts.items()]
+
+
 class SessionManager:
     def __init__(self):
-        self.db = _safe_tinydb_init(DB_PATH)
+        self.db = open_database()
         self.sessions_table = self.db.table("sessions")
         self.history_table = self.db.table("history")
+        self.transcripts = get_transcript_cache(self.db)
+        self.blobs = get_blob_store(self.db)
+        self.archive_index = self.db.table("archived_sessions")
+        self.archive_dir = APP_DIR / "archive"
+        self.search_index = get_search_index(self.db)
 
     def create_session(self, title="New Chat"):
         session_id = str(uuid.uuid4())
@@ -178,60 +1404,263 @@ class SessionManager:
         Session = Query()
         self.sessions_table.update({"title": new_title}, Session.id == session_id)
 
+    def get_context_summary(self, session_id):
+        """Rolling summary of the turns that left the context window ({"covered", "anchor", "text"}), if any."""
+        Session = Query()
+        session = self.sessions_table.get(Session.id == session_id)
+        return session.get("context_summary") if session else None
+
+    def save_context_summary(self, session_id, summary):
+        Session = Query()
+        self.sessions_table.update({"context_summary": summary}, Session.id == session_id)
+
     def get_all_sessions(self):
         sessions = self.sessions_table.all()
         return sorted(sessions, key=lambda x: x["created_at"], reverse=True)
 
+    def list_sessions(self, limit=SESSION_PAGE_SIZE, before=None):
+        """
+        Newest-first page of sessions (archived ones included, flagged "archived"), served
+        from the created_at indexes. Pass the returned cursor as `before` to get the next
+        page; it is None on the last page. Returns (sessions, next_cursor).
+        """
+        Session = Query()
+        cond = Session.created_at < before if before else None
+        # One extra row tells whether another page exists
+        sessions = self.sessions_table.search_page(cond, order_by="created_at", descending=True, limit=limit + 1)
+        archived = self.archive_index.search_page(cond, order_by="created_at", descending=True, limit=limit + 1)
+        if archived:
+            archived = [
+                {"id": a["id"], "title": a["title"], "created_at": a["created_at"], "archived": True} for a in archived
+            ]
+            sessions = sorted(sessions + archived, key=lambda x: x.get("created_at") or "", reverse=True)
+
+        if len(sessions) > limit:
+            sessions = sessions[:limit]
+            return sessions, sessions[-1]["created_at"]
+        return sessions, None
+
     def get_messages(self, session_id):
+        cached = self.transcripts.get(session_id)
+        if cached is not None:
+            return cached
+
+        version = self.transcripts.version(session_id)
+        flush_interactions(self.history_table)
         History = Query()
         interactions = self.history_table.search(History.session_id == session_id)
+        # Archived sessions are read lazily from their month segment
+        interactions = self._archived_interactions(session_id) + interactions
         interactions.sort(key=lambda x: x.get("timestamp", ""))
 
+        self.blobs.prefetch((ix.get("user_message") or {}).get("content_ref") for ix in interactions)
         formatted_messages = []
         for ix in interactions:
-            timestamp = ix.get("timestamp", "")
-            model_info = ix.get("model", "Unknown")
-            provider_info = ix.get("provider", "Unknown")  # Metadata: Retrieve provider
-            persona_info = ix.get("persona") or "Default"
-
-            if ix.get("messages"):
-                user_msg = ix["messages"][-1]
-                formatted_messages.append(
-                    {
-                        "role": "user",
-                        "content": user_msg["content"],
-                        "time": timestamp,
-                        "model": model_info,
-                        "provider": provider_info,  # Added provider
-                        "persona": persona_info,
-                    }
-                )
+            formatted_messages.extend(format_interaction(ix, self.blobs))
 
-            formatted_messages.append(
+        self.transcripts.put(session_id, formatted_messages, version)
+        return formatted_messages
+
+    def search_sessions(self, text, limit=20):
+        """
+        Sessions whose prompts or replies match text, best match first (archived ones
+        included, flagged "archived"). Each result carries the snippet of its best hit.
+        """
+        flush_interactions(self.history_table)
+        index = ensure_search_index(self.db)
+        Session = Query()
+        results = []
+        seen = set()
+        # Sessions usually have several matching messages: read ahead, keep the best per session
+        for hit in index.search(text, limit=limit * 5):
+            session_id = hit["session_id"]
+            if session_id in seen:
+                continue
+            seen.add(session_id)
+            session = self.sessions_table.get(Session.id == session_id)
+            archived = session is None
+            if archived:
+                session = self.archive_index.get(Session.id == session_id)
+            if session is None:
+                continue
+            results.append(
                 {
-                    "role": "assistant",
-                    "content": ix.get("reply", ""),
-                    "time": timestamp,
-                    "model": model_info,
-                    "provider": provider_info,  # Added provider
-                    "persona": persona_info,
+                    "id": session_id,
+                    "title": session.get("title", ""),
+                    "created_at": session.get("created_at"),
+                    "archived": archived,
+                    "snippet": hit["snippet"],
+                    "timestamp": hit["timestamp"],
                 }
             )
-        return formatted_messages
+            if len(results) >= limit:
+                break
+        return results
 
     def delete_session(self, session_id):
+        self.transcripts.invalidate(session_id)
+        flush_interactions(self.history_table)
+        self.search_index.remove_sessions([session_id])
         Session = Query()
         History = Query()
         self.sessions_table.remove(Session.id == session_id)
-        self.history_table.remove(History.session_id == session_id)
+        rollup = get_usage_rollup(self.db)
+        with rollup.lock:
+            removed = self.history_table.search(History.session_id == session_id)
+            if removed:
+                self.history_table.remove(doc_ids=[doc.doc_id for doc in removed])
+            archived = self._archived_interactions(session_id)
+            if archived:
+                archive.drop_entry(self._segment_of(session_id), session_id)
+                self.archive_index.remove(Session.id == session_id)
+            if removed or archived:
+                rollup.apply(removed=removed + archived)
+
+    # --- Archival tier ---
+    def _segment_of(self, session_id):
+        Session = Query()
+        indexed = self.archive_index.get(Session.id == session_id)
+        return archive.segment_path(self.archive_dir, indexed["segment"]) if indexed else None
+
+    def _archived_interactions(self, session_id):
+        path = self._segment_of(session_id)
+        entry = archive.read_entry(path, session_id) if path else None
+        return entry["interactions"] if entry else []
+
+    def archive_sessions(self, older_than_days=ARCHIVE_AFTER_DAYS):
+        """
+        Moves sessions last active more than `older_than_days` ago, with their history, into
+        the compressed monthly segments and indexes them in archived_sessions. Records added to
+        an archived session later (stragglers) are archived the same way once they are that old.
+        Usage rollups are left untouched, so the dashboard keeps counting archived conversations.
+        Returns the number of archived sessions (stragglers not included).
+        """
+        if older_than_days <= 0:
+            return 0
+
+        cutoff = activity_time((datetime.now() - timedelta(days=older_than_days)).isoformat())
+        Session = Query()
+        History = Query()
+        flush_interactions(self.history_table)
+
+        # A session can't have been active after the cutoff without being created before it
+        candidates = self.sessions_table.search(Session.created_at < cutoff.replace(" ", "T"))
+        old_sessions = []
+        for session in candidates:
+            interactions = self.history_table.search(History.session_id == session["id"])
+            if all(activity_time(ix.get("timestamp")) < cutoff for ix in interactions):
+                old_sessions.append((session, interactions))
+        stragglers = self._stragglers(cutoff)
+        if not old_sessions and not stragglers:
+            return 0
+
+        segments = {}
+        history_doc_ids = []
+        index_rows = []
+        for session, interactions in old_sessions:
+            history_doc_ids.extend(ix.doc_id for ix in interactions)
+            segment = archive.segment_name(session.get("created_at"))
+            segments.setdefault(segment, []).append(
+                {"session": dict(session), "interactions": [dict(ix) for ix in interactions]}
+            )
+            index_rows.append(
+                {
+                    "id": session["id"],
+                    "title": session.get("title", ""),
+                    "created_at": session.get("created_at"),
+                    "segment": segment,
+                    "interactions": len(interactions),
+                    "last_activity": max(
+                        [activity_time(session.get("created_at"))]
+                        + [activity_time(ix.get("timestamp")) for ix in interactions]
+                    ),
+                    "dimensions": archive_dimensions(interactions),
+                }
+            )
+        for indexed, interactions in stragglers:
+            history_doc_ids.extend(ix.doc_id for ix in interactions)
+            # Appended to the session's own segment, where opening it looks
+            segments.setdefault(indexed["segment"], []).append(
+                {"session": {"id": indexed["id"]}, "interactions": [dict(ix) for ix in interactions]}
+            )
+
+        # Segments are written first: a crash before the removals leaves duplicates, never losses
+        for segment, entries in segments.items():
+            archive.append_entries(archive.segment_path(self.archive_dir, segment), entries)
+        if index_rows:
+            self.archive_index.insert_multiple(index_rows)
+        for indexed, interactions in stragglers:
+            fields = {"interactions": indexed.get("interactions", 0) + len(interactions)}
+            # Rows indexed without them get both from the whole entry when first needed
+            if "dimensions" in indexed:
+                fields["last_activity"] = max(
+                    [indexed["last_activity"]] + [activity_time(ix.get("timestamp")) for ix in interactions]
+                )
+                fields["dimensions"] = merge_dimensions(indexed["dimensions"], archive_dimensions(interactions))
+            self.archive_index.update(fields, doc_ids=[indexed.doc_id])
+        if history_doc_ids:
+            self.history_table.remove(doc_ids=history_doc_ids)
+        if old_sessions:
+            self.sessions_table.remove(doc_ids=[session.doc_id for session, _ in old_sessions])
+
+        for session_id in [session["id"] for session, _ in old_sessions] + [ix["id"] for ix, _ in stragglers]:
+            self.transcripts.invalidate(session_id)
+        return len(old_sessions)
+
+    def _stragglers(self, cutoff):
+        """
+        (archive index row, live records) of archived sessions that got records after being
+        archived, when none of those records is newer than the cutoff.
+        """
+        History = Query()
+        Session = Query()
+        by_session = {}
+        for ix in self.history_table.search(History.timestamp < cutoff):
+            by_session.setdefault(ix.get("session_id"), []).append(ix)
+
+        stragglers = []
+        for session_id, interactions in by_session.items():
+            indexed = self.archive_index.get(Session.id == session_id) if session_id else None
+            if indexed is None:
+                continue
+            if len(self.history_table.search(History.session_id == session_id)) == len(interactions):
+                stragglers.append((indexed, interactions))
+        return stragglers
+
+
+_ARCHIVAL_DONE = False
+
+
+def archive_old_sessions():
+    """Runs the configured archival once per process (CALANGO_ARCHIVE_AFTER_DAYS)."""
+    global _ARCHIVAL_DONE
+    with _REGISTRY_LOCK:
+        if _ARCHIVAL_DONE or ARCHIVE_AFTER_DAYS <= 0:
+            return 0
+        _ARCHIVAL_DONE = True
+    return SessionManager().archive_sessions(ARCHIVE_AFTER_DAYS)
 
 
 class InteractionManager:
-    def __init__(self):
-        self.db = _safe_tinydb_init(DB_PATH)
+    def __init__(self, write_behind=None):
+        self.db = open_database()
         self.history_table = self.db.table("history")
+        self.archive_index = self.db.table("archived_sessions")
+        self.archive_dir = APP_DIR / "archive"
+        self.rollup = get_usage_rollup(self.db)
+        self.transcripts = get_transcript_cache(self.db)
+        self.blobs = get_blob_store(self.db)
+        self.search_index = get_search_index(self.db)
+        use_writer = WRITE_BEHIND if write_behind is None else write_behind
+        self.writer = (
+            get_interaction_writer(self.history_table, self.rollup, self.blobs, self.search_index)
+            if use_writer
+            else None
+        )
 
-    def log_interaction(self, provider, model, messages, response, session_id, persona, cost=0.0):
+    def log_interaction(
+        self, provider, model, messages, response, session_id, persona, cost=0.0, record_id=None, cached=False
+    ):
         try:
             input_tokens = response.usage.prompt_tokens
             output_tokens = response.usage.completion_tokens
@@ -241,16 +1670,222 @@ class InteractionManager:
             reply_content = ""
 
         record = {
-            "id": str(uuid.uuid4()),
+            "id": record_id or str(uuid.uuid4()),
             "session_id": session_id,
             "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),  # Date: yyyy-mm-dd HH:mm:ss
             "provider": provider,
             "model": model,
             "persona": persona,
-            "messages": messages,
+            # Snapshot: the record may be serialized later by the background writer
+            "user_message": self._compact_message(messages[-1]) if messages else None,
+            "context": self._context_reference(messages),
             "reply": reply_content,
-            "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens},
+            "usage": {
+                "prompt_tokens": input_tokens,
+                "completion_tokens": output_tokens,
+                "total_tokens": input_tokens + output_tokens,
+            },
             "cost_usd": cost,
+            "schema_version": HISTORY_SCHEMA_VERSION,
         }
-        self.history_table.insert(record)
+        if cached:
+            # Served from the response cache, no API call was made
+            record["cached"] = True
+        if self.writer:
+            self.writer.submit_record(record)
+        else:
+            self.blobs.flush()
+            with self.rollup.lock:
+                self.history_table.insert(record)
+                self.rollup.apply(added=[record])
+            index_records(self.search_index, [record], self.blobs)
+        self.transcripts.append(record)
         return record
+
+    def _compact_message(self, message):
+        """Copy of a message whose long content is replaced by a blob reference."""
+        message = dict(message)
+        content = message.get("content")
+        if isinstance(content, str) and len(content) >= BLOB_MIN_CHARS:
+            message["content_ref"] = self.blobs.put(message.pop("content"))
+        return message
+
+    def _context_reference(self, messages):
+        """
+        Describes what was sent before the new user turn without copying it: the system
+        prompt (stored once in the blob store), the per-turn system messages after it (e.g.
+        retrieved context, kept in a blob of their own) and how many earlier turns were included.
+        """
+        system_messages = [m.get("content") for m in messages if m.get("role") == "system"]
+        earlier_turns = sum(1 for m in messages[:-1] if m.get("role") != "system")
+        system_prompt = system_messages[0] if system_messages else None
+        reference = {
+            "system_prompt_id": self.blobs.put(system_prompt) if system_prompt else None,
+            "turns": earlier_turns,
+        }
+        extra = "\n\n".join(content for content in system_messages[1:] if content)
+        if extra:
+            reference["extra_system_id"] = self.blobs.put(extra)
+        return reference
+
+    def get_request_messages(self, record):
+        """
+        Rebuilds the message list that was sent for a history record: the full list for legacy
+        records, otherwise system prompt + the session's earlier turns + the user turn.
+        """
+        if "messages" in record:
+            return record["messages"]
+
+        context = record.get("context") or {}
+        messages = []
+        system_prompt = self.blobs.get(context["system_prompt_id"]) if context.get("system_prompt_id") else None
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+        if context.get("extra_system_id"):
+            messages.append({"role": "system", "content": self.blobs.get(context["extra_system_id"])})
+
+        turns = context.get("turns", 0)
+        if turns:
+            self.flush()
+            History = Query()
+            earlier = []
+            for ix in sorted(
+                self.history_table.search(History.session_id == record.get("session_id")),
+                key=lambda x: x.get("timestamp", ""),
+            ):
+                if ix.get("id") == record.get("id"):
+                    break
+                earlier.extend({"role": m["role"], "content": m["content"]} for m in format_interaction(ix, self.blobs))
+            messages.extend(earlier[-turns:])
+
+        user_message = record_user_message(record, self.blobs)
+        if user_message:
+            messages.append(user_message)
+        return messages
+
+    def update_interaction(self, record_id, fields):
+        """Patches a logged interaction (e.g. usage and cost computed after the stream)."""
+        self.transcripts.patch(record_id, fields)
+        if self.writer:
+            self.writer.submit_patch(record_id, fields)
+        else:
+            Log = Query()
+            with self.rollup.lock:
+                previous = self.history_table.get(Log.id == record_id)
+                self.history_table.update(fields, Log.id == record_id)
+                if previous is not None:
+                    self.rollup.apply(added=[{**previous, **fields}], removed=[previous])
+
+    def flush(self):
+        """Waits until buffered interactions are written to the storage."""
+        if self.writer:
+            self.writer.flush()
+
+    @staticmethod
+    def _interaction_filter(providers=None, models=None, personas=None):
+        """Builds the query for the log filters (None when nothing is filtered)."""
+        Log = Query()
+        cond = None
+        for field, values in (("provider", providers), ("model", models), ("persona", personas)):
+            if values:
+                condition = getattr(Log, field).one_of(list(values))
+                cond = condition if cond is None else cond & condition
+        return cond
+
+    def _archived_matches(self, providers=None, models=None, personas=None):
+        """
+        (archive index row, matching record count) of the archived sessions holding records that
+        match the filters, counted from the index alone.
+        """
+        matches = []
+        for indexed in self.archive_index.all():
+            if "dimensions" not in indexed:
+                indexed = self._index_dimensions(indexed)
+            count = sum(
+                n
+                for provider, model, persona, n in indexed["dimensions"]
+                if (not providers or provider in providers)
+                and (not models or model in models)
+                and (not personas or persona in personas)
+            )
+            if count:
+                matches.append((indexed, count))
+        return matches
+
+    def _index_dimensions(self, indexed):
+        """Adds last_activity and dimensions to an archive index row written without them."""
+        path = archive.segment_path(self.archive_dir, indexed["segment"])
+        entry = archive.read_entry(path, indexed["id"]) or {"interactions": []}
+        interactions = entry["interactions"]
+        fields = {
+            "last_activity": max(
+                [activity_time(indexed.get("created_at"))] + [activity_time(ix.get("timestamp")) for ix in interactions]
+            ),
+            "dimensions": archive_dimensions(interactions),
+        }
+        self.archive_index.update(fields, doc_ids=[indexed.doc_id])
+        return {**indexed, **fields}
+
+    def _archived_records(self, indexed_rows, cond):
+        """Archived records of the given sessions matching cond, read one segment at a time."""
+        by_segment = {}
+        for indexed in indexed_rows:
+            by_segment.setdefault(indexed["segment"], []).append(indexed["id"])
+        records = []
+        for segment, session_ids in by_segment.items():
+            entries = archive.read_entries(archive.segment_path(self.archive_dir, segment), session_ids)
+            for entry in entries.values():
+                records.extend(ix for ix in entry["interactions"] if cond is None or cond(ix))
+        return records
+
+    def iter_archived(self):
+        """Streams the archived history records (see calango.archive)."""
+        return archive.iter_interactions(self.archive_dir)
+
+    def count_interactions(self, providers=None, models=None, personas=None):
+        """
+        Number of history records matching the filters (empty/None filters match everything),
+        archived sessions included.
+        """
+        self.flush()
+        cond = self._interaction_filter(providers, models, personas)
+        live = len(self.history_table) if cond is None else self.history_table.count(cond)
+        return live + sum(count for _, count in self._archived_matches(providers, models, personas))
+
+    def query_interactions(self, providers=None, models=None, personas=None, limit=50, offset=0, newest_first=True):
+        """
+        One page of history records matching the filters, sorted by timestamp. Archived
+        sessions are included; their segments are only read when the page reaches them.
+        """
+        self.flush()
+        cond = self._interaction_filter(providers, models, personas)
+        archived = self._archived_matches(providers, models, personas)
+        if not archived:
+            return self.history_table.search_page(
+                cond, order_by="timestamp", descending=newest_first, limit=limit, offset=offset
+            )
+
+        end = None if limit is None else offset + limit
+        live = self.history_table.search_page(cond, order_by="timestamp", descending=newest_first, limit=end)
+        newest_archived = max(indexed["last_activity"] for indexed, _ in archived)
+        if newest_first and len(live) == end and activity_time(live[-1].get("timestamp")) > newest_archived:
+            # Every archived record is older than the whole page
+            return live[offset:]
+
+        records = live + self._archived_records([indexed for indexed, _ in archived], cond)
+        records.sort(key=lambda x: x.get("timestamp", ""), reverse=newest_first)
+        return records[offset:end]
+
+    def search_history(self, text, limit=20, offset=0):
+        """Best-ranked messages matching text (see HistorySearchIndex.search)."""
+        self.flush()
+        return ensure_search_index(self.db).search(text, limit=limit, offset=offset)
+
+    def get_usage_rollups(self):
+        """
+        Aggregated usage rows ({day, provider, model, persona, count, tokens..., cost_usd}).
+        The first call on a pre-existing history aggregates it once.
+        """
+        self.flush()
+        self.rollup.ensure_backfilled(self.history_table)
+        return self.rollup.rows()
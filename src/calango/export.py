@@ -0,0 +1,176 @@
+"""
+Columnar export of the interaction history (Parquet or Arrow IPC).
+
+Usage:
+    python -m calango.export [--output PATH] [--format parquet|arrow] [--row-group-size N]
+
+Records are flattened to one row per interaction (no messages or reply text) and written
+in row groups, so memory stays bounded by --row-group-size whatever the history size.
+Requires pyarrow (pip install "calango-ai[export]").
+"""
+
+import argparse
+import itertools
+import os
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+from calango.database import APP_DIR, InteractionManager, usage_tokens
+
+DEFAULT_EXPORT_PATH = APP_DIR / "exports" / "history.parquet"
+DEFAULT_ROW_GROUP_SIZE = 50_000
+FORMATS = ("parquet", "arrow")
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+    except ImportError as e:
+        raise RuntimeError('Exporting needs pyarrow: pip install "calango-ai[export]"') from e
+    return pyarrow
+
+
+def history_schema():
+    pa = _require_pyarrow()
+    return pa.schema(
+        [
+            ("id", pa.string()),
+            ("session_id", pa.string()),
+            ("timestamp", pa.timestamp("s")),
+            ("provider", pa.string()),
+            ("model", pa.string()),
+            ("persona", pa.string()),
+            ("prompt_tokens", pa.int64()),
+            ("completion_tokens", pa.int64()),
+            ("total_tokens", pa.int64()),
+            ("cost_usd", pa.float64()),
+            ("usage_source", pa.string()),
+        ]
+    )
+
+
+def _parse_timestamp(value):
+    try:
+        return datetime.fromisoformat(str(value)).replace(tzinfo=None)
+    except ValueError:
+        return None
+
+
+def _as_int(value):
+    return int(value) if isinstance(value, int | float) and not isinstance(value, bool) else 0
+
+
+def flatten_record(record):
+    """Maps a history document to a flat export row."""
+    prompt_tokens, completion_tokens, total_tokens = usage_tokens(record)
+    return {
+        "id": record.get("id"),
+        "session_id": record.get("session_id"),
+        "timestamp": _parse_timestamp(record.get("timestamp")),
+        "provider": record.get("provider"),
+        "model": record.get("model"),
+        "persona": record.get("persona"),
+        "prompt_tokens": _as_int(prompt_tokens),
+        "completion_tokens": _as_int(completion_tokens),
+        "total_tokens": _as_int(total_tokens),
+        "cost_usd": float(record.get("cost_usd") or 0.0),
+        "usage_source": record.get("usage_source"),
+    }
+
+
+def _iter_batches(records, batch_size):
+    batch = []
+    for record in records:
+        batch.append(flatten_record(record))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def export_history(path=DEFAULT_EXPORT_PATH, fmt="parquet", row_group_size=DEFAULT_ROW_GROUP_SIZE, manager=None):
+    """
+    Streams the history table, then the archived sessions, into a Parquet/Arrow file. The file
+    is written next to the target and moved into place at the end, so readers never see a
+    partial snapshot.
+    Returns the number of exported rows.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format '{fmt}' (expected one of {', '.join(FORMATS)})")
+
+    pa = _require_pyarrow()
+    manager = manager or InteractionManager()
+    manager.flush()
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    schema = history_schema()
+
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+
+        writer = pq.ParquetWriter(tmp_path, schema, compression="zstd")
+    else:
+        writer = pa.ipc.new_file(tmp_path, schema)
+
+    history = manager.history_table
+    docs = history.iter_documents(row_group_size) if hasattr(history, "iter_documents") else history
+    rows = 0
+    try:
+        for batch in _iter_batches(itertools.chain(docs, manager.iter_archived()), row_group_size):
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+            rows += len(batch)
+    except BaseException:
+        writer.close()
+        tmp_path.unlink(missing_ok=True)
+        raise
+    writer.close()
+
+    os.replace(tmp_path, path)
+    return rows
+
+
+def read_export(path=DEFAULT_EXPORT_PATH, columns=None):
+    """Loads an exported snapshot as a pandas DataFrame (only the requested columns are read)."""
+    pa = _require_pyarrow()
+    path = Path(path)
+    if path.suffix == ".parquet":
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(path, columns=columns)
+    else:
+        with pa.memory_map(str(path)) as source:
+            table = pa.ipc.open_file(source).read_all()
+        if columns:
+            table = table.select(columns)
+    return table.to_pandas()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export Calango interaction history to Parquet or Arrow IPC.")
+    parser.add_argument("--output", type=Path, default=None, help=f"Target file (default: {DEFAULT_EXPORT_PATH})")
+    parser.add_argument("--format", choices=FORMATS, default=None, help="Defaults to the output file extension")
+    parser.add_argument("--row-group-size", type=int, default=DEFAULT_ROW_GROUP_SIZE, help="Rows per row group")
+    args = parser.parse_args(argv)
+
+    fmt = args.format or ("arrow" if args.output and args.output.suffix in (".arrow", ".feather") else "parquet")
+    output = args.output or DEFAULT_EXPORT_PATH.with_suffix(".parquet" if fmt == "parquet" else ".arrow")
+
+    started = time.perf_counter()
+    try:
+        rows = export_history(output, fmt=fmt, row_group_size=args.row_group_size)
+    except (RuntimeError, ValueError, OSError) as e:
+        print(f"❌ Export failed: {e}")
+        return 1
+
+    elapsed = time.perf_counter() - started
+    print(f"🦎 Exported {rows:,} interactions to {output} in {elapsed:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
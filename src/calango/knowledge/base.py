@@ -0,0 +1,296 @@
+"""
+Local knowledge base (RAG): ingestion, retrieval and prompt context.
+
+Ingestion is incremental: every file's mtime, size and sha256 are kept in the store's
+registry, so a sync only re-chunks and re-embeds files that are new or whose content
+changed. Rows of changed or deleted files are tombstoned, and once tombstones pass
+COMPACT_THRESHOLD of the rows a compaction rewrites the store (and retrains the IVF index).
+Chunking runs in a process pool; embedding and writes stay in the calling process.
+
+Queries are answered by a vectorized dot product over every live row, or through an IVF
+index once one has been built (see `calango-knowledge build-index`).
+"""
+
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from calango.database import APP_DIR
+from calango.knowledge.chunking import SUPPORTED_SUFFIXES, prepare_file
+from calango.knowledge.ivf import INDEX_FILE, IVFIndex
+from calango.knowledge.store import MANIFEST_FILE, StoreBusyError, VectorStore, writer_lock
+from calango.semantic_cache import EMBEDDER, get_embedder
+
+KNOWLEDGE_DIR = Path(os.getenv("CALANGO_KNOWLEDGE_DIR", APP_DIR / "knowledge"))
+KNOWLEDGE_EMBEDDER = os.getenv("CALANGO_KNOWLEDGE_EMBEDDER", EMBEDDER)
+EMBED_BATCH_SIZE = int(os.getenv("CALANGO_KNOWLEDGE_BATCH", "64"))
+KNOWLEDGE_TOP_K = int(os.getenv("CALANGO_KNOWLEDGE_TOP_K", "4"))
+# Chunks scoring below this are not worth sending to the model
+KNOWLEDGE_MIN_SCORE = float(os.getenv("CALANGO_KNOWLEDGE_MIN_SCORE", "0.2"))
+KNOWLEDGE_CONTEXT_CHARS = int(os.getenv("CALANGO_KNOWLEDGE_CONTEXT_CHARS", "4000"))
+IVF_NPROBE = int(os.getenv("CALANGO_KNOWLEDGE_NPROBE", "8"))
+KNOWLEDGE_WORKERS = int(os.getenv("CALANGO_KNOWLEDGE_WORKERS", str(os.cpu_count() or 1)))
+# Fraction of tombstoned rows that triggers a compaction
+COMPACT_THRESHOLD = float(os.getenv("CALANGO_KNOWLEDGE_COMPACT_THRESHOLD", "0.2"))
+
+CONTEXT_HEADER = "Use the following context from the user's local knowledge base when it is relevant:"
+
+# Store directories with a compaction running in this process
+_COMPACTING = set()
+_COMPACTING_LOCK = threading.Lock()
+
+
+def _candidate_files(roots):
+    for root in roots:
+        files = sorted(p for p in root.rglob("*") if p.is_file()) if root.is_dir() else [root]
+        for file in files:
+            if file.suffix.lower() in SUPPORTED_SUFFIXES:
+                yield file
+
+
+def _is_under(path, roots):
+    path = Path(path)
+    return any(path == root or root in path.parents for root in roots)
+
+
+class KnowledgeBase:
+    def __init__(self, path=KNOWLEDGE_DIR, embedder=None, batch_size=EMBED_BATCH_SIZE):
+        self.path = Path(path)
+        self.embedder = embedder or get_embedder(KNOWLEDGE_EMBEDDER)
+        self.batch_size = batch_size
+        self.store = VectorStore(self.path, self.embedder.dim)
+        self.index_path = self.path / INDEX_FILE
+        self.ivf = None
+        self._ivf_stamp = None
+        self._load_index()
+
+    def _load_index(self):
+        """(Re)loads the IVF index when it changed on disk; indexes of older store generations are ignored."""
+        try:
+            stamp = self.index_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            self.ivf, self._ivf_stamp = None, None
+            return
+        if stamp != self._ivf_stamp:
+            self.ivf, self._ivf_stamp = IVFIndex.load(self.index_path), stamp
+        if self.ivf is not None and (
+            self.ivf.generation != self.store.generation or self.ivf.trained_count > self.store.count
+        ):
+            self.ivf = None
+
+    def _append_chunks(self, source, chunks):
+        """Embeds and appends a file's chunks (uncommitted). Returns the first row."""
+        first_row = self.store.count
+        for start in range(0, len(chunks), self.batch_size):
+            batch = [
+                {"source": source, "chunk": start + i, "offset": offset, "text": text}
+                for i, (offset, text) in enumerate(chunks[start : start + self.batch_size])
+            ]
+            row = self.store.append(self.embedder.embed([entry["text"] for entry in batch]), batch, commit=False)
+            first_row = row if start == 0 else first_row
+        return first_row
+
+    def _forget(self, source):
+        entry = self.store.files.pop(source)
+        self.store.delete_rows(entry["first_row"], entry["first_row"] + entry["rows"])
+
+    @staticmethod
+    def _prepared(todo, workers):
+        """Yields prepare_file() results in order, keeping at most 2 x workers files in flight."""
+        if workers <= 1 or len(todo) <= 1:
+            for source, _, entry in todo:
+                yield prepare_file(source, entry and entry["sha256"])
+            return
+
+        with ProcessPoolExecutor(max_workers=min(workers, len(todo))) as pool:
+            pending = deque()
+            for source, _, entry in todo:
+                pending.append(pool.submit(prepare_file, source, entry and entry["sha256"]))
+                if len(pending) >= 2 * workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def sync(self, paths, workers=KNOWLEDGE_WORKERS):
+        """
+        Brings the knowledge base in line with files and directories (recursively, supported
+        extensions only). New and changed files are (re)ingested, files that vanished from
+        under the given paths are tombstoned. Each file is committed on its own, so an
+        interrupted sync keeps everything finished so far.
+        Returns {"added", "updated", "removed": [paths], "unchanged": n, "chunks": n}.
+        """
+        report = {"added": [], "updated": [], "removed": [], "unchanged": 0, "chunks": 0}
+        roots = [Path(p).resolve() for p in paths]
+
+        with writer_lock(self.path):
+            self.store.refresh()
+            files = self.store.files
+            found = {str(file): file.stat() for file in _candidate_files(roots)}
+
+            for source in [source for source in files if source not in found and _is_under(source, roots)]:
+                self._forget(source)
+                report["removed"].append(source)
+
+            todo = []
+            for source, stat in found.items():
+                entry = files.get(source)
+                if entry and (entry["mtime_ns"], entry["size"]) == (stat.st_mtime_ns, stat.st_size):
+                    report["unchanged"] += 1
+                else:
+                    todo.append((source, stat, entry))
+
+            for (source, stat, entry), (digest, chunks) in zip(todo, self._prepared(todo, workers), strict=True):
+                record = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "sha256": digest}
+                if chunks is None:
+                    # Touched but identical: only the registry needs the new mtime
+                    entry.update(record)
+                    report["unchanged"] += 1
+                    continue
+
+                if entry:
+                    self._forget(source)
+                report["updated" if entry else "added"].append(source)
+                files[source] = {**record, "first_row": self._append_chunks(source, chunks), "rows": len(chunks)}
+                report["chunks"] += len(chunks)
+                self.store.commit()
+
+            self.store.commit()
+        return report
+
+    def needs_compaction(self, threshold=COMPACT_THRESHOLD):
+        self.store.refresh()
+        return bool(self.store.count) and self.store.deleted_count / self.store.count >= threshold
+
+    def compact(self, blocking=True):
+        """
+        Drops tombstoned rows and retrains the IVF index if there was one. Returns the number
+        of rows removed (0 when another writer holds the store and blocking is False).
+        """
+        try:
+            with writer_lock(self.path, blocking=blocking):
+                self.store.refresh()
+                had_index = self.index_path.exists()
+                nlist = len(self.ivf.centroids) if self.ivf is not None else None
+                removed = self.store.compact()
+                if removed and had_index:
+                    self._train_index(nlist)
+                return removed
+        except StoreBusyError:
+            return 0
+
+    def maybe_compact(self, threshold=COMPACT_THRESHOLD, background=False):
+        """
+        Compacts when tombstones pass the threshold. With background=True the work runs on a
+        daemon thread over a separate store handle; readers pick the result up on refresh.
+        Returns the thread (background), the number of rows removed, or None when not needed.
+        """
+        if not self.needs_compaction(threshold):
+            return None
+        if not background:
+            return self.compact()
+
+        key = str(self.path.resolve())
+        with _COMPACTING_LOCK:
+            if key in _COMPACTING:
+                return None
+            _COMPACTING.add(key)
+
+        def run():
+            try:
+                KnowledgeBase(self.path, self.embedder, self.batch_size).compact(blocking=False)
+            except Exception as e:
+                print(f"⚠️ Knowledge compaction failed: {e}")
+            finally:
+                with _COMPACTING_LOCK:
+                    _COMPACTING.discard(key)
+
+        thread = threading.Thread(target=run, name="calango-knowledge-compaction", daemon=True)
+        thread.start()
+        return thread
+
+    def _train_index(self, nlist=None):
+        self.ivf = IVFIndex.train(self.store.vectors, nlist=nlist, generation=self.store.generation)
+        tmp_path = self.path / f"ivf.tmp{Path(INDEX_FILE).suffix}"
+        self.ivf.save(tmp_path)
+        os.replace(tmp_path, self.index_path)
+        self._ivf_stamp = self.index_path.stat().st_mtime_ns
+        return self.ivf
+
+    def build_index(self, nlist=None):
+        """Trains the IVF index over the current rows (worth it for large corpora only)."""
+        with writer_lock(self.path):
+            self.store.refresh()
+            if not self.store.count:
+                return None
+            return self._train_index(nlist)
+
+    def drop_index(self):
+        self.ivf = None
+        self.index_path.unlink(missing_ok=True)
+
+    def reset(self):
+        """Deletes every stored chunk (and the index built over them)."""
+        with writer_lock(self.path):
+            self.drop_index()
+            self.store.reset()
+
+    def search(self, query, k=KNOWLEDGE_TOP_K, nprobe=IVF_NPROBE):
+        """Returns up to k chunks most similar to query: [{"source", "chunk", "offset", "text", "score"}]."""
+        self.store.refresh()
+        self._load_index()
+        if not len(self.store) or not query.strip():
+            return []
+
+        query_vector = self.embedder.embed([query])[0]
+        rows = self.ivf.candidates(query_vector, nprobe, self.store.count) if self.ivf is not None else None
+        top_rows, scores = self.store.search(query_vector, k, rows)
+        return [
+            {**meta, "score": float(score)}
+            for meta, score in zip(self.store.metadata(top_rows.tolist()), scores, strict=True)
+        ]
+
+    def context_for(self, query, k=KNOWLEDGE_TOP_K, min_score=KNOWLEDGE_MIN_SCORE, max_chars=KNOWLEDGE_CONTEXT_CHARS):
+        """Formats the best matching chunks as a context block for the system prompt ("" when none)."""
+        parts = []
+        used = 0
+        for hit in self.search(query, k):
+            if hit["score"] < min_score:
+                break
+            part = f"[{Path(hit['source']).name}]\n{hit['text']}"
+            if used + len(part) > max_chars:
+                break
+            parts.append(part)
+            used += len(part)
+        return "\n\n".join(parts)
+
+    def __len__(self):
+        self.store.refresh()
+        return len(self.store)
+
+
+def context_message(context):
+    """
+    System message carrying retrieved context (None without context). It is sent after the
+    system prompt rather than appended to it, so the prompt stays the same on every turn.
+    """
+    if not context:
+        return None
+    return {"role": "system", "content": f"{CONTEXT_HEADER}\n\n{context}"}
+
+
+def get_knowledge_base(path=KNOWLEDGE_DIR):
+    """
+    The knowledge base at path, or None when nothing has been ingested there yet.
+    Starts a background compaction when tombstones piled up.
+    """
+    if not (Path(path) / MANIFEST_FILE).exists():
+        return None
+    try:
+        knowledge = KnowledgeBase(path)
+        knowledge.maybe_compact(background=True)
+    except (ValueError, RuntimeError, OSError) as e:
+        print(f"⚠️ Knowledge base unavailable: {e}")
+        return None
+    return knowledge if len(knowledge) else None
@@ -0,0 +1,87 @@
+"""
+Streaming text extraction and chunking for the knowledge base.
+
+Files are read in fixed-size blocks and cut into overlapping chunks as they stream in, so
+ingesting a large file never holds more than a block plus one chunk in memory.
+"""
+
+import hashlib
+import os
+from pathlib import Path
+
+CHUNK_CHARS = int(os.getenv("CALANGO_KNOWLEDGE_CHUNK_CHARS", "800"))
+CHUNK_OVERLAP = int(os.getenv("CALANGO_KNOWLEDGE_CHUNK_OVERLAP", "100"))
+READ_BLOCK_CHARS = 64 * 1024
+TEXT_SUFFIXES = {".txt", ".md", ".markdown", ".rst", ".csv", ".json", ".yaml", ".yml", ".py", ".html"}
+SUPPORTED_SUFFIXES = TEXT_SUFFIXES | {".pdf"}
+
+
+def _iter_pdf(path):
+    try:
+        from pypdf import PdfReader
+    except ImportError as e:
+        raise RuntimeError("Reading PDFs needs pypdf: pip install pypdf") from e
+    for page in PdfReader(path).pages:
+        text = page.extract_text() or ""
+        if text:
+            yield text + "\n"
+
+
+def iter_text(path, block_chars=READ_BLOCK_CHARS):
+    """Yields the text of a file in blocks (one page at a time for PDFs)."""
+    path = Path(path)
+    if path.suffix.lower() == ".pdf":
+        yield from _iter_pdf(path)
+        return
+    with open(path, encoding="utf-8", errors="replace") as f:
+        while block := f.read(block_chars):
+            yield block
+
+
+def _cut(buffer, chunk_chars):
+    """Where to end a chunk: the last whitespace in its second half, else a hard cut."""
+    cut = max(buffer.rfind(" ", chunk_chars // 2, chunk_chars), buffer.rfind("\n", chunk_chars // 2, chunk_chars))
+    return cut + 1 if cut > 0 else chunk_chars
+
+
+def chunk_stream(blocks, chunk_chars=CHUNK_CHARS, overlap=CHUNK_OVERLAP):
+    """
+    Cuts streamed text blocks into chunks of at most chunk_chars, each starting `overlap`
+    characters before the previous one ended. Yields (offset, text) with character offsets
+    into the full text; blank chunks are skipped.
+    """
+    overlap = min(overlap, chunk_chars // 2)
+    buffer = ""
+    offset = 0
+    for block in blocks:
+        buffer += block
+        while len(buffer) > chunk_chars:
+            end = _cut(buffer, chunk_chars)
+            text = buffer[:end]
+            if text.strip():
+                yield offset, text.strip()
+            step = max(end - overlap, 1)
+            buffer = buffer[step:]
+            offset += step
+    if buffer.strip():
+        yield offset, buffer.strip()
+
+
+def file_digest(path):
+    """sha256 of a file's bytes."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(1024 * 1024):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def prepare_file(path, known_digest=None):
+    """
+    Hashes a file and chunks it unless its content still matches known_digest.
+    Returns (digest, [(offset, text), ...] or None). CPU-bound, so ingestion runs it in worker processes.
+    """
+    digest = file_digest(path)
+    if digest == known_digest:
+        return digest, None
+    return digest, list(chunk_stream(iter_text(path)))
@@ -0,0 +1,82 @@
+"""
+Command line management of the local knowledge base.
+
+Usage:
+    python -m calango.knowledge.cli ingest PATH [PATH ...] [--reset] [--workers N]
+    python -m calango.knowledge.cli build-index [--nlist N]
+    python -m calango.knowledge.cli compact
+    python -m calango.knowledge.cli search "question" [-k N]
+"""
+
+import argparse
+import sys
+import time
+
+from calango.knowledge.base import KNOWLEDGE_TOP_K, KNOWLEDGE_WORKERS, KnowledgeBase
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage Calango's local knowledge base.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ingest = commands.add_parser(
+        "ingest", help="Add or refresh files or directories (only changed files are re-embedded)"
+    )
+    ingest.add_argument("paths", nargs="+")
+    ingest.add_argument("--reset", action="store_true", help="Delete the existing knowledge base first")
+    ingest.add_argument("--workers", type=int, default=KNOWLEDGE_WORKERS, help="Chunking processes")
+
+    build = commands.add_parser("build-index", help="Train the IVF index (for large corpora)")
+    build.add_argument("--nlist", type=int, default=None, help="Number of lists (default: sqrt(rows))")
+
+    commands.add_parser("compact", help="Drop deleted chunks from disk now")
+
+    search = commands.add_parser("search", help="Show the chunks retrieved for a question")
+    search.add_argument("query")
+    search.add_argument("-k", type=int, default=KNOWLEDGE_TOP_K)
+
+    args = parser.parse_args(argv)
+
+    try:
+        knowledge = KnowledgeBase()
+    except (ValueError, RuntimeError) as e:
+        print(f"❌ {e}")
+        return 1
+
+    started = time.perf_counter()
+    if args.command == "ingest":
+        if args.reset:
+            knowledge.reset()
+        try:
+            report = knowledge.sync(args.paths, workers=args.workers)
+        except (RuntimeError, OSError) as e:
+            print(f"❌ Ingestion failed: {e}")
+            return 1
+        # Compaction (if tombstones piled up) runs while the report is printed
+        compaction = knowledge.maybe_compact(background=True)
+        elapsed = time.perf_counter() - started
+        print(
+            f"🦎 {len(report['added']):,} added, {len(report['updated']):,} updated, "
+            f"{len(report['removed']):,} removed, {report['unchanged']:,} unchanged "
+            f"({report['chunks']:,} chunks embedded) in {elapsed:.2f}s"
+        )
+        if compaction is not None:
+            compaction.join()
+    elif args.command == "build-index":
+        index = knowledge.build_index(args.nlist)
+        if index is None:
+            print("🦎 Nothing to index yet.")
+        else:
+            elapsed = time.perf_counter() - started
+            print(f"🦎 Indexed {index.trained_count:,} chunks into {len(index.centroids):,} lists in {elapsed:.2f}s")
+    elif args.command == "compact":
+        removed = knowledge.compact()
+        print(f"🦎 Compacted away {removed:,} deleted chunks in {time.perf_counter() - started:.2f}s")
+    else:
+        for hit in knowledge.search(args.query, args.k):
+            print(f"{hit['score']:.3f}  {hit['source']}#{hit['chunk']}\n    {hit['text'][:200]!r}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+"""
+Inverted-file (IVF) index for large knowledge bases.
+
+A coarse quantizer (spherical k-means centroids) splits the rows into lists; a query only
+scores the rows of its `nprobe` closest lists. Rows appended after training are not in
+any list and are always scored exactly, so the index never hides new knowledge.
+"""
+
+import numpy as np
+
+INDEX_FILE = "ivf.npz"
+
+
+class IVFIndex:
+    def __init__(self, centroids, order, offsets, trained_count, generation=0):
+        self.centroids = centroids
+        # Row ids grouped by list: the rows of list i are order[offsets[i]:offsets[i + 1]]
+        self.order = order
+        self.offsets = offsets
+        self.trained_count = trained_count
+        # Store generation the row ids refer to (compaction renumbers rows)
+        self.generation = generation
+
+    @classmethod
+    def train(cls, vectors, nlist=None, iterations=10, sample_size=50_000, block_rows=65_536, seed=0, generation=0):
+        """Trains centroids on a sample of the rows and assigns every row to its closest list."""
+        count = len(vectors)
+        nlist = min(nlist or max(1, int(np.sqrt(count))), count)
+        rng = np.random.default_rng(seed)
+        sample_rows = np.sort(rng.choice(count, size=min(sample_size, count), replace=False))
+        sample = np.asarray(vectors[sample_rows], dtype=np.float32)
+
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # Empty lists keep their previous centroid
+            centroids = np.where(norms > 0, sums / np.where(norms == 0, 1.0, norms), centroids)
+
+        assignment = np.empty(count, dtype=np.int32)
+        for start in range(0, count, block_rows):
+            block = np.asarray(vectors[start : start + block_rows], dtype=np.float32)
+            assignment[start : start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+
+        order = np.argsort(assignment, kind="stable").astype(np.int64)
+        offsets = np.searchsorted(assignment[order], np.arange(nlist + 1)).astype(np.int64)
+        return cls(centroids.astype(np.float32), order, offsets, count, generation)
+
+    def candidates(self, query, nprobe, count):
+        """Rows to score for a query: the nprobe closest lists plus rows added since training."""
+        probes = np.argsort(-(self.centroids @ query))[:nprobe]
+        parts = [self.order[self.offsets[i] : self.offsets[i + 1]] for i in probes]
+        parts.append(np.arange(self.trained_count, count, dtype=np.int64))
+        # Sorted row ids keep the memory-mapped reads sequential
+        return np.sort(np.concatenate(parts))
+
+    def save(self, path):
+        np.savez(
+            path,
+            centroids=self.centroids,
+            order=self.order,
+            offsets=self.offsets,
+            trained_count=np.int64(self.trained_count),
+            generation=np.int64(self.generation),
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            generation = int(data["generation"]) if "generation" in data else 0
+            return cls(data["centroids"], data["order"], data["offsets"], int(data["trained_count"]), generation)
@@ -0,0 +1,287 @@
+"""
+On-disk vector store of the knowledge base.
+
+Layout of a store directory:
+    vectors[.<gen>].f32    raw float32 matrix (rows x dim), appended in batches and read through np.memmap
+    chunks[.<gen>].jsonl   metadata sidecar, one JSON line per row (source, offset, text)
+    manifest.json          row count, tombstones and the per-file registry, rewritten atomically
+
+The manifest is the commit point: rows past "count" (e.g. left by an interrupted ingestion)
+are invisible to readers and truncated before the next append. Deleting rows only records a
+tombstone range; compact() rewrites the live rows into the next generation of data files and
+switches the manifest over, keeping the previous generation until the following compaction so
+readers that still map it can finish.
+"""
+
+import json
+import os
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers are not serialized across processes
+    fcntl = None
+
+MANIFEST_FILE = "manifest.json"
+LOCK_FILE = "write.lock"
+COMPACT_BLOCK_ROWS = 65_536
+
+
+class StoreBusyError(RuntimeError):
+    pass
+
+
+@contextmanager
+def writer_lock(path, blocking=True):
+    """Serializes writers (ingestion, compaction) of a store directory across processes."""
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    with open(path / LOCK_FILE, "a") as f:
+        if fcntl is not None:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError as e:
+                raise StoreBusyError(f"Knowledge base at {path} is being written by another process") from e
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def data_paths(path, generation):
+    suffix = f".{generation}" if generation else ""
+    return Path(path) / f"vectors{suffix}.f32", Path(path) / f"chunks{suffix}.jsonl"
+
+
+class VectorStore:
+    def __init__(self, path, dim):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.dim = dim
+        self.manifest_path = self.path / MANIFEST_FILE
+        self._load()
+
+    def _manifest_stamp(self):
+        try:
+            stat = self.manifest_path.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _load(self):
+        manifest = {"dim": self.dim, "count": 0, "meta_bytes": 0, "generation": 0, "tombstones": [], "files": {}}
+        if self.manifest_path.exists():
+            with open(self.manifest_path, encoding="utf-8") as f:
+                manifest.update(json.load(f))
+        if manifest["count"] and manifest["dim"] != self.dim:
+            raise ValueError(
+                f"Knowledge base at {self.path} holds {manifest['dim']}-d vectors but the embedder "
+                f"produces {self.dim}-d ones; re-ingest with --reset"
+            )
+        self.count = manifest["count"]
+        self.meta_bytes = manifest["meta_bytes"]
+        self.generation = manifest["generation"]
+        self.tombstones = [tuple(span) for span in manifest["tombstones"]]
+        # {path: {"mtime_ns", "size", "sha256", "first_row", "rows"}} of every ingested file
+        self.files = manifest["files"]
+        self.vectors_path, self.chunks_path = data_paths(self.path, self.generation)
+        self._stamp = self._manifest_stamp()
+        self._pending_rows = 0
+        self._pending_bytes = 0
+        self._vectors = None
+        self._offsets = None
+        self._deleted = None
+
+    def refresh(self):
+        """Picks up changes committed by another process (e.g. the ingestion CLI)."""
+        if self._manifest_stamp() != self._stamp:
+            self._load()
+
+    def _write_manifest(self):
+        manifest = {
+            "dim": self.dim,
+            "count": self.count,
+            "meta_bytes": self.meta_bytes,
+            "generation": self.generation,
+            "tombstones": [list(span) for span in self.tombstones],
+            "files": self.files,
+        }
+        tmp_path = self.manifest_path.with_name(MANIFEST_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp_path, self.manifest_path)
+        self._stamp = self._manifest_stamp()
+
+    @property
+    def vectors(self):
+        """Read-only memory map of the committed rows (tombstoned rows included)."""
+        if self._vectors is None:
+            if self.count:
+                self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(self.count, self.dim))
+            else:
+                self._vectors = np.zeros((0, self.dim), dtype=np.float32)
+        return self._vectors
+
+    @property
+    def deleted(self):
+        """Boolean mask of tombstoned rows, or None when there are none."""
+        if self._deleted is None and self.tombstones:
+            self._deleted = np.zeros(self.count, dtype=bool)
+            for start, end in self.tombstones:
+                self._deleted[start:end] = True
+        return self._deleted
+
+    @property
+    def deleted_count(self):
+        return sum(end - start for start, end in self.tombstones)
+
+    def append(self, vectors, metadata, commit=True):
+        """
+        Appends a batch of rows; metadata is a list of JSON-serializable dicts, one per row.
+        With commit=False the rows stay invisible until commit(), so a whole file can be
+        added (and its registry entry updated) atomically.
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if vectors.shape != (len(metadata), self.dim):
+            raise ValueError(f"Expected {len(metadata)} x {self.dim} vectors, got {vectors.shape}")
+
+        lines = "".join(json.dumps(meta, ensure_ascii=False) + "\n" for meta in metadata).encode("utf-8")
+        with open(self.vectors_path, "ab") as f:
+            if not self._pending_rows:
+                f.truncate(self.count * self.dim * 4)
+            f.write(vectors.tobytes())
+        with open(self.chunks_path, "ab") as f:
+            if not self._pending_rows:
+                f.truncate(self.meta_bytes)
+            f.write(lines)
+
+        first_row = self.count + self._pending_rows
+        self._pending_rows += len(metadata)
+        self._pending_bytes += len(lines)
+        if commit:
+            self.commit()
+        return first_row
+
+    def delete_rows(self, start, end):
+        """Tombstones rows [start, end); takes effect on the next commit()."""
+        if end > start:
+            self.tombstones.append((start, end))
+            self._deleted = None
+
+    def commit(self):
+        self.count += self._pending_rows
+        self.meta_bytes += self._pending_bytes
+        self._pending_rows = 0
+        self._pending_bytes = 0
+        self._write_manifest()
+        self._vectors = None
+        self._offsets = None
+        self._deleted = None
+
+    def compact(self, block_rows=COMPACT_BLOCK_ROWS):
+        """
+        Rewrites the live rows into the next generation of data files, dropping tombstones.
+        Returns the number of rows removed. Callers must hold the writer lock.
+        """
+        deleted = self.deleted
+        if deleted is None:
+            return 0
+
+        generation = self.generation + 1
+        vectors_path, chunks_path = data_paths(self.path, generation)
+        keep = ~deleted
+        meta_bytes = 0
+        with open(vectors_path, "wb") as out:
+            for start in range(0, self.count, block_rows):
+                block = self.vectors[start : start + block_rows]
+                out.write(np.ascontiguousarray(block[keep[start : start + block_rows]]).tobytes())
+        with open(self.chunks_path, "rb") as src, open(chunks_path, "wb") as out:
+            for row in range(self.count):
+                line = src.readline()
+                if keep[row]:
+                    out.write(line)
+                    meta_bytes += len(line)
+
+        # Tombstones always cover whole files, so live files keep contiguous rows
+        removed_before = np.concatenate(([0], np.cumsum(deleted)))
+        for entry in self.files.values():
+            entry["first_row"] -= int(removed_before[entry["first_row"]])
+
+        removed = int(deleted.sum())
+        previous = self.generation
+        self.count -= removed
+        self.meta_bytes = meta_bytes
+        self.generation = generation
+        self.tombstones = []
+        self.vectors_path, self.chunks_path = vectors_path, chunks_path
+        self._write_manifest()
+        self._vectors = None
+        self._offsets = None
+        self._deleted = None
+
+        # The previous generation stays for readers still mapping it; older ones can go
+        for stale in range(previous):
+            for path in data_paths(self.path, stale):
+                try:
+                    path.unlink(missing_ok=True)
+                except OSError:
+                    pass
+        return removed
+
+    def _line_offsets(self):
+        if self._offsets is None:
+            offsets = [0]
+            with open(self.chunks_path, "rb") as f:
+                for line in f:
+                    offsets.append(offsets[-1] + len(line))
+            self._offsets = offsets[: self.count + 1]
+        return self._offsets
+
+    def metadata(self, rows):
+        """Reads the sidecar entries of the given rows (seeking straight to each line)."""
+        if not rows:
+            return []
+        offsets = self._line_offsets()
+        result = []
+        with open(self.chunks_path, "rb") as f:
+            for row in rows:
+                f.seek(offsets[row])
+                result.append(json.loads(f.readline()))
+        return result
+
+    def search(self, query, k, rows=None):
+        """
+        Top-k live rows by dot product with a normalized query vector. When rows is given,
+        only those rows are scored. Returns (rows, scores) sorted by decreasing score.
+        """
+        if rows is None:
+            rows = np.arange(self.count, dtype=np.int64)
+            scores = np.asarray(self.vectors @ query)
+        else:
+            rows = np.asarray(rows, dtype=np.int64)
+            scores = np.asarray(self.vectors[rows] @ query)
+
+        deleted = self.deleted
+        if deleted is not None:
+            live = ~deleted[rows]
+            rows, scores = rows[live], scores[live]
+        if scores.size == 0:
+            return rows, scores
+
+        k = min(k, scores.size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return rows[top], scores[top]
+
+    def reset(self):
+        for path in [*self.path.glob("vectors*.f32"), *self.path.glob("chunks*.jsonl"), self.manifest_path]:
+            path.unlink(missing_ok=True)
+        self._load()
+
+    def __len__(self):
+        """Number of live (not tombstoned) rows."""
+        return self.count - self.deleted_count
@@ -0,0 +1,214 @@
+"""
+One-shot migration of TinyDB JSON stores (calango.json, rinha_store.json) into the SQLite backend.
+
+Usage:
+    python -m calango.migrate [--source-dir DIR] [--batch-size N] [--force]
+
+The TinyDB files are parsed incrementally, so multi-hundred-MB histories are never held
+in memory as a whole. Documents keep their doc_ids, are inserted in batched transactions
+and every table is verified by row count and checksum afterwards.
+"""
+
+import argparse
+import hashlib
+import json
+import sys
+import time
+from pathlib import Path
+
+from tinydb.table import Document
+
+from calango.database import APP_DIR, SQLiteDatabase
+
+STORES = ("calango", "rinha_store")
+READ_CHUNK_SIZE = 1 << 20  # 1 MiB
+
+
+class TinyDBStreamReader:
+    """
+    Incremental reader for TinyDB's JSON layout: {"table": {"doc_id": {...}, ...}, ...}.
+    Yields one (table, doc_id, document) at a time while only buffering the current document.
+    """
+
+    def __init__(self, fp, chunk_size=READ_CHUNK_SIZE):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.bytes_read = 0
+
+    def _fill(self):
+        """Reads another chunk, dropping the consumed prefix. Returns False at end of file."""
+        if self.eof:
+            return False
+        chunk = self.fp.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.bytes_read += len(chunk.encode("utf-8"))
+        self.buffer = self.buffer[self.pos :] + chunk
+        self.pos = 0
+        return True
+
+    def _peek(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ""
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise ValueError(f"Malformed TinyDB file: expected {char!r} at offset {self.bytes_read}")
+        self.pos += 1
+
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                self.pos = end
+                return value
+            except json.JSONDecodeError:
+                # The value is split across chunks: read more and retry
+                if not self._fill():
+                    raise
+
+    def _members(self):
+        """Iterates the "key": value pairs of the object at the current position, parsing keys only."""
+        self._expect("{")
+        if self._peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self._value()
+            self._expect(":")
+            yield key
+            separator = self._peek()
+            self.pos += 1
+            if separator == "}":
+                return
+            if separator != ",":
+                raise ValueError(f"Malformed TinyDB file: unexpected {separator!r} at offset {self.bytes_read}")
+
+    def __iter__(self):
+        if self._peek() == "":
+            return
+        for table_name in self._members():
+            for doc_id in self._members():
+                yield table_name, int(doc_id), self._value()
+
+
+def _canonical(document):
+    return json.dumps(document, sort_keys=True, ensure_ascii=False)
+
+
+def migrate_store(source_path, target_db, batch_size=1000, force=False, log=print):
+    """
+    Streams one TinyDB file into a SQLiteDatabase.
+    Returns per-table stats: {"table": {"rows": n, "checksum": sha256, "verified": bool}}.
+    """
+    stats = {}
+    checksums = {}
+    pending = {}
+    started = time.perf_counter()
+    total_rows = 0
+
+    def flush(table_name):
+        docs = pending.pop(table_name, [])
+        if docs:
+            target_db.table(table_name).insert_multiple(docs)
+
+    with open(source_path, encoding="utf-8") as fp:
+        reader = TinyDBStreamReader(fp)
+        for table_name, doc_id, document in reader:
+            if table_name not in stats:
+                table = target_db.table(table_name)
+                if len(table):
+                    if not force:
+                        raise RuntimeError(
+                            f"Target table '{table_name}' already has data. Use --force to overwrite it."
+                        )
+                    table.truncate()
+                stats[table_name] = {"rows": 0}
+                checksums[table_name] = hashlib.sha256()
+
+            stats[table_name]["rows"] += 1
+            checksums[table_name].update(_canonical(document).encode("utf-8"))
+            pending.setdefault(table_name, []).append(Document(document, doc_id))
+            total_rows += 1
+
+            if len(pending[table_name]) >= batch_size:
+                flush(table_name)
+                rate = total_rows / (time.perf_counter() - started)
+                log(f"  {total_rows:,} rows | {reader.bytes_read / 1_048_576:.1f} MiB | {rate:,.0f} rows/s")
+
+        for table_name in list(pending):
+            flush(table_name)
+        bytes_read = reader.bytes_read
+
+    # --- Verification ---
+    for table_name, table_stats in stats.items():
+        target_digest = hashlib.sha256()
+        target_rows = 0
+        for document in target_db.table(table_name).iter_documents():
+            target_digest.update(_canonical(document).encode("utf-8"))
+            target_rows += 1
+
+        table_stats["checksum"] = checksums[table_name].hexdigest()
+        table_stats["verified"] = (
+            target_rows == table_stats["rows"] and target_digest.hexdigest() == table_stats["checksum"]
+        )
+
+    elapsed = max(time.perf_counter() - started, 1e-9)
+    log(
+        f"  Done: {total_rows:,} rows, {bytes_read / 1_048_576:.1f} MiB in {elapsed:.2f}s "
+        f"({total_rows / elapsed:,.0f} rows/s, {bytes_read / 1_048_576 / elapsed:.1f} MiB/s)"
+    )
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Migrate Calango TinyDB JSON files to the SQLite storage backend.")
+    parser.add_argument("--source-dir", type=Path, default=APP_DIR, help="Folder containing the .json stores")
+    parser.add_argument("--target-dir", type=Path, default=None, help="Folder for the .db files (default: source)")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Documents per insert transaction")
+    parser.add_argument("--force", action="store_true", help="Overwrite tables that already exist in the target")
+    args = parser.parse_args(argv)
+
+    target_dir = args.target_dir or args.source_dir
+    failed = False
+
+    for store in STORES:
+        source_path = args.source_dir / f"{store}.json"
+        if not source_path.exists():
+            print(f"⏭️  {source_path} not found, skipping.")
+            continue
+
+        print(f"🦎 Migrating {source_path} -> {target_dir / f'{store}.db'}")
+        target_db = SQLiteDatabase(target_dir / f"{store}.db")
+        try:
+            stats = migrate_store(source_path, target_db, batch_size=args.batch_size, force=args.force)
+        except (RuntimeError, ValueError, json.JSONDecodeError) as e:
+            print(f"❌ {store}: {e}")
+            failed = True
+            continue
+        finally:
+            target_db.close()
+
+        for table_name, table_stats in stats.items():
+            status = "✅" if table_stats["verified"] else "❌"
+            print(f"  {status} {table_name}: {table_stats['rows']:,} rows (sha256 {table_stats['checksum'][:12]})")
+            failed = failed or not table_stats["verified"]
+
+    if not failed:
+        print('Set CALANGO_STORAGE="sqlite" to start using the migrated data.')
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
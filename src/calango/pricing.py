@@ -0,0 +1,179 @@
+"""
+Pricing catalog used for cost accounting.
+
+Prices are merged from (lowest to highest priority) litellm's model cost map, the bundled
+pricing.yaml and an optional user file (~/.calango/pricing.yaml, or CALANGO_PRICING_FILE).
+YAML and JSON files are both accepted. The merged catalog is compiled once per process into
+plain dicts, so pricing a request is a couple of hash lookups.
+"""
+
+import os
+from functools import lru_cache
+from pathlib import Path
+from typing import NamedTuple
+
+import yaml
+
+from calango.database import APP_DIR
+
+BUNDLED_CATALOG_PATH = Path(__file__).parent / "pricing.yaml"
+USER_CATALOG_PATH = Path(os.getenv("CALANGO_PRICING_FILE", APP_DIR / "pricing.yaml"))
+# litellm's map covers most hosted models; disable with CALANGO_PRICING_LITELLM=0
+USE_LITELLM_COSTS = os.getenv("CALANGO_PRICING_LITELLM", "1").lower() not in ("0", "false", "no")
+
+# Used when a model is not in any source and the catalog has no "default" entry
+FALLBACK_INPUT_PER_M = 0.15
+FALLBACK_OUTPUT_PER_M = 0.60
+WILDCARD = "*"
+
+
+class ModelPrice(NamedTuple):
+    """USD per token for prompt (input) and completion (output) tokens."""
+
+    input_per_token: float
+    output_per_token: float
+
+    def cost(self, prompt_tokens, completion_tokens):
+        return prompt_tokens * self.input_per_token + completion_tokens * self.output_per_token
+
+
+class PricingCatalog:
+    def __init__(self, default, by_provider=None, by_model=None):
+        """
+        default: ModelPrice for unknown models.
+        by_provider: {(provider, model): ModelPrice}, model may be "*" for provider-wide prices.
+        by_model: {model: ModelPrice} for entries that apply to any provider.
+        """
+        self.default = default
+        self.by_provider = by_provider or {}
+        self.by_model = by_model or {}
+
+    def price(self, provider, model):
+        """Resolves a price: provider/model -> model -> provider/* -> default."""
+        provider = (provider or "").strip().lower()
+        model = (model or "").strip().lower()
+        # Models are sometimes given in litellm's "provider/model" form
+        if provider and model.startswith(f"{provider}/"):
+            model = model[len(provider) + 1 :]
+
+        return (
+            self.by_provider.get((provider, model))
+            or self.by_model.get(model)
+            or self.by_provider.get((provider, WILDCARD))
+            or self.default
+        )
+
+    def cost(self, provider, model, prompt_tokens, completion_tokens):
+        return self.price(provider, model).cost(prompt_tokens, completion_tokens)
+
+
+def _split_key(key):
+    provider, _, model = key.strip().lower().partition("/")
+    if not model:
+        return "", provider
+    return provider, model
+
+
+def _price_from_entry(entry):
+    """Accepts per-million (input_per_m/output_per_m) or litellm-style per-token fields."""
+    if "input_per_m" in entry or "output_per_m" in entry:
+        return ModelPrice(
+            float(entry.get("input_per_m", 0.0)) / 1_000_000,
+            float(entry.get("output_per_m", 0.0)) / 1_000_000,
+        )
+    return ModelPrice(
+        float(entry.get("input_cost_per_token", 0.0)),
+        float(entry.get("output_cost_per_token", 0.0)),
+    )
+
+
+def _load_file(path):
+    """Reads a YAML/JSON catalog file. Returns {} when missing or unreadable."""
+    if not path.exists():
+        return {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = yaml.safe_load(f) or {}
+    except (OSError, yaml.YAMLError) as e:
+        print(f"⚠️ Pricing catalog '{path}' ignored: {e}")
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def _litellm_prices(by_provider, by_model):
+    try:
+        from litellm import model_cost
+    except ImportError:
+        return
+
+    for key, info in model_cost.items():
+        if not isinstance(info, dict) or info.get("mode", "chat") not in ("chat", "completion"):
+            continue
+        input_cost = info.get("input_cost_per_token")
+        output_cost = info.get("output_cost_per_token")
+        if not isinstance(input_cost, (int, float)) or not isinstance(output_cost, (int, float)):
+            continue
+
+        price = ModelPrice(float(input_cost), float(output_cost))
+        provider = str(info.get("litellm_provider", "")).lower()
+        key = key.lower()
+        model = key[len(provider) + 1 :] if key.startswith(f"{provider}/") else key
+        by_provider[(provider, model)] = price
+        # Only unprefixed keys are the canonical names (e.g. "gpt-4o", not "azure/gpt-4o")
+        if "/" not in key:
+            by_model.setdefault(model, price)
+
+
+def build_catalog(paths=(), use_litellm=False):
+    """Compiles a PricingCatalog from litellm (optional) and catalog files, later paths winning."""
+    default = ModelPrice(FALLBACK_INPUT_PER_M / 1_000_000, FALLBACK_OUTPUT_PER_M / 1_000_000)
+    by_provider = {}
+    by_model = {}
+
+    for path in paths:
+        data = _load_file(Path(path))
+        if isinstance(data.get("default"), dict):
+            default = _price_from_entry(data["default"])
+        for key, entry in (data.get("models") or {}).items():
+            if not isinstance(entry, dict):
+                continue
+            provider, model = _split_key(key)
+            if provider:
+                by_provider[(provider, model)] = _price_from_entry(entry)
+            else:
+                by_model[model] = _price_from_entry(entry)
+
+    if use_litellm:
+        litellm_by_provider = {}
+        litellm_by_model = {}
+        _litellm_prices(litellm_by_provider, litellm_by_model)
+        # A bare "model" entry in a file must also beat litellm's provider-specific price
+        by_provider = {
+            **{key: price for key, price in litellm_by_provider.items() if key[1] not in by_model},
+            **by_provider,
+        }
+        by_model = {**litellm_by_model, **by_model}
+
+    return PricingCatalog(default, by_provider, by_model)
+
+
+@lru_cache(maxsize=1)
+def get_catalog():
+    """The process-wide catalog, built on first use."""
+    return build_catalog((BUNDLED_CATALOG_PATH, USER_CATALOG_PATH), use_litellm=USE_LITELLM_COSTS)
+
+
+@lru_cache(maxsize=512)
+def get_price(provider, model):
+    return get_catalog().price(provider, model)
+
+
+def cost_usd(provider, model, prompt_tokens, completion_tokens):
+    """USD cost of a request for the given provider/model."""
+    return get_price(provider, model).cost(prompt_tokens, completion_tokens)
+
+
+def reload():
+    """Rebuilds the catalog on next use (e.g. after editing the pricing file)."""
+    get_catalog.cache_clear()
+    get_price.cache_clear()
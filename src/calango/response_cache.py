@@ -0,0 +1,109 @@
+"""
+Opt-in cache of complete replies for identical requests.
+
+Entries are keyed on provider, model, the normalized messages and the completion
+parameters, stored in a local SQLite file and evicted by age (TTL) and by count (least
+recently used first). Enable it with CALANGO_RESPONSE_CACHE=1.
+"""
+
+import hashlib
+import json
+import os
+import time
+
+from calango.database import APP_DIR, close_sqlite_connection, get_sqlite_connection
+
+RESPONSE_CACHE_ENABLED = os.getenv("CALANGO_RESPONSE_CACHE", "0") == "1"
+RESPONSE_CACHE_PATH = APP_DIR / "response_cache.db"
+RESPONSE_CACHE_TTL = int(os.getenv("CALANGO_RESPONSE_CACHE_TTL", str(7 * 24 * 3600)))  # seconds
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("CALANGO_RESPONSE_CACHE_MAX", "1000"))
+
+
+def cache_key(provider, model, messages, params=None):
+    """
+    Stable key for a request. Messages are reduced to role + content with surrounding
+    whitespace stripped, so cosmetic differences still hit the same entry.
+    """
+    normalized = {
+        "provider": (provider or "").strip().lower(),
+        "model": (model or "").strip(),
+        "messages": [[m.get("role"), (m.get("content") or "").strip()] for m in messages],
+        "params": params or {},
+    }
+    payload = json.dumps(normalized, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path=RESPONSE_CACHE_PATH, ttl=RESPONSE_CACHE_TTL, max_entries=RESPONSE_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # One connection per file, shared by the caches of every engine (see get_sqlite_connection)
+        self.conn, self.lock = get_sqlite_connection(path)
+        with self.lock, self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, provider TEXT, model TEXT, content TEXT NOT NULL, usage TEXT, "
+                "created_at REAL NOT NULL, last_hit REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS ix_responses_last_hit ON responses (last_hit)")
+
+    def get(self, key):
+        """Returns {"content", "usage"} for a fresh entry, or None (expired entries are dropped)."""
+        now = time.time()
+        with self.lock, self.conn:
+            row = self.conn.execute("SELECT content, usage, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            content, usage, created_at = row
+            if self.ttl > 0 and now - created_at > self.ttl:
+                self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            self.conn.execute("UPDATE responses SET last_hit = ?, hits = hits + 1 WHERE key = ?", (now, key))
+        return {"content": content, "usage": json.loads(usage) if usage else None}
+
+    def put(self, key, provider, model, content, usage=None):
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, provider, model, content, usage, created_at, last_hit, hits) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, 0)",
+                (key, provider, model, content, json.dumps(usage) if usage else None, now, now),
+            )
+            self._evict(now)
+
+    def _evict(self, now):
+        if self.ttl > 0:
+            self.conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+        if self.max_entries > 0:
+            self.conn.execute(
+                "DELETE FROM responses WHERE key IN "
+                "(SELECT key FROM responses ORDER BY last_hit DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def clear(self):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM responses")
+
+    def close(self):
+        """Closes the file's shared connection (also done by close_databases)."""
+        close_sqlite_connection(self.path)
+
+
+def replay_chunks(content, chunk_size=24):
+    """Splits a cached reply into stream-like chunks, cutting after whitespace where possible."""
+    start = 0
+    while start < len(content):
+        end = min(start + chunk_size, len(content))
+        if end < len(content):
+            cut = content.rfind(" ", start, end)
+            if cut > start:
+                end = cut + 1
+        yield content[start:end]
+        start = end
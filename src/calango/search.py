@@ -0,0 +1,156 @@
+"""
+Full-text index over the chat history (user prompts and replies).
+
+Messages live in an SQLite FTS5 table (unicode61 tokenizer without diacritics, so "acao"
+finds "ação") next to a plain `entries` table holding the record/session ids, indexed by
+session so deleting a conversation doesn't scan the index. The interaction writer adds
+every batch it stores; adds are idempotent per (record, role), so a rebuild racing with
+the writer never duplicates hits.
+
+The index is a derived cache: it lives in its own file next to the database it indexes
+(<database file>.search.db) and is rebuilt from the history whenever it is missing, its
+version changes or an add failed (see mark_dirty).
+"""
+
+import itertools
+import re
+import sqlite3
+import threading
+
+SEARCH_INDEX_VERSION = "1"
+SNIPPET_TOKENS = 12
+
+_TERM_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def match_expression(text):
+    """
+    Turns free text into a safe FTS5 query: every word must match, the last one as a prefix
+    (so results update while typing). Returns None when there is nothing to search for.
+    """
+    terms = _TERM_RE.findall(text or "")
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+class HistorySearchIndex:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self._dirty = False
+        self.conn = sqlite3.connect(str(path), check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "id INTEGER PRIMARY KEY, record_id TEXT NOT NULL, role TEXT NOT NULL, session_id TEXT, timestamp TEXT, "
+                "UNIQUE (record_id, role))"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS ix_entries_session ON entries (session_id)")
+            self.conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS messages USING fts5("
+                "content, tokenize = 'unicode61 remove_diacritics 2')"
+            )
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    def _add(self, entries):
+        for record_id, role, session_id, timestamp, content in entries:
+            if not content:
+                continue
+            cursor = self.conn.execute(
+                "INSERT OR IGNORE INTO entries (record_id, role, session_id, timestamp) VALUES (?, ?, ?, ?)",
+                (record_id, role, session_id, timestamp),
+            )
+            if cursor.rowcount:
+                self.conn.execute("INSERT INTO messages (rowid, content) VALUES (?, ?)", (cursor.lastrowid, content))
+
+    def add(self, entries):
+        """Indexes (record_id, role, session_id, timestamp, content) tuples; known ones are skipped."""
+        with self.lock, self.conn:
+            self._add(entries)
+
+    def remove_sessions(self, session_ids):
+        with self.lock, self.conn:
+            for session_id in session_ids:
+                rowids = [
+                    (row[0],) for row in self.conn.execute("SELECT id FROM entries WHERE session_id = ?", (session_id,))
+                ]
+                self.conn.executemany("DELETE FROM messages WHERE rowid = ?", rowids)
+                self.conn.execute("DELETE FROM entries WHERE session_id = ?", (session_id,))
+
+    def mark_dirty(self):
+        """
+        Flags the index as missing entries (e.g. after a failed add), so the next is_built()
+        is False and it gets rebuilt. Other processes see it too when the file is writable.
+        """
+        self._dirty = True
+        try:
+            with self.lock, self.conn:
+                self.conn.execute("DELETE FROM meta WHERE key = 'version'")
+        except sqlite3.Error:
+            pass
+
+    def is_built(self):
+        if self._dirty:
+            return False
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return row is not None and row[0] == SEARCH_INDEX_VERSION
+
+    def rebuild(self, entries, batch_size=5000):
+        """Replaces the whole index with `entries` (an iterable, consumed in one transaction)."""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM messages")
+            self.conn.execute("DELETE FROM entries")
+            # The tables are empty: ids are assigned here and rows go in with executemany
+            seen = set()
+            for batch in itertools.batched(entries, batch_size):
+                rows = []
+                for record_id, role, session_id, timestamp, content in batch:
+                    if content and (record_id, role) not in seen:
+                        seen.add((record_id, role))
+                        rows.append((len(seen), record_id, role, session_id, timestamp, content))
+                self.conn.executemany(
+                    "INSERT INTO entries (id, record_id, role, session_id, timestamp) VALUES (?, ?, ?, ?, ?)",
+                    [row[:5] for row in rows],
+                )
+                self.conn.executemany(
+                    "INSERT INTO messages (rowid, content) VALUES (?, ?)", [(row[0], row[5]) for row in rows]
+                )
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)", (SEARCH_INDEX_VERSION,))
+            self._dirty = False
+        with self.lock:
+            self.conn.execute("INSERT INTO messages (messages) VALUES ('optimize')")
+            self.conn.commit()
+
+    def search(self, text, limit=20, offset=0):
+        """
+        Best-ranked (bm25) messages matching text:
+        [{"record_id", "role", "session_id", "timestamp", "snippet"}], matches wrapped in **.
+        """
+        expression = match_expression(text)
+        if expression is None:
+            return []
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT e.record_id, e.role, e.session_id, e.timestamp, "
+                f"snippet(messages, 0, '**', '**', '…', {SNIPPET_TOKENS}) "
+                "FROM messages JOIN entries e ON e.id = messages.rowid "
+                "WHERE messages MATCH ? ORDER BY rank LIMIT ? OFFSET ?",
+                (expression, limit, offset),
+            ).fetchall()
+        return [
+            {"record_id": record_id, "role": role, "session_id": session_id, "timestamp": timestamp, "snippet": snippet}
+            for record_id, role, session_id, timestamp, snippet in rows
+        ]
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
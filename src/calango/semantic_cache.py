@@ -0,0 +1,435 @@
+"""
+Opt-in semantic cache: near-identical questions are answered with an earlier reply.
+
+The opening question of a conversation is embedded and compared (cosine similarity) with
+the questions already answered for the same provider, model and persona. When the best
+match reaches the threshold its reply is replayed instead of calling the API. Follow-up
+turns always go to the model, since their meaning depends on the conversation so far.
+
+Entries (with their vectors) are appended to a JSON-lines file in ~/.calango/semantic_cache/
+and read into an in-memory matrix; every process picks up lines appended by others, and the
+file is only rewritten to drop evicted entries. One cache per directory is shared by the
+whole process (see get_semantic_cache).
+
+Cosine similarity alone happily matches questions that differ in their one important word
+("... in Python?" vs "... in Rust?"), so a hit also needs both questions to use the same
+content words, up to spelling variants. The cache needs a real embedding model: install the
+`semantic` extra and enable it with CALANGO_SEMANTIC_CACHE=1 and
+CALANGO_EMBEDDER=sentence-transformers:<model>. The default hashing embedder (words and
+character trigrams, CPU only) only measures lexical overlap and is not accepted for it.
+"""
+
+import atexit
+import base64
+import hashlib
+import importlib.util
+import json
+import os
+import re
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from calango.database import APP_DIR
+
+SEMANTIC_CACHE_ENABLED = os.getenv("CALANGO_SEMANTIC_CACHE", "0") == "1"
+SEMANTIC_CACHE_DIR = APP_DIR / "semantic_cache"
+SEMANTIC_THRESHOLD = float(os.getenv("CALANGO_SEMANTIC_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("CALANGO_SEMANTIC_CACHE_MAX", "2000"))
+EMBEDDER = os.getenv("CALANGO_EMBEDDER", "hashing")
+
+# One JSON line per cached reply, its vector included (base64 float32)
+ENTRIES_FILE = "entries.jsonl"
+STATS_FILE = "stats.json"
+# Hit/miss counters are written to STATS_FILE at most this often (seconds), and at exit
+STATS_WRITE_INTERVAL = 5.0
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+# Words that don't change what is being asked (English and Portuguese)
+STOPWORDS = frozenset(
+    """
+    a an the and or of to in on at for with by from as is are was were be been do does did can could
+    would should will shall may might must i me my you your we our it its this that these those what
+    which who whom how why when where please there here some any about into
+    o os as um uma uns umas de do da dos das e ou em no na nos nas por para com se que qual quais
+    como quando onde eu me meu minha voce você seu sua isso isto esse essa este esta ao aos pelo pela
+    é ser foi são está estão pode poderia por favor
+    """.split()
+)
+# Shared character trigrams (Jaccard) for two words to count as spelling variants
+SPELLING_SIMILARITY = 0.5
+
+
+class HashingEmbedder:
+    """
+    Feature-hashing embedder over words, word bigrams and character trigrams. Similarity
+    reflects shared spelling, not meaning.
+    """
+
+    def __init__(self, dim=512):
+        self.dim = dim
+
+    def _features(self, text):
+        words = _WORD_RE.findall(text.lower())
+        yield from words
+        yield from (f"{a} {b}" for a, b in zip(words, words[1:], strict=False))
+        for word in words:
+            padded = f"#{word}#"
+            yield from (padded[i : i + 3] for i in range(len(padded) - 2))
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+                # The top bit picks the sign, so colliding features tend to cancel out
+                vectors[row, digest % self.dim] += 1.0 if digest >> 63 else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1.0, norms)
+
+
+class SentenceTransformerEmbedder:
+    """Local sentence-transformers model (the `semantic` extra)."""
+
+    def __init__(self, model_name="all-MiniLM-L6-v2"):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise RuntimeError(
+                "CALANGO_EMBEDDER needs sentence-transformers: pip install 'calango-ai[semantic]'"
+            ) from e
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def embed(self, texts):
+        return np.asarray(self.model.encode(list(texts), normalize_embeddings=True), dtype=np.float32)
+
+
+def get_embedder(spec=EMBEDDER):
+    """Builds an embedder from a spec: "hashing" or "sentence-transformers[:<model>]"."""
+    name, _, arg = spec.partition(":")
+    if name == "hashing":
+        return HashingEmbedder(int(arg) if arg else 512)
+    if name == "sentence-transformers":
+        return SentenceTransformerEmbedder(arg) if arg else SentenceTransformerEmbedder()
+    raise ValueError(f"Unknown embedder '{spec}'")
+
+
+def embedder_problem(spec=EMBEDDER):
+    """
+    Why an embedder spec can't back the semantic cache (None when it can), checked without
+    loading the model: lexical embedders would serve answers to different questions.
+    """
+    name = spec.partition(":")[0]
+    if name == "hashing":
+        return (
+            "it needs an embedding model: install the `semantic` extra and set "
+            "CALANGO_EMBEDDER=sentence-transformers:all-MiniLM-L6-v2"
+        )
+    if name == "sentence-transformers" and importlib.util.find_spec("sentence_transformers") is None:
+        return "sentence-transformers is not installed: pip install 'calango-ai[semantic]'"
+    return None
+
+
+def cache_scope(provider, model, persona):
+    """Replies are only shared between requests to the same provider, model and persona."""
+    return f"{(provider or '').strip().lower()}/{(model or '').strip()}/{persona or ''}"
+
+
+def semantic_query(messages):
+    """The question to embed, or None when the request is not an opening question."""
+    if any(m.get("role") == "assistant" for m in messages):
+        return None
+    user_turns = [m for m in messages if m.get("role") == "user"]
+    if len(user_turns) != 1:
+        return None
+    return (user_turns[0].get("content") or "").strip() or None
+
+
+def _terms(text):
+    return {word for word in _WORD_RE.findall(text.lower()) if word not in STOPWORDS}
+
+
+def _trigrams(word):
+    padded = f"#{word}#"
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def _spelling_variants(a, b):
+    ta, tb = _trigrams(a), _trigrams(b)
+    return len(ta & tb) / len(ta | tb) >= SPELLING_SIMILARITY
+
+
+def same_terms(a, b):
+    """
+    True when two questions use the same content words, ignoring case, punctuation, word
+    order, stop words and spelling variants (plurals, typos). A content word with no close
+    counterpart in the other question ("Python" vs "Rust", "8601" vs "8602") makes them different.
+    """
+    terms_a, terms_b = _terms(a), _terms(b)
+    only_a, only_b = terms_a - terms_b, terms_b - terms_a
+    return all(any(_spelling_variants(x, y) for y in only_b) for x in only_a) and all(
+        any(_spelling_variants(y, x) for x in only_a) for y in only_b
+    )
+
+
+def _write_json(path, data):
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def read_stats(path=SEMANTIC_CACHE_DIR):
+    """Hit/miss counters of a cache directory, readable without loading the index."""
+    stats = {"hits": 0, "misses": 0, "saved_tokens": 0}
+    stats_path = Path(path) / STATS_FILE
+    if stats_path.exists():
+        try:
+            with open(stats_path, encoding="utf-8") as f:
+                stats.update(json.load(f))
+        except (OSError, ValueError):
+            pass
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+    return stats
+
+
+_CACHES = {}
+_CACHES_LOCK = threading.Lock()
+
+
+def get_semantic_cache(path=SEMANTIC_CACHE_DIR):
+    """
+    The process-wide semantic cache for a directory, shared by every engine (Streamlit
+    rebuilds the engine on each rerun). None when CALANGO_EMBEDDER can't back it (see
+    embedder_problem).
+    """
+    key = str(Path(path).resolve())
+    with _CACHES_LOCK:
+        if key not in _CACHES:
+            problem = embedder_problem()
+            if problem:
+                print(f"⚠️ Semantic cache disabled: {problem}")
+                _CACHES[key] = None
+            else:
+                _CACHES[key] = SemanticCache(path, get_embedder())
+        return _CACHES[key]
+
+
+@atexit.register
+def _flush_shared_stats():
+    with _CACHES_LOCK:
+        caches = [cache for cache in _CACHES.values() if cache is not None]
+    for cache in caches:
+        cache.flush_stats()
+
+
+def _encode_vector(vector):
+    return base64.b64encode(np.ascontiguousarray(vector, dtype=np.float32).tobytes()).decode("ascii")
+
+
+def _decode_vector(text):
+    return np.frombuffer(base64.b64decode(text), dtype=np.float32)
+
+
+class SemanticCache:
+    def __init__(
+        self,
+        path=SEMANTIC_CACHE_DIR,
+        embedder=None,
+        threshold=SEMANTIC_THRESHOLD,
+        max_entries=SEMANTIC_CACHE_MAX_ENTRIES,
+    ):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.entries_path = self.path / ENTRIES_FILE
+        self.embedder = embedder or get_embedder()
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        # Last embedded question, so a miss followed by add() embeds only once
+        self._last = (None, None)
+        with self.lock:
+            self._reset()
+            self._sync()
+        stats = read_stats(self.path)
+        self.stats = {key: stats[key] for key in ("hits", "misses", "saved_tokens")}
+        self._stats_dirty = False
+        self._stats_written = None  # monotonic time of the last write
+
+    def _reset(self):
+        self._entries = []
+        self._matrix = np.zeros((64, self.embedder.dim), dtype=np.float32)
+        self._scopes = np.empty(64, dtype=object)
+        # Oldest row still served: rows before it are evicted (dropped on the next compaction)
+        self._start = 0
+        # Position in the entries file and its identity (a compaction replaces the file)
+        self._offset = 0
+        self._inode = None
+
+    def _write_lines(self, entries):
+        """Atomically replaces the entries file."""
+        tmp_path = self.entries_path.with_name(ENTRIES_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries)
+        os.replace(tmp_path, self.entries_path)
+
+    def _append_rows(self, entries, vectors):
+        count = len(self._entries)
+        needed = count + len(entries)
+        if needed > len(self._matrix):
+            capacity = max(needed, 2 * len(self._matrix))
+            matrix = np.zeros((capacity, self.embedder.dim), dtype=np.float32)
+            matrix[:count] = self._matrix[:count]
+            scopes = np.empty(capacity, dtype=object)
+            scopes[:count] = self._scopes[:count]
+            self._matrix, self._scopes = matrix, scopes
+        self._matrix[count:needed] = vectors
+        self._scopes[count:needed] = [entry["scope"] for entry in entries]
+        self._entries.extend(entries)
+        if self.max_entries > 0:
+            self._start = max(self._start, needed - self.max_entries)
+
+    def _sync(self):
+        """Reads the entries appended since the last read, by this process or another one."""
+        try:
+            stat = self.entries_path.stat()
+        except FileNotFoundError:
+            if self._entries:
+                self._reset()
+            return
+        if stat.st_ino != self._inode or stat.st_size < self._offset:
+            # Compacted (or recreated) elsewhere: start over
+            self._reset()
+            self._inode = stat.st_ino
+        if stat.st_size == self._offset:
+            return
+
+        with open(self.entries_path, "rb") as f:
+            f.seek(self._offset)
+            data = f.read(stat.st_size - self._offset)
+        # A writer may be in the middle of a line: only complete lines are read
+        data = data[: data.rfind(b"\n") + 1]
+        self._offset += len(data)
+
+        entries, vectors = [], []
+        for line in data.splitlines():
+            try:
+                entry = json.loads(line)
+                vector = _decode_vector(entry.pop("vector"))
+            except (ValueError, KeyError):
+                continue
+            # Entries from another embedder (dimension) are meaningless here
+            if vector.shape == (self.embedder.dim,):
+                entries.append(entry)
+                vectors.append(vector)
+        if entries:
+            self._append_rows(entries, np.stack(vectors))
+
+    def _compact(self):
+        """
+        Rewrites the file without evicted entries once they make up half of it. A reply another
+        process appends during the rewrite may be lost, which a cache can afford.
+        """
+        if self._start < max(self.max_entries, 1):
+            return
+        entries = self._entries[self._start :]
+        vectors = self._matrix[self._start : len(self._entries)].copy()
+        self._write_lines({**entry, "vector": _encode_vector(v)} for entry, v in zip(entries, vectors, strict=True))
+        self._reset()
+        self._sync()
+
+    @property
+    def entries(self):
+        """Entries currently served, oldest first."""
+        return self._entries[self._start :]
+
+    @property
+    def vectors(self):
+        return self._matrix[self._start : len(self._entries)]
+
+    def _embed(self, text):
+        if self._last[0] == text:
+            return self._last[1]
+        vector = self.embedder.embed([text])[0]
+        self._last = (text, vector)
+        return vector
+
+    def lookup(self, scope, text):
+        """
+        Returns the cached entry most similar to text within scope that asks the same thing
+        (see same_terms), or None when no entry reaches the threshold.
+        """
+        with self.lock:
+            self._sync()
+            vector = self._embed(text)
+            best = None
+            candidates = np.flatnonzero(self._scopes[self._start : len(self._entries)] == scope) + self._start
+            if candidates.size:
+                scores = self._matrix[candidates] @ vector
+                for top in np.argsort(-scores):
+                    if scores[top] < self.threshold:
+                        break
+                    entry = self._entries[candidates[top]]
+                    if same_terms(text, entry["query"]):
+                        best = {**entry, "similarity": float(scores[top])}
+                        break
+
+            if best:
+                self.stats["hits"] += 1
+                self.stats["saved_tokens"] += int(best.get("saved_tokens") or 0)
+            else:
+                self.stats["misses"] += 1
+            self._stats_dirty = True
+            now = time.monotonic()
+            if self._stats_written is None or now - self._stats_written >= STATS_WRITE_INTERVAL:
+                self._write_stats(now)
+            return best
+
+    def _write_stats(self, now):
+        try:
+            _write_json(self.path / STATS_FILE, self.stats)
+        except OSError as e:
+            print(f"⚠️ Semantic cache stats not saved: {e}")
+        self._stats_dirty = False
+        self._stats_written = now
+
+    def flush_stats(self):
+        """Writes counters not saved yet (lookups only write them every STATS_WRITE_INTERVAL)."""
+        with self.lock:
+            if self._stats_dirty:
+                self._write_stats(time.monotonic())
+
+    def add(self, scope, text, content, saved_tokens=0):
+        """
+        Appends a reply to the entries file (a single write, so concurrent writers never
+        clobber each other). Beyond max_entries the oldest entries stop being served.
+        """
+        with self.lock:
+            entry = {
+                "scope": scope,
+                "query": text,
+                "content": content,
+                "saved_tokens": saved_tokens,
+                "created_at": time.time(),
+                "vector": _encode_vector(self._embed(text)),
+            }
+            with open(self.entries_path, "ab") as f:
+                f.write((json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8"))
+            self._sync()
+            self._compact()
+
+    def __len__(self):
+        return len(self._entries) - self._start
+
+    def get_stats(self):
+        with self.lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "entries": len(self),
+                "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+            }
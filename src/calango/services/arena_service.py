@@ -1,11 +1,13 @@
+import asyncio
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
-from tinydb import Query
+from calango.pricing import cost_usd
+from calango.tokenizer import count_tokens
 
-try:
-    import tiktoken
-except ImportError:
-    tiktoken = None
+# Upper bound for fighters streaming at the same time (the UI allows up to 4)
+MAX_CONCURRENT_FIGHTERS = 4
 
 
 class ArenaService:
@@ -18,23 +20,18 @@ class ArenaService:
         self.interaction_manager = interaction_manager
         self.persistence_adapter = persistence_adapter
 
-    def calculate_usage(self, model_name, prompt_text, response_text):
+    def calculate_usage(self, model_name, prompt_text, response_text, provider=None):
         """Same token calculation logic as ChatService for consistency."""
-        if tiktoken:
-            try:
-                encoding = tiktoken.encoding_for_model(model_name)
-            except KeyError:
-                encoding = tiktoken.get_encoding("cl100k_base")
-            prompt_tokens = len(encoding.encode(prompt_text))
-            completion_tokens = len(encoding.encode(response_text))
-        else:
-            prompt_tokens = len(prompt_text) // 4
-            completion_tokens = len(response_text) // 4
+        # Encodings come from the shared registry (loaded once per process)
+        prompt_tokens = count_tokens(prompt_text, model_name)
+        completion_tokens = count_tokens(response_text, model_name)
+
+        return self._usage_from_counts(prompt_tokens, completion_tokens, provider, model_name)
 
+    @staticmethod
+    def _usage_from_counts(prompt_tokens, completion_tokens, provider=None, model=None):
         total_tokens = prompt_tokens + completion_tokens
-        input_price_per_m = 0.15
-        output_price_per_m = 0.60
-        cost = (prompt_tokens * input_price_per_m / 1_000_000) + (completion_tokens * output_price_per_m / 1_000_000)
+        cost = cost_usd(provider, model, prompt_tokens, completion_tokens)
 
         return {
             "prompt_tokens": prompt_tokens,
@@ -43,107 +40,212 @@ class ArenaService:
             "cost_usd": cost,
         }
 
-    def run_battle_round(self, prompt, contenders, system_prompt, persona_name):
+    def _fight(self, contender, messages, persona_name, interaction_id):
+        """
+        Streams a single contender to completion.
+        Returns (full_response, error, reported_usage) so errors can be classified on the caller side.
+        """
+        full_response = ""
+        reported_usage = {}
+        try:
+            gen = self.engine.run_chat(
+                provider_name=contender["provider"],
+                model_name=contender["model"],
+                messages=messages,
+                session_id="rinha-mode",
+                persona_name=persona_name,
+                is_new_session=False,
+                interaction_id=interaction_id,
+                on_usage=reported_usage.update,
+            )
+
+            for chunk in gen:
+                full_response += self._check_chunk(chunk)
+        except Exception as e:
+            return full_response, e, reported_usage
+
+        return full_response, None, reported_usage
+
+    async def _fight_async(self, contender, messages, persona_name, interaction_id):
+        """Async counterpart of _fight, streaming through engine.run_chat_async."""
+        full_response = ""
+        reported_usage = {}
+        try:
+            gen = self.engine.run_chat_async(
+                provider_name=contender["provider"],
+                model_name=contender["model"],
+                messages=messages,
+                session_id="rinha-mode",
+                persona_name=persona_name,
+                is_new_session=False,
+                interaction_id=interaction_id,
+                on_usage=reported_usage.update,
+            )
+
+            async for chunk in gen:
+                full_response += self._check_chunk(chunk)
+        except Exception as e:
+            return full_response, e, reported_usage
+
+        return full_response, None, reported_usage
+
+    @staticmethod
+    def _check_chunk(chunk):
+        """Returns the chunk as text, raising if the stream leaked an error."""
+        chunk_str = str(chunk) if chunk is not None else ""
+
+        # Detect error messages early (before adding to response)
+        # All errors from core.py start with "Error:"
+        if chunk_str.startswith("Error:"):
+            raise Exception(chunk_str.replace("Error: ", ""))
+
+        # Additional detection for quota errors in stream content
+        chunk_lower = chunk_str.lower()
+        is_quota_error = (
+            ("error" in chunk_lower and "429" in chunk_lower)
+            or ("quota" in chunk_lower and "exceeded" in chunk_lower)
+            or ("resource_exhausted" in chunk_lower)
+        )
+
+        if is_quota_error:
+            raise Exception("Quota Exceeded (Detected in Stream)")
+
+        return chunk_str
+
+    def _format_error(self, contender, error):
+        """Maps a fighter exception to the user-facing message shown in its column."""
+        err_str = str(error).lower()
+
+        # Check for specific error types
+        if any(k in err_str for k in ["quota", "429", "rate limit", "resource_exhausted"]):
+            return f"**Cota Excedida** ({contender['model']})\n\nO limite gratuito foi atingido."
+        elif "model" in err_str and "not found" in err_str and contender["provider"].lower() == "ollama":
+            # Ollama model not found - provide helpful instructions
+            return (
+                f"**Modelo Local Não Encontrado** ({contender['model']})\n\n"
+                f"O modelo `{contender['model']}` não está instalado no Ollama.\n"
+                f"```"
+            )
+        elif "no api key found" in err_str:
+            provider_upper = contender["provider"].upper()
+            return (
+                f"**API Key Não Configurada** ({contender['model']})\n\n"
+                f"Configure a variável de ambiente `{provider_upper}_API_KEY` ou "
+                f"adicione a chave na página de Configurações."
+            )
+        return f"**Erro**\n\n{str(error)}"
+
+    def _finalize(self, contender, full_response, system_prompt, prompt, interaction_id, reported_usage):
+        """
+        Computes the stats line for a successful fighter and patches its usage
+        into the interaction history. Provider-reported usage skips local tokenization.
+        """
+        # Skip cost calculation for local models (Ollama)
+        if contender["provider"].lower() == "ollama":
+            # For local models, just show it's local - no cost or token count needed
+            return "🏠 Local"
+
+        if reported_usage.get("cached"):
+            # Replayed from the response cache: nothing was billed
+            return "♻️ Cache"
+
+        if reported_usage:
+            usage_stats = self._usage_from_counts(
+                reported_usage["prompt_tokens"],
+                reported_usage["completion_tokens"],
+                contender["provider"],
+                contender["model"],
+            )
+        else:
+            usage_stats = self.calculate_usage(
+                contender["model"], f"{system_prompt}\n{prompt}", full_response, provider=contender["provider"]
+            )
+
+        # Silently update interaction history (only for paid models). Each fighter logs under
+        # its own id, so fighters sharing a model never patch each other's record.
+        try:
+            self.interaction_manager.update_interaction(
+                interaction_id,
+                {
+                    "usage": usage_stats,
+                    "cost_usd": usage_stats["cost_usd"],
+                    "total_tokens": usage_stats["total_tokens"],
+                },
+            )
+        except Exception:
+            pass
+
+        return f"💰 ${usage_stats['cost_usd']:.5f} | ⚡ {usage_stats['total_tokens']} tok"
+
+    def run_battle_round(self, prompt, contenders, system_prompt, persona_name, max_workers=None):
         """
         Logic to run a prompt against multiple models.
+        Contenders are streamed concurrently on a bounded thread pool, so a round takes
+        as long as the slowest model instead of the sum of all of them.
         Handles error detection for quotas and updates global interaction history.
+        Results are returned in contender order.
         """
-        results = []
         messages = [{"role": "user", "content": prompt}]
         now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-        for contender in contenders:
-            full_response = ""
-            stats_text = "⚠️ Indisponível"
-            error_occurred = False
-
-            try:
-                gen = self.engine.run_chat(
-                    provider_name=contender["provider"],
-                    model_name=contender["model"],
-                    messages=messages,
-                    session_id="rinha-mode",
-                    persona_name=persona_name,
-                    is_new_session=False,
-                )
-
-                for chunk in gen:
-                    chunk_str = str(chunk) if chunk is not None else ""
-
-                    # Detect error messages early (before adding to response)
-                    # All errors from core.py start with "Error:"
-                    if chunk_str.startswith("Error:"):
-                        raise Exception(chunk_str.replace("Error: ", ""))
-
-                    full_response += chunk_str
-
-                    # Additional detection for quota errors in stream content
-                    chunk_lower = chunk_str.lower()
-                    is_quota_error = (
-                        ("error" in chunk_lower and "429" in chunk_lower)
-                        or ("quota" in chunk_lower and "exceeded" in chunk_lower)
-                        or ("resource_exhausted" in chunk_lower)
-                    )
+        if not contenders:
+            return []
 
-                    if is_quota_error:
-                        raise Exception("Quota Exceeded (Detected in Stream)")
-
-                # Finalize stats for this fighter
-                # Skip cost calculation for local models (Ollama)
-                if contender["provider"].lower() == "ollama":
-                    # For local models, just show it's local - no cost or token count needed
-                    stats_text = "🏠 Local"
-                else:
-                    usage_stats = self.calculate_usage(contender["model"], f"{system_prompt}\n{prompt}", full_response)
-                    stats_text = f"💰 ${usage_stats['cost_usd']:.5f} | ⚡ {usage_stats['total_tokens']} tok"
-
-                    # Silently update interaction history if record exists (only for paid models)
-                    try:
-                        Log = Query()
-                        records = self.interaction_manager.history_table.search(
-                            (Log.session_id == "rinha-mode") & (Log.model == contender["model"])
-                        )
-                        if records:
-                            self.interaction_manager.history_table.update(
-                                {
-                                    "usage": usage_stats,
-                                    "cost_usd": usage_stats["cost_usd"],
-                                    "total_tokens": usage_stats["total_tokens"],
-                                },
-                                doc_ids=[records[-1].doc_id],
-                            )
-                    except Exception:
-                        pass
-
-            except Exception as e:
-                error_occurred = True
-                err_str = str(e).lower()
-
-                # Check for specific error types
-                if any(k in err_str for k in ["quota", "429", "rate limit", "resource_exhausted"]):
-                    full_response = f"**Cota Excedida** ({contender['model']})\n\nO limite gratuito foi atingido."
-                elif "model" in err_str and "not found" in err_str and contender["provider"].lower() == "ollama":
-                    # Ollama model not found - provide helpful instructions
-                    full_response = (
-                        f"**Modelo Local Não Encontrado** ({contender['model']})\n\n"
-                        f"O modelo `{contender['model']}` não está instalado no Ollama.\n"
-                        f"```"
-                    )
-                elif "no api key found" in err_str:
-                    provider_upper = contender["provider"].upper()
-                    full_response = (
-                        f"**API Key Não Configurada** ({contender['model']})\n\n"
-                        f"Configure a variável de ambiente `{provider_upper}_API_KEY` ou "
-                        f"adicione a chave na página de Configurações."
+        interaction_ids = [str(uuid.uuid4()) for _ in contenders]
+        workers = max_workers or min(len(contenders), MAX_CONCURRENT_FIGHTERS)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rinha") as pool:
+            futures = [
+                pool.submit(self._fight, contender, messages, persona_name, interaction_id)
+                for contender, interaction_id in zip(contenders, interaction_ids, strict=True)
+            ]
+            outcomes = [future.result() for future in futures]
+
+        return self._build_results(contenders, interaction_ids, outcomes, system_prompt, prompt, persona_name, now_str)
+
+    async def run_battle_round_async(self, prompt, contenders, system_prompt, persona_name):
+        """
+        Async counterpart of run_battle_round: every contender streams on the running
+        event loop via asyncio.gather. Results are returned in contender order.
+        """
+        messages = [{"role": "user", "content": prompt}]
+        now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+        interaction_ids = [str(uuid.uuid4()) for _ in contenders]
+
+        outcomes = await asyncio.gather(
+            *(
+                self._fight_async(contender, messages, persona_name, interaction_id)
+                for contender, interaction_id in zip(contenders, interaction_ids, strict=True)
+            )
+        )
+
+        return await asyncio.to_thread(
+            self._build_results, contenders, interaction_ids, outcomes, system_prompt, prompt, persona_name, now_str
+        )
+
+    def _build_results(self, contenders, interaction_ids, outcomes, system_prompt, prompt, persona_name, now_str):
+        # Post-processing runs sequentially so history updates never race each other
+        results = []
+        for contender, interaction_id, (full_response, error, reported_usage) in zip(
+            contenders, interaction_ids, outcomes, strict=True
+        ):
+            if error is None:
+                try:
+                    stats_text = self._finalize(
+                        contender, full_response, system_prompt, prompt, interaction_id, reported_usage
                     )
-                else:
-                    full_response = f"**Erro**\n\n{str(e)}"
+                except Exception as e:
+                    error = e
+
+            if error is not None:
+                full_response = self._format_error(contender, error)
+                stats_text = "⚠️ Falha"
 
             results.append(
                 {
                     "model": contender["model"],
                     "content": full_response,
-                    "stats": stats_text if not error_occurred else "⚠️ Falha",
+                    "stats": stats_text,
                     "time": now_str,
                     "persona": persona_name,
                 }
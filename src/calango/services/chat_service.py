@@ -1,19 +1,45 @@
-from tinydb import Query
+import asyncio
+import uuid
+from typing import NamedTuple
 
-try:
-    import tiktoken
-except ImportError:
-    tiktoken = None
+from calango.context_window import CONTEXT_SUMMARY_ENABLED, ContextWindow
+from calango.knowledge.base import context_message
+from calango.pricing import cost_usd
+from calango.semantic_cache import semantic_query
+from calango.tokenizer import count_tokens, count_tokens_cached, encoding_key, message_tokens
+
+
+class PreparedChat(NamedTuple):
+    """Per-call state of one send_message call, so concurrent streams never share it."""
+
+    session_id: str
+    is_new: bool
+    messages: list
+    context: str
+    window: dict | None
+    opening_turn: bool
 
 
 class ChatService:
-    def __init__(self, engine, session_manager):
+    def __init__(self, engine, session_manager, knowledge=None, context_window=None):
         """
         Dependency Injection of Core Engine and Session Management.
+        knowledge: optional KnowledgeBase; its best matches for each prompt are sent after the system prompt.
+        context_window: ContextWindow trimming the history sent each turn. By default one with the
+            configured budget, summarizing older turns through the engine when CALANGO_CONTEXT_SUMMARY=1.
         """
         self.engine = engine
         self.session_manager = session_manager
+        self.knowledge = knowledge
+        if context_window is None:
+            summarizer = engine.summarize if CONTEXT_SUMMARY_ENABLED else None
+            context_window = ContextWindow(summarizer=summarizer, summaries=session_manager)
+        self.context_window = context_window
+        # Outcome of the last completed call, for callers reading it back (see the getters);
+        # the calls themselves only use the PreparedChat they were given
         self.current_session_id = None
+        self.last_reply_tokens = None
+        self.last_window = None
 
     def get_messages(self, session_id):
         """Wraps session manager logic to retrieve history."""
@@ -23,29 +49,28 @@ class ChatService:
         """Returns the session ID from the last send_message call."""
         return self.current_session_id
 
-    def calculate_usage(self, model_name, prompt_text, response_text):
+    def get_last_window(self):
+        """Returns how the last history was fitted to the context window (see ContextWindow.fit)."""
+        return self.last_window
+
+    def get_last_reply_tokens(self):
+        """Returns the cached token count ({encoding: count}) of the last streamed reply, if tracked."""
+        return self.last_reply_tokens
+
+    def calculate_usage(self, model_name, prompt_text, response_text, provider=None):
         """
-        Estimates tokens and cost based on character counts or tiktoken.
-        Pricing follows the logic found in home.py ($0.15/$0.60 per 1M tokens).
+        Estimates tokens based on character counts or tiktoken.
+        Cost comes from the pricing catalog (see calango.pricing).
         """
-        if tiktoken:
-            try:
-                encoding = tiktoken.encoding_for_model(model_name)
-            except KeyError:
-                encoding = tiktoken.get_encoding("cl100k_base")
-
-            prompt_tokens = len(encoding.encode(prompt_text))
-            completion_tokens = len(encoding.encode(response_text))
-        else:
-            # Fallback: ~4 chars per token
-            prompt_tokens = len(prompt_text) // 4
-            completion_tokens = len(response_text) // 4
+        # Encodings come from the shared registry (loaded once per process)
+        prompt_tokens = count_tokens(prompt_text, model_name)
+        completion_tokens = count_tokens(response_text, model_name)
+        return self._usage_from_counts(prompt_tokens, completion_tokens, provider, model_name)
 
+    @staticmethod
+    def _usage_from_counts(prompt_tokens, completion_tokens, provider=None, model=None):
         total_tokens = prompt_tokens + completion_tokens
-        input_price_per_m = 0.15
-        output_price_per_m = 0.60
-
-        cost = (prompt_tokens * input_price_per_m / 1_000_000) + (completion_tokens * output_price_per_m / 1_000_000)
+        cost = cost_usd(provider, model, prompt_tokens, completion_tokens)
 
         return {
             "prompt_tokens": prompt_tokens,
@@ -54,31 +79,133 @@ class ChatService:
             "cost_usd": cost,
         }
 
-    def send_message(self, prompt, session_id, provider, model, persona_name, system_prompt, messages):
+    @staticmethod
+    def _prompt_tokens(model, chat_history):
         """
-        Handles the flow of creating a session (if new), building history,
-        running the engine stream, and updating the database with calculated usage.
+        Sums the tokens of the history sent to the model. Counts are cached on each message
+        (and restored from history records), so only the new turn gets encoded.
+        """
+        total = 0
+        for m in chat_history:
+            if m.get("role") == "system":
+                total += count_tokens_cached(m["content"], model)
+            else:
+                total += message_tokens(m, model)
+        return total
+
+    def _retrieve_context(self, prompt):
+        """Knowledge base context for a prompt ("" without a knowledge base or a good match)."""
+        if self.knowledge is None or not prompt:
+            return ""
+        try:
+            return self.knowledge.context_for(prompt)
+        except Exception as e:
+            print(f"⚠️ Knowledge Retrieval Failed: {e}")
+            return ""
+
+    def _prepare(self, session_id, system_prompt, messages, prompt=None, provider=None, model=None):
+        """
+        Creates the session if needed and builds the history sent to the engine, cut down to
+        the context window of the model (when given). Returns a PreparedChat.
         """
         is_new = False
         if session_id is None:
             session_id = self.session_manager.create_session(title="Nova Conversa")
             is_new = True
 
-        # Store the session_id so it can be retrieved by the caller
-        self.current_session_id = session_id
-
         # Prepare chat history excluding system messages to avoid duplication
         chat_history = [m for m in messages if m.get("role") != "system"]
-        chat_history.insert(0, {"role": "system", "content": system_prompt})
+        context = self._retrieve_context(prompt)
+        retrieved = context_message(context)
+        chat_history[:0] = [{"role": "system", "content": system_prompt}, *([retrieved] if retrieved else [])]
+
+        # Judged before trimming: a follow-up may look like an opening question once cut down
+        opening_turn = semantic_query(chat_history) is not None
+        window = None
+        if model is not None:
+            chat_history, window = self.context_window.fit(provider, model, chat_history, session_id)
+
+        return PreparedChat(session_id, is_new, chat_history, context, window, opening_turn)
+
+    def _start(self, prepared):
+        """Records the session and window of the call just prepared, for the getters."""
+        self.current_session_id = prepared.session_id
+        self.last_window = prepared.window
+        self.last_reply_tokens = None
+
+    def _record_usage(self, interaction_id, provider, model, chat_history, full_content, reported_usage):
+        """
+        Post-processing: Update Token Usage.
+        Provider-reported numbers are used as-is; only when they are missing are the reply and
+        the history sent tokenized locally (the history through the per-message caches).
+        Token counts of the turn are stored with the record, so reloading the session doesn't
+        re-encode them. Returns the reply's token count when it was counted here.
+        """
+        reply_tokens = None
+        try:
+            if reported_usage:
+                usage_stats = self._usage_from_counts(
+                    reported_usage["prompt_tokens"], reported_usage["completion_tokens"], provider, model
+                )
+                usage_source = "cache" if reported_usage.get("cached") else "provider"
+            else:
+                prompt_tokens = self._prompt_tokens(model, chat_history)
+                completion_tokens = count_tokens(full_content, model)
+                usage_stats = self._usage_from_counts(prompt_tokens, completion_tokens, provider, model)
+                reply_tokens = {encoding_key(model): completion_tokens}
+                usage_source = "estimate"
+
+            # The user turn may only have been counted now, after the record was logged
+            user_turn = chat_history[-1] if chat_history and chat_history[-1].get("role") == "user" else {}
+
+            # engine.memory is the InteractionManager instance; the record is keyed by
+            # the id we handed to run_chat, so no history lookup is needed
+            self.engine.memory.update_interaction(
+                interaction_id,
+                {
+                    "usage": {
+                        "prompt_tokens": usage_stats["prompt_tokens"],
+                        "completion_tokens": usage_stats["completion_tokens"],
+                        "total_tokens": usage_stats["total_tokens"],
+                    },
+                    "cost_usd": usage_stats["cost_usd"],
+                    "total_tokens": usage_stats["total_tokens"],
+                    "usage_source": usage_source,
+                    "user_tokens": user_turn.get("tokens"),
+                    "reply_tokens": reply_tokens,
+                },
+            )
+        except Exception as e:
+            print(f"⚠️ Service Usage Update Failed: {e}")
+        return reply_tokens
+
+    def send_message(self, prompt, session_id, provider, model, persona_name, system_prompt, messages):
+        """
+        Handles the flow of creating a session (if new), building history,
+        running the engine stream, and updating the database with calculated usage.
+        Usage reported by the provider is preferred over local token counting.
+        With a knowledge base, context retrieved for the prompt is sent as a system message of its own.
+        Only the turns fitting the model's context window are sent (see calango.context_window).
+        """
+        prepared = self._prepare(session_id, system_prompt, messages, prompt, provider, model)
+        self._start(prepared)
+        interaction_id = str(uuid.uuid4())
+
+        # Skip cost calculation for local models (Ollama)
+        track_usage = provider.lower() != "ollama"
 
         # Run the Stream
+        reported_usage = {}
         stream = self.engine.run_chat(
             provider_name=provider,
             model_name=model,
-            messages=chat_history,
-            session_id=session_id,
+            messages=prepared.messages,
+            session_id=prepared.session_id,
             persona_name=persona_name,
-            is_new_session=is_new,
+            is_new_session=prepared.is_new,
+            interaction_id=interaction_id,
+            on_usage=reported_usage.update,
+            opening_turn=prepared.opening_turn,
         )
 
         full_content = ""
@@ -90,35 +217,45 @@ class ChatService:
             if "Error:" in chunk:
                 error_occurred = True
 
-        # Post-processing: Calculate and Update Token Usage
         # Skip if an error occurred (no API key, quota exceeded, etc.)
-        if error_occurred or full_content.startswith("Error:"):
-            return
+        if track_usage and not error_occurred and not full_content.startswith("Error:"):
+            self.last_reply_tokens = self._record_usage(
+                interaction_id, provider, model, prepared.messages, full_content, reported_usage
+            )
 
-        # Skip cost calculation for local models (Ollama)
-        if provider.lower() == "ollama":
-            return
+    async def send_message_async(self, prompt, session_id, provider, model, persona_name, system_prompt, messages):
+        """
+        Async counterpart of send_message, streaming through engine.run_chat_async.
+        Blocking database work runs on worker threads so the event loop stays free.
+        """
+        prepared = await asyncio.to_thread(self._prepare, session_id, system_prompt, messages, prompt, provider, model)
+        self._start(prepared)
+        interaction_id = str(uuid.uuid4())
 
-        try:
-            full_input_text = system_prompt + "\n" + "\n".join([m["content"] for m in chat_history])
-            usage_stats = self.calculate_usage(model, full_input_text, full_content)
-
-            Log = Query()
-            # engine.memory is the InteractionManager instance
-            records = self.engine.memory.history_table.search(Log.session_id == session_id)
-            if records:
-                last_record_id = records[-1].doc_id
-                self.engine.memory.history_table.update(
-                    {
-                        "usage": {
-                            "prompt_tokens": usage_stats["prompt_tokens"],
-                            "completion_tokens": usage_stats["completion_tokens"],
-                            "total_tokens": usage_stats["total_tokens"],
-                        },
-                        "cost_usd": usage_stats["cost_usd"],
-                        "total_tokens": usage_stats["total_tokens"],
-                    },
-                    doc_ids=[last_record_id],
-                )
-        except Exception as e:
-            print(f"⚠️ Service Usage Update Failed: {e}")
+        track_usage = provider.lower() != "ollama"
+
+        reported_usage = {}
+        stream = self.engine.run_chat_async(
+            provider_name=provider,
+            model_name=model,
+            messages=prepared.messages,
+            session_id=prepared.session_id,
+            persona_name=persona_name,
+            is_new_session=prepared.is_new,
+            interaction_id=interaction_id,
+            on_usage=reported_usage.update,
+            opening_turn=prepared.opening_turn,
+        )
+
+        full_content = ""
+        error_occurred = False
+        async for chunk in stream:
+            full_content += chunk
+            yield chunk
+            if "Error:" in chunk:
+                error_occurred = True
+
+        if track_usage and not error_occurred and not full_content.startswith("Error:"):
+            self.last_reply_tokens = await asyncio.to_thread(
+                self._record_usage, interaction_id, provider, model, prepared.messages, full_content, reported_usage
+            )
@@ -0,0 +1,97 @@
+"""
+Shared tokenizer registry used for token accounting.
+
+Encodings are loaded lazily and kept in an LRU keyed by encoding name, so models that
+share a BPE table (e.g. every gpt-4o variant) load it only once per process. Very long
+inputs are estimated from a prefix sample instead of being fully encoded.
+"""
+
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+DEFAULT_ENCODING = "cl100k_base"
+# Fallback when no encoding is available: ~4 chars per token
+CHARS_PER_TOKEN = 4
+# Texts longer than this are estimated by encoding only the first SAMPLE_CHARS
+LONG_TEXT_CHARS = 100_000
+SAMPLE_CHARS = 20_000
+
+
+@lru_cache(maxsize=256)
+def _encoding_name(model_name):
+    try:
+        return tiktoken.encoding_name_for_model(model_name)
+    except KeyError:
+        return DEFAULT_ENCODING
+
+
+@lru_cache(maxsize=8)
+def _load_encoding(encoding_name):
+    try:
+        return tiktoken.get_encoding(encoding_name)
+    except Exception as e:
+        # e.g. offline and the BPE file isn't cached yet: fall back to estimates
+        print(f"⚠️ Tokenizer '{encoding_name}' unavailable, estimating tokens: {e}")
+        return None
+
+
+def get_encoding(model_name):
+    """Returns the tiktoken encoding for a model, or None when tiktoken can't be used."""
+    if tiktoken is None:
+        return None
+    return _load_encoding(_encoding_name(model_name))
+
+
+def count_tokens(text, model_name):
+    """Counts the tokens of text for a model (exact for short texts, estimated for very long ones)."""
+    if not text:
+        return 0
+
+    encoding = get_encoding(model_name)
+    if encoding is None:
+        return len(text) // CHARS_PER_TOKEN
+
+    if len(text) <= LONG_TEXT_CHARS:
+        return len(encoding.encode(text, disallowed_special=()))
+
+    sample_tokens = len(encoding.encode(text[:SAMPLE_CHARS], disallowed_special=()))
+    return round(sample_tokens * len(text) / SAMPLE_CHARS)
+
+
+def encoding_key(model_name):
+    """Identifies how counts for a model are produced, so cached counts are only reused when valid."""
+    if tiktoken is None or get_encoding(model_name) is None:
+        return "estimate"
+    return _encoding_name(model_name)
+
+
+@lru_cache(maxsize=128)
+def count_tokens_cached(text, model_name):
+    """count_tokens memoized by text, for inputs repeated every turn such as system prompts."""
+    return count_tokens(text, model_name)
+
+
+def message_tokens(message, model_name):
+    """
+    Token count of a chat message, cached on the message itself under "tokens"
+    ({encoding_key: count}) so each message is only encoded once per conversation.
+    """
+    key = encoding_key(model_name)
+    cached = message.get("tokens")
+    if isinstance(cached, dict) and key in cached:
+        return cached[key]
+
+    count = count_tokens(message.get("content") or "", model_name)
+    message["tokens"] = {**(cached if isinstance(cached, dict) else {}), key: count}
+    return count
+
+
+def clear_cache():
+    """Drops every loaded encoding (mainly for tests)."""
+    _encoding_name.cache_clear()
+    _load_encoding.cache_clear()
+    count_tokens_cached.cache_clear()
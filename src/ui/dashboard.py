@@ -2,7 +2,8 @@ import pandas as pd
 import plotly.express as px
 
 import streamlit as st
-from calango.database import InteractionManager
+from calango.database import InteractionManager, usage_tokens
+from calango.semantic_cache import SEMANTIC_CACHE_ENABLED, embedder_problem, read_stats
 
 # --- CSS: TEXT CONTRAST FIX ONLY ---
 st.markdown(
@@ -37,49 +38,40 @@ db = InteractionManager()
 st.title("🦎 A Cuca (The Brain)")
 st.caption("She sees everything. Track your costs, tokens, and digital memories here.")
 
-history_data = db.history_table.all()
+# Metrics and charts read the pre-aggregated rollups (a few rows per day), not raw history
+rollups = db.get_usage_rollups()
 
-if not history_data:
+if not rollups:
     st.warning("🦎 The Cuca is hungry! Start chatting to feed her some data.")
     st.stop()
 
-df = pd.DataFrame(history_data)
-
-# --- USAGE DATA NORMALIZATION ---
-if "usage" in df.columns:
-    df = df.reset_index(drop=True)
-    usage_df = pd.json_normalize(df["usage"])
-
-    # Remove overlapping columns to prevent duplicates
-    common_cols = [c for c in usage_df.columns if c in df.columns]
-    if common_cols:
-        df = df.drop(columns=common_cols)
-
-    df = pd.concat([df.drop(["usage"], axis=1), usage_df], axis=1)
-
-    cols_to_fill = [c for c in ["total_tokens", "prompt_tokens", "completion_tokens"] if c in df.columns]
-    fill_values = {c: 0 for c in cols_to_fill}
-    df = df.fillna(value=fill_values)
-else:
-    df["total_tokens"] = 0
-    df["prompt_tokens"] = 0
-    df["completion_tokens"] = 0
-
-# --- TIMESTAMP FORMATTING ---
-df["timestamp"] = pd.to_datetime(df["timestamp"], format="mixed", errors="coerce")
+rollup_df = pd.DataFrame(rollups)
+rollup_df["day"] = pd.to_datetime(rollup_df["day"], errors="coerce")
 
 col1, col2, col3, col4 = st.columns(4)
 
-total_cost = float(df["cost_usd"].sum()) if "cost_usd" in df.columns else 0.0
-total_tokens = int(df["total_tokens"].sum()) if "total_tokens" in df.columns else 0
-total_interactions = len(df)
-fav_model = df["model"].mode()[0] if "model" in df.columns and not df["model"].empty else "N/A"
+total_cost = float(rollup_df["cost_usd"].sum())
+total_tokens = int(rollup_df["total_tokens"].sum())
+total_interactions = int(rollup_df["count"].sum())
+count_by_model = rollup_df.groupby("model")["count"].sum()
+fav_model = count_by_model.idxmax() if not count_by_model.empty else "N/A"
 
 col1.metric("Total Treasure ($)", f"${total_cost:.5f}")
 col2.metric("Tokens Consumed", f"{total_tokens:,.0f}")
 col3.metric("Memories Stored", total_interactions)
 col4.metric("Favorite Spirit", fav_model)
 
+# Semantic cache counters are kept on disk by the chat engine
+cache_problem = embedder_problem() if SEMANTIC_CACHE_ENABLED else None
+if cache_problem:
+    st.warning(f"CALANGO_SEMANTIC_CACHE is on but the semantic cache is disabled: {cache_problem}")
+cache_stats = read_stats()
+if cache_stats["hits"] or cache_stats["misses"]:
+    cache_col1, cache_col2, cache_col3 = st.columns(3)
+    cache_col1.metric("Déjà Vu Rate (Semantic Cache)", f"{cache_stats['hit_rate']:.1%}")
+    cache_col2.metric("Answers Remembered", f"{cache_stats['hits']:,}")
+    cache_col3.metric("Tokens Saved", f"{cache_stats['saved_tokens']:,}")
+
 st.divider()
 
 c1, c2 = st.columns(2)
@@ -89,7 +81,7 @@ THEME_PALETTE = ["#8A2BE2", "#22c55e", "#FACC15", "#DC2626", "#0284C7"]
 with c1:
     st.subheader("🏺 Tribute by Model (Cost)")
     if total_cost > 0:
-        cost_by_model = df.groupby("model")["cost_usd"].sum().reset_index()
+        cost_by_model = rollup_df.groupby("model")["cost_usd"].sum().reset_index()
         fig_pie = px.pie(
             cost_by_model,
             values="cost_usd",
@@ -109,15 +101,16 @@ with c1:
 
 with c2:
     st.subheader("📈 Activity Flow")
-    if not df.empty and "total_tokens" in df.columns:
-        daily_usage = df.set_index("timestamp").resample("D")["total_tokens"].sum().reset_index()
+    dated_df = rollup_df.dropna(subset=["day"])
+    if not dated_df.empty:
+        daily_usage = dated_df.set_index("day").resample("D")["total_tokens"].sum().reset_index()
 
         if not daily_usage.empty:
             fig_line = px.bar(
                 daily_usage,
-                x="timestamp",
+                x="day",
                 y="total_tokens",
-                labels={"total_tokens": "Tokens", "timestamp": "Date"},
+                labels={"total_tokens": "Tokens", "day": "Date"},
                 color_discrete_sequence=["#22c55e"],
             )
             fig_line.update_layout(
@@ -135,24 +128,57 @@ st.subheader("📜 The Cauldron (Logs)")
 
 filter_col1, filter_col2, filter_col3 = st.columns(3)
 with filter_col1:
-    options = df["provider"].unique() if "provider" in df.columns else []
+    options = sorted(p for p in rollup_df["provider"].unique() if p)
     selected_provider_filter = st.multiselect("Realm (Provider)", options=options)
 with filter_col2:
-    options = df["model"].unique() if "model" in df.columns else []
+    options = sorted(m for m in rollup_df["model"].unique() if m)
     selected_model_filter = st.multiselect("Spirit (Model)", options=options)
 with filter_col3:
-    options = df["persona"].unique() if "persona" in df.columns else []
+    options = sorted(p for p in rollup_df["persona"].unique() if p)
     selected_persona_filter = st.multiselect("Identity (Persona)", options=options)
 
-filtered_df = df.copy()
-if selected_provider_filter:
-    filtered_df = filtered_df[filtered_df["provider"].isin(selected_provider_filter)]
-if selected_model_filter:
-    filtered_df = filtered_df[filtered_df["model"].isin(selected_model_filter)]
-if "persona" in filtered_df.columns and selected_persona_filter:
-    filtered_df = filtered_df[filtered_df["persona"].isin(selected_persona_filter)]
+PAGE_SIZES = [25, 50, 100, 250]
+
+page_col1, page_col2, page_col3 = st.columns([1, 1, 2])
+with page_col1:
+    page_size = st.selectbox("Rows per page", options=PAGE_SIZES, index=1)
+
+filters = {
+    "providers": selected_provider_filter,
+    "models": selected_model_filter,
+    "personas": selected_persona_filter,
+}
+
+# Only the visible page is read; filters and sorting run in the storage layer
+total_matching = db.count_interactions(**filters)
+page_count = max(1, -(-total_matching // page_size))
+with page_col2:
+    page = st.number_input("Page", min_value=1, max_value=page_count, value=1, step=1)
+with page_col3:
+    st.caption(f"{total_matching:,} memories match · page {page} of {page_count}")
+
+records = db.query_interactions(**filters, limit=page_size, offset=(page - 1) * page_size)
+
+
+def _log_row(record):
+    prompt_tokens, completion_tokens, total_tokens = usage_tokens(record)
+    return {
+        "timestamp": record.get("timestamp"),
+        "provider": record.get("provider"),
+        "model": record.get("model"),
+        "persona": record.get("persona"),
+        "total_tokens": total_tokens,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "cost_usd": record.get("cost_usd", 0.0),
+    }
+
 
-filtered_df = filtered_df.sort_values(by="timestamp", ascending=False)
+filtered_df = pd.DataFrame([_log_row(record) for record in records])
+
+# --- TIMESTAMP FORMATTING ---
+if not filtered_df.empty:
+    filtered_df["timestamp"] = pd.to_datetime(filtered_df["timestamp"], format="mixed", errors="coerce")
 
 # --- TABLE COLUMNS CONFIGURATION ---
 cols_to_show = [
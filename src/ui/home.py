@@ -2,18 +2,34 @@ from datetime import datetime
 
 import streamlit as st
 from calango.core import CalangoEngine
-from calango.database import ConfigManager, PersonaManager, SessionManager
+from calango.database import SESSION_PAGE_SIZE, ConfigManager, PersonaManager, SessionManager
+from calango.knowledge.base import get_knowledge_base
 from calango.services.chat_service import ChatService
 from calango.themes import render_copy_button
 
+
+@st.cache_resource
+def load_knowledge_base():
+    """One knowledge base handle for every rerun and session; it picks up re-ingested files by itself."""
+    return get_knowledge_base()
+
+
 # Inicialização da Lógica
 engine = CalangoEngine()
 session_mgr = SessionManager()
 persona_mgr = PersonaManager()
 config_db = ConfigManager()
 
+knowledge = load_knowledge_base()
+if knowledge is None:
+    # Nothing ingested yet: look again on the next rerun
+    load_knowledge_base.clear()
+else:
+    # Re-ingestion may have left tombstones since the handle was made
+    knowledge.maybe_compact(background=True)
+
 # Instantiate ChatService
-chat_service = ChatService(engine, session_mgr)
+chat_service = ChatService(engine, session_mgr, knowledge=knowledge)
 
 # Get theme for JS buttons
 current_theme_name = config_db.load_theme_setting()
@@ -93,12 +109,31 @@ with st.sidebar:
         st.session_state.messages = []
         st.rerun()
 
-    previous_sessions = session_mgr.get_all_sessions()
+    search_text = st.text_input(
+        "Buscar nas conversas",
+        key="history_search",
+        placeholder="🔎 Buscar nas conversas",
+        label_visibility="collapsed",
+    )
+
+    # Only the newest sessions are read; "load more" extends the window one page at a time
+    if "sessions_limit" not in st.session_state:
+        st.session_state.sessions_limit = SESSION_PAGE_SIZE
+    if search_text.strip():
+        # Full-text matches replace the session list while a search is active
+        previous_sessions, more_cursor = session_mgr.search_sessions(search_text), None
+        if not previous_sessions:
+            st.caption("Nenhuma conversa encontrada.")
+    else:
+        previous_sessions, more_cursor = session_mgr.list_sessions(limit=st.session_state.sessions_limit)
     for s in previous_sessions:
         col_title, col_del = st.columns([4, 1], vertical_alignment="center")
-        if col_title.button(f"💬 {s['title']}", key=f"sel_{s['id']}", use_container_width=True):
+        icon = "🗄️" if s.get("archived") else "💬"
+        if col_title.button(f"{icon} {s['title']}", key=f"sel_{s['id']}", use_container_width=True):
             st.session_state.pending_session_id = s["id"]
             st.rerun()
+        if s.get("snippet"):
+            col_title.caption(s["snippet"])
 
         if col_del.button("", icon=":material/delete:", key=f"del_{s['id']}", type="primary", help="Deletar Chat"):
             session_mgr.delete_session(s["id"])
@@ -107,6 +142,10 @@ with st.sidebar:
                 st.session_state.messages = []
             st.rerun()
 
+    if more_cursor and st.button("Carregar mais", icon=":material/expand_more:", use_container_width=True):
+        st.session_state.sessions_limit += SESSION_PAGE_SIZE
+        st.rerun()
+
 # --- CHAT INTERFACE ---
 for msg in st.session_state.messages:
     if isinstance(msg, dict) and msg.get("role") != "system":
@@ -146,13 +185,15 @@ if prompt := st.chat_input("Pergunte ao Calango..."):
         # Retrieve the session ID from the service
         st.session_state.session_id = chat_service.get_current_session_id()
 
-    st.session_state.messages.append(
-        {
-            "role": "assistant",
-            "content": response_content,
-            "time": now_str,
-            "model": selected_model,
-            "persona": selected_persona_name,
-        }
-    )
+    assistant_message = {
+        "role": "assistant",
+        "content": response_content,
+        "time": now_str,
+        "model": selected_model,
+        "persona": selected_persona_name,
+    }
+    # Keep the reply's token count so the next turn doesn't encode it again
+    if reply_tokens := chat_service.get_last_reply_tokens():
+        assistant_message["tokens"] = reply_tokens
+    st.session_state.messages.append(assistant_message)
     st.rerun()
@@ -1,8 +1,6 @@
-from tinydb import TinyDB
-
 import streamlit as st
 from calango.core import CalangoEngine
-from calango.database import APP_DIR, ConfigManager, InteractionManager, PersonaManager
+from calango.database import ConfigManager, InteractionManager, PersonaManager, open_database
 from calango.services.arena_service import ArenaService
 from calango.themes import render_copy_button
 
@@ -13,8 +11,7 @@ persona_mgr = PersonaManager()
 config_db = ConfigManager()
 
 # Initialize Persistence (Rinha Store)
-rinha_db_path = APP_DIR / "rinha_store.json"
-rinha_db = TinyDB(rinha_db_path)
+rinha_db = open_database("rinha_store")
 config_table = rinha_db.table("config")
 
 # Instantiate ArenaService
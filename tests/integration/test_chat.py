@@ -46,6 +46,8 @@ def test_full_chat_flow_integration(monkeypatch, tmp_path):
         assert response_text == "Hello World"
         
         # Verify persistence: check if engine logged the interaction to the temp DB
+        # (interactions are written behind, so wait for the buffer first)
+        engine.memory.flush()
         history = engine.memory.history_table.all()
         assert len(history) == 1
         assert history[0]["reply"] == "Hello World"
@@ -48,4 +48,74 @@ def test_save_round(mock_arena_deps):
     db.insert.assert_called_once()
     saved_data = db.insert.call_args[0][0]
     assert saved_data["prompt"] == "The Prompt"
-    assert saved_data["results"] == results
\ No newline at end of file
+    assert saved_data["results"] == results
+
+def test_run_battle_round_runs_fighters_concurrently(mock_arena_deps):
+    import threading
+
+    engine, imgr, db = mock_arena_deps
+    service = ArenaService(engine, imgr, db)
+
+    # Every fighter blocks until all of them are streaming at the same time
+    barrier = threading.Barrier(3, timeout=5)
+
+    def fake_run_chat(provider_name, model_name, **kwargs):
+        barrier.wait()
+        yield f"answer from {model_name}"
+
+    engine.run_chat.side_effect = fake_run_chat
+    contenders = [{"provider": "ollama", "model": f"M{i}"} for i in range(3)]
+
+    results = service.run_battle_round("Test prompt", contenders, "System", "Persona")
+
+    assert [r["model"] for r in results] == ["M0", "M1", "M2"]
+    assert [r["content"] for r in results] == ["answer from M0", "answer from M1", "answer from M2"]
+    assert all(r["stats"] == "🏠 Local" for r in results)
+
+
+def test_run_battle_round_keeps_errors_per_fighter(mock_arena_deps):
+    engine, imgr, db = mock_arena_deps
+    service = ArenaService(engine, imgr, db)
+
+    def fake_run_chat(provider_name, model_name, **kwargs):
+        if model_name == "broken":
+            yield f"Error: No API key found for {provider_name}."
+        else:
+            yield "fine"
+
+    engine.run_chat.side_effect = fake_run_chat
+    contenders = [{"provider": "openai", "model": "broken"}, {"provider": "ollama", "model": "llama3"}]
+
+    results = service.run_battle_round("Test prompt", contenders, "System", "Persona")
+
+    assert "API Key Não Configurada" in results[0]["content"]
+    assert results[0]["stats"] == "⚠️ Falha"
+    assert results[1]["content"] == "fine"
+
+
+def test_run_battle_round_patches_each_fighter_by_its_own_record(mock_arena_deps):
+    engine, imgr, db = mock_arena_deps
+    service = ArenaService(engine, imgr, db)
+
+    engine.run_chat.side_effect = lambda **kwargs: iter(["same model, different answer"])
+    contenders = [{"provider": "openai", "model": "gpt-4o"}, {"provider": "openai", "model": "gpt-4o"}]
+
+    with patch.object(service, "calculate_usage", return_value={"cost_usd": 0.0, "total_tokens": 3}):
+        service.run_battle_round("Test prompt", contenders, "System", "Persona")
+
+    logged_ids = [c.kwargs["interaction_id"] for c in engine.run_chat.call_args_list]
+    patched_ids = [c.args[0] for c in imgr.update_interaction.call_args_list]
+    assert len(set(logged_ids)) == 2
+    assert sorted(patched_ids) == sorted(logged_ids)
+
+
+def test_finalize_prices_by_contender_model():
+    service = ArenaService(MagicMock(), MagicMock(), MagicMock())
+    contender = {"provider": "openai", "model": "gpt-4o"}
+    usage = {"prompt_tokens": 1_000_000, "completion_tokens": 1_000_000}
+
+    with patch("calango.services.arena_service.cost_usd", return_value=12.5) as mock_cost:
+        stats = service._finalize(contender, "reply", "sys", "prompt", "rec-1", usage)
+
+    mock_cost.assert_called_once_with("openai", "gpt-4o", 1_000_000, 1_000_000)
+    assert "$12.50000" in stats
@@ -1,5 +1,10 @@
+import asyncio
+import threading
+
 import pytest
 from unittest.mock import MagicMock, patch
+from calango import tokenizer
+from calango.context_window import ContextWindow
 from calango.services.chat_service import ChatService
 
 @pytest.fixture
@@ -16,10 +21,11 @@ def test_calculate_usage_with_tiktoken(mock_dependencies):
     service = ChatService(engine, session_mgr)
     
     # Mock tiktoken to return predictable token counts
-    with patch("calango.services.chat_service.tiktoken") as mock_tik:
+    tokenizer.clear_cache()
+    with patch("calango.tokenizer.tiktoken") as mock_tik:
         mock_encoding = MagicMock()
         mock_encoding.encode.side_effect = [range(10), range(20)] # 10 prompt, 20 completion
-        mock_tik.encoding_for_model.return_value = mock_encoding
+        mock_tik.get_encoding.return_value = mock_encoding
         
         usage = service.calculate_usage("gpt-4o-mini", "hello", "hi there")
         
@@ -28,13 +34,14 @@ def test_calculate_usage_with_tiktoken(mock_dependencies):
         assert usage["total_tokens"] == 30
         # Math: (10 * 0.15 / 1M) + (20 * 0.60 / 1M)
         assert usage["cost_usd"] == pytest.approx(0.0000135)
+    tokenizer.clear_cache()
 
 def test_calculate_usage_fallback(mock_dependencies):
     engine, session_mgr = mock_dependencies
     service = ChatService(engine, session_mgr)
     
     # Simulate tiktoken missing
-    with patch("calango.services.chat_service.tiktoken", None):
+    with patch("calango.tokenizer.tiktoken", None):
         # 40 chars / 4 = 10 tokens
         usage = service.calculate_usage("any-model", "a" * 40, "b" * 80)
         assert usage["prompt_tokens"] == 10
@@ -47,11 +54,6 @@ def test_send_message_flow(mock_dependencies):
     session_mgr.create_session.return_value = "new-uuid"
     engine.run_chat.return_value = iter(["Hello", " world"])
     
-    # Mock search result for history update
-    mock_record = MagicMock()
-    mock_record.doc_id = 1
-    engine.memory.history_table.search.return_value = [mock_record]
-
     gen = service.send_message(
         prompt="Hi",
         session_id=None, # Trigger new session
@@ -68,4 +70,164 @@ def test_send_message_flow(mock_dependencies):
     session_mgr.create_session.assert_called_once()
     engine.run_chat.assert_called_once()
     # Verify usage was updated in DB
-    engine.memory.history_table.update.assert_called_once()
\ No newline at end of file
+    engine.memory.update_interaction.assert_called_once()
+    # Usage is keyed by the id the engine logged the interaction under
+    logged_id = engine.run_chat.call_args.kwargs["interaction_id"]
+    assert engine.memory.update_interaction.call_args[0][0] == logged_id
+
+def test_send_message_counts_tokens_incrementally(mock_dependencies):
+    engine, session_mgr = mock_dependencies
+    service = ChatService(engine, session_mgr)
+    engine.run_chat.return_value = iter(["b" * 40, "b" * 40])
+
+    history = [
+        {"role": "user", "content": "old question", "tokens": {"estimate": 900}},
+        {"role": "assistant", "content": "old answer", "tokens": {"estimate": 90}},
+        {"role": "user", "content": "a" * 20},
+    ]
+
+    tokenizer.clear_cache()
+    with patch("calango.tokenizer.tiktoken", None):
+        list(service.send_message("new", "sess-1", "openai", "gpt-4o", "Default", "s" * 8, history))
+
+    # Cached counts are reused; only the system prompt (2) and the new turn (5) are encoded
+    patch_fields = engine.memory.update_interaction.call_args[0][1]
+    assert patch_fields["usage"]["prompt_tokens"] == 900 + 90 + 2 + 5
+    assert patch_fields["usage"]["completion_tokens"] == 20
+    assert history[-1]["tokens"] == {"estimate": 5}
+    assert service.get_last_reply_tokens() == {"estimate": 20}
+    # Counted after the record was logged: stored through the patch
+    assert (patch_fields["user_tokens"], patch_fields["reply_tokens"]) == ({"estimate": 5}, {"estimate": 20})
+
+
+def test_send_message_prefers_provider_usage(mock_dependencies):
+    engine, session_mgr = mock_dependencies
+    service = ChatService(engine, session_mgr)
+
+    def fake_run_chat(on_usage, **kwargs):
+        yield "Hello"
+        on_usage({"prompt_tokens": 7, "completion_tokens": 1, "total_tokens": 8})
+
+    engine.run_chat.side_effect = fake_run_chat
+
+    with (
+        patch("calango.services.chat_service.count_tokens") as mock_count,
+        patch("calango.services.chat_service.count_tokens_cached") as mock_cached,
+        patch("calango.services.chat_service.message_tokens") as mock_message,
+        patch("calango.context_window.count_tokens_cached") as mock_window_cached,
+        patch("calango.context_window.message_tokens") as mock_window_message,
+    ):
+        history = [{"role": "user", "content": "Hello"}, {"role": "assistant", "content": "Hi!"}]
+        list(service.send_message("Hi", "sess-1", "openai", "gpt-4o", "Default", "sys", history))
+
+    # Nothing gets tokenized: neither for usage nor to fit the short history in the context window
+    for mock in (mock_count, mock_cached, mock_message, mock_window_cached, mock_window_message):
+        mock.assert_not_called()
+    patch_fields = engine.memory.update_interaction.call_args[0][1]
+    assert patch_fields["usage"]["total_tokens"] == 8
+    assert patch_fields["usage_source"] == "provider"
+
+
+def test_send_message_injects_knowledge_context(mock_dependencies):
+    engine, session_mgr = mock_dependencies
+    knowledge = MagicMock()
+    knowledge.context_for.return_value = "[notes.md]\nThe calango is a lizard."
+    service = ChatService(engine, session_mgr, knowledge=knowledge)
+    engine.run_chat.return_value = iter(["A lizard."])
+
+    list(service.send_message("What is a calango?", "sess-1", "ollama", "llama3", "Default", "Be brief.", []))
+
+    knowledge.context_for.assert_called_once_with("What is a calango?")
+    # The system prompt stays as given, so its stored copy is shared by every turn
+    system_prompt, retrieved = engine.run_chat.call_args.kwargs["messages"][:2]
+    assert system_prompt == {"role": "system", "content": "Be brief."}
+    assert retrieved["role"] == "system"
+    assert "The calango is a lizard." in retrieved["content"]
+
+def test_send_message_trims_history_to_context_window(mock_dependencies):
+    engine, session_mgr = mock_dependencies
+    service = ChatService(engine, session_mgr, context_window=ContextWindow(budget=300))
+    engine.run_chat.return_value = iter(["Still a lizard."])
+    messages = []
+    for i in range(20):
+        messages.append({"role": "user" if i % 2 == 0 else "assistant", "content": f"turn {i} " + "x" * 392})
+    messages.append({"role": "user", "content": "And now?"})
+
+    with patch("calango.tokenizer.tiktoken", None):
+        list(service.send_message("And now?", "sess-1", "ollama", "llama3", "Default", "Be brief.", messages))
+
+    sent = engine.run_chat.call_args.kwargs["messages"]
+    assert [m["role"] for m in sent] == ["system", "user", "assistant", "user"]
+    assert sent[1:] == messages[-3:]
+    assert service.get_last_window()["dropped"] == 18
+    assert engine.run_chat.call_args.kwargs["opening_turn"] is False
+
+
+def test_follow_up_trimmed_to_one_turn_is_not_an_opening_question(mock_dependencies):
+    engine, session_mgr = mock_dependencies
+    service = ChatService(engine, session_mgr, context_window=ContextWindow(budget=300))
+    engine.run_chat.return_value = iter(["Agora em português."])
+    messages = [
+        {"role": "user", "content": "Write a long story."},
+        {"role": "assistant", "content": "Once upon a time " + "x" * 4000},
+        {"role": "user", "content": "Now translate it to Portuguese"},
+    ]
+
+    with patch("calango.tokenizer.tiktoken", None):
+        list(service.send_message(messages[-1]["content"], "sess-1", "openai", "gpt-4o", "Default", "sys", messages))
+
+    kwargs = engine.run_chat.call_args.kwargs
+    assert [m["role"] for m in kwargs["messages"]] == ["system", "user"]
+    assert kwargs["opening_turn"] is False
+
+    engine.run_chat.return_value = iter(["Hi!"])
+    opening = [{"role": "user", "content": "Hello"}]
+    list(service.send_message("Hello", None, "openai", "gpt-4o", "Default", "sys", opening))
+    assert engine.run_chat.call_args.kwargs["opening_turn"] is True
+
+
+@pytest.mark.asyncio
+async def test_concurrent_async_streams_keep_their_own_state(mock_dependencies):
+    engine, session_mgr = mock_dependencies
+    context_window = ContextWindow(budget=10_000)
+    service = ChatService(engine, session_mgr, context_window=context_window)
+    session_mgr.create_session.return_value = "new-session"
+    # Both calls are prepared (on worker threads) before either starts streaming
+    both_prepared = threading.Barrier(2, timeout=5)
+    fit = context_window.fit
+
+    def fit_together(*args):
+        fitted = fit(*args)
+        both_prepared.wait()
+        return fitted
+
+    context_window.fit = fit_together
+    both_started = asyncio.Event()
+    started = []
+
+    async def run_chat_async(**kwargs):
+        started.append(kwargs["session_id"])
+        if len(started) == 2:
+            both_started.set()
+        await both_started.wait()
+        yield f"reply for {kwargs['session_id']}"
+
+    engine.run_chat_async.side_effect = run_chat_async
+    opening = [{"role": "user", "content": "Hello"}]
+    follow_up = [
+        {"role": "user", "content": "Hello"},
+        {"role": "assistant", "content": "Hi!"},
+        {"role": "user", "content": "Tell me more"},
+    ]
+
+    async def consume(session_id, messages):
+        stream = service.send_message_async(messages[-1]["content"], session_id, "ollama", "llama3", "D", "s", messages)
+        return [chunk async for chunk in stream]
+
+    replies = await asyncio.gather(consume(None, opening), consume("sess-1", follow_up))
+
+    assert replies == [["reply for new-session"], ["reply for sess-1"]]
+    calls = {c.kwargs["session_id"]: c.kwargs for c in engine.run_chat_async.call_args_list}
+    assert (calls["new-session"]["opening_turn"], calls["new-session"]["is_new_session"]) == (True, True)
+    assert (calls["sess-1"]["opening_turn"], calls["sess-1"]["is_new_session"]) == (False, False)
+    assert len(calls["sess-1"]["messages"]) == 4
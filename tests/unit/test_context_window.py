@@ -0,0 +1,140 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from calango import context_window, tokenizer
+from calango.context_window import SUMMARY_HEADER, ContextWindow, context_limit, token_budget
+
+MODEL_COST = {
+    "gpt-small": {"litellm_provider": "openai", "max_input_tokens": 1000, "max_tokens": 500},
+    "gemini/gemini-x": {"litellm_provider": "gemini", "max_tokens": 32_000},
+}
+
+
+@pytest.fixture(autouse=True)
+def estimated_tokens():
+    """Every message costs len(content) / 4 tokens; limits come from a small model map."""
+    tokenizer.clear_cache()
+    context_limit.cache_clear()
+    with patch("calango.tokenizer.tiktoken", None), patch("litellm.model_cost", MODEL_COST):
+        yield
+    tokenizer.clear_cache()
+    context_limit.cache_clear()
+
+
+def conversation(turns):
+    """System prompt (10 tokens) followed by `turns` messages of 100 tokens each, the last one a question."""
+    messages = [{"role": "system", "content": "s" * 40}]
+    for i in range(turns):
+        role = "user" if (turns - 1 - i) % 2 == 0 else "assistant"
+        messages.append({"role": role, "content": f"{i:03d}" + "x" * 397})
+    return messages
+
+
+def test_context_limit_and_budget():
+    assert context_limit("OpenAI", "gpt-small") == 1000
+    # Google models are listed under litellm's "gemini" prefix
+    assert context_limit("Google", "gemini-x") == 32_000
+    assert context_limit("ollama", "unknown") == context_window.DEFAULT_CONTEXT_LIMIT
+
+    # A quarter of a small context at most is reserved for the reply
+    assert token_budget("openai", "gpt-small", budget=16_000, reply_reserve=2048) == 750
+    assert token_budget("google", "gemini-x", budget=16_000, reply_reserve=2048) == 16_000
+    assert token_budget("google", "gemini-x", budget=0, reply_reserve=2048) == 29_952
+
+
+def test_fit_keeps_system_prompt_and_newest_turns():
+    history = conversation(20)
+    window = ContextWindow(budget=450)
+
+    messages, info = window.fit("openai", "gpt-small", history)
+
+    assert messages[0] == history[0]
+    # 440 tokens of turns fit, but the window never opens with a cut-off reply
+    assert messages[1:] == history[-3:]
+    assert messages[1]["role"] == "user"
+    assert info == {"limit": 1000, "budget": 450, "tokens": 310, "sent": 3, "dropped": 17, "summarized": 0}
+
+
+def test_fit_always_sends_every_system_message():
+    history = conversation(20)
+    retrieved = {"role": "system", "content": "c" * 800}
+    history.insert(1, retrieved)
+
+    messages, info = ContextWindow(budget=450).fit("openai", "gpt-small", history)
+
+    assert messages[:2] == history[:2]
+    # With the retrieved context (200 tokens) only the question fits
+    assert messages[2:] == history[-1:]
+    assert info["tokens"] == 310
+
+
+def test_fit_always_sends_the_new_prompt():
+    history = conversation(3)
+    history[-1]["content"] = "q" * 4000
+
+    messages, info = ContextWindow(budget=100).fit("openai", "gpt-small", history)
+
+    assert messages == [history[0], history[-1]]
+    assert info["dropped"] == 2
+
+
+def test_short_conversations_are_sent_whole():
+    history = conversation(5)
+    messages, info = ContextWindow().fit("openai", "gpt-small", history)
+    assert messages == history
+    assert info["dropped"] == 0
+
+
+class SummaryStore:
+    def __init__(self):
+        self.summaries = {}
+
+    def get_context_summary(self, session_id):
+        return self.summaries.get(session_id)
+
+    def save_context_summary(self, session_id, summary):
+        self.summaries[session_id] = summary
+
+
+def test_rolling_summary_is_cached_and_refreshed_in_batches():
+    store = SummaryStore()
+    summarizer = MagicMock(return_value="They talked about lizards.")
+    window = ContextWindow(budget=450, summarizer=summarizer, summaries=store, batch=6)
+    history = conversation(11)
+
+    messages, info = window.fit("openai", "gpt-small", history, "s1")
+
+    provider, model, folded, previous = summarizer.call_args.args
+    assert (provider, model, previous) == ("openai", "gpt-small", "")
+    assert folded == history[1:9]
+    assert messages[0]["content"] == f"{history[0]['content']}\n\n{SUMMARY_HEADER}\nThey talked about lizards."
+    assert messages[1:] == history[-3:]
+    assert info["summarized"] == 8
+    assert store.summaries["s1"]["covered"] == 8
+
+    # The next turns reuse the cached summary until another batch has left the window
+    history += conversation(3)[2:]
+    window.fit("openai", "gpt-small", history, "s1")
+    assert summarizer.call_count == 1
+
+    history += conversation(9)[2:]
+    summarizer.return_value = "Lizards, then snakes."
+    messages, info = window.fit("openai", "gpt-small", history, "s1")
+    assert summarizer.call_count == 2
+    assert summarizer.call_args.args[2:] == (history[9:19], "They talked about lizards.")
+    assert messages[0]["content"].endswith("Lizards, then snakes.")
+
+
+def test_stale_or_failed_summary_falls_back_to_trimming(capsys):
+    store = SummaryStore()
+    store.summaries["s1"] = {"covered": 4, "anchor": "edited", "text": "Outdated."}
+    window = ContextWindow(budget=450, summarizer=MagicMock(side_effect=RuntimeError("quota")), summaries=store)
+    history = conversation(11)
+
+    messages, info = window.fit("openai", "gpt-small", history, "s1")
+
+    assert "Outdated." not in messages[0]["content"]
+    assert messages == [history[0], *history[-3:]]
+    assert info["summarized"] == 0
+    assert "Context Summary Failed" in capsys.readouterr().out
@@ -0,0 +1,227 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from calango.core import CalangoEngine
+
+
+@pytest.fixture
+def engine():
+    """Engine with its internal managers mocked out."""
+    with (
+        patch("calango.core.ConfigManager"),
+        patch("calango.core.InteractionManager"),
+        patch("calango.core.SessionManager"),
+    ):
+        engine = CalangoEngine()
+    engine.config.get_provider.return_value = {"name": "openai", "api_key": "sk-test", "models": ["gpt-4o-mini"]}
+    return engine
+
+
+class AsyncStream:
+    def __init__(self, items):
+        self.items = iter(items)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self.items)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+def make_chunk(content):
+    chunk = MagicMock()
+    chunk.choices = [MagicMock()]
+    chunk.choices[0].delta.content = content
+    return chunk
+
+
+async def collect(agen):
+    return [chunk async for chunk in agen]
+
+
+@pytest.mark.asyncio
+async def test_run_chat_async_streams_and_logs(engine, monkeypatch):
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+
+    async def fake_acompletion(**kwargs):
+        return AsyncStream([make_chunk("Hello"), make_chunk(None), make_chunk(" World")])
+
+    messages = [{"role": "user", "content": "Hi"}]
+    with patch("calango.core.acompletion", side_effect=fake_acompletion) as mock_acompletion:
+        chunks = await collect(engine.run_chat_async("openai", "gpt-4o-mini", messages, "sess-1", "Default"))
+
+    assert chunks == ["Hello", " World"]
+    assert mock_acompletion.call_args.kwargs["model"] == "openai/gpt-4o-mini"
+    assert mock_acompletion.call_args.kwargs["api_key"] == "sk-test"
+    logged = engine.memory.log_interaction.call_args.kwargs
+    assert logged["response"].choices[0].message.content == "Hello World"
+    assert logged["session_id"] == "sess-1"
+
+
+@pytest.mark.asyncio
+async def test_run_chat_async_maps_errors(engine, monkeypatch):
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+
+    with patch("calango.core.acompletion", side_effect=Exception("429 rate limit")):
+        chunks = await collect(engine.run_chat_async("openai", "gpt-4o-mini", [], "sess-1", "Default"))
+
+    assert chunks == ["Error: Cota excedida. Limite de uso atingido para openai/gpt-4o-mini."]
+    engine.memory.log_interaction.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_run_chat_async_without_api_key(engine, monkeypatch):
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    engine.config.get_provider.return_value = None
+
+    chunks = await collect(engine.run_chat_async("openai", "gpt-4o-mini", [], "sess-1", "Default"))
+
+    assert chunks == ["Error: No API key found for openai."]
+
+
+def test_run_chat_captures_provider_usage(engine, monkeypatch):
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+
+    usage_chunk = MagicMock()
+    usage_chunk.choices = []
+    usage_chunk.usage.prompt_tokens = 12
+    usage_chunk.usage.completion_tokens = 3
+
+    reported = {}
+    with patch("calango.core.completion", return_value=[make_chunk("Hi"), usage_chunk]) as mock_completion:
+        chunks = list(engine.run_chat("openai", "gpt-4o-mini", [], "sess-1", "Default", on_usage=reported.update))
+
+    assert chunks == ["Hi"]
+    assert mock_completion.call_args.kwargs["stream_options"] == {"include_usage": True}
+    assert reported == {"prompt_tokens": 12, "completion_tokens": 3, "total_tokens": 15}
+    logged_usage = engine.memory.log_interaction.call_args.kwargs["response"].usage
+    assert (logged_usage.prompt_tokens, logged_usage.completion_tokens) == (12, 3)
+
+
+def test_run_chat_replays_cached_response(engine, monkeypatch, tmp_path):
+    from calango.response_cache import ResponseCache
+
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    engine.response_cache = ResponseCache(tmp_path / "cache.db")
+    messages = [{"role": "user", "content": "Hi"}]
+
+    with patch("calango.core.completion", return_value=[make_chunk("Hello there")]) as mock_completion:
+        first = "".join(engine.run_chat("openai", "gpt-4o-mini", messages, "sess-1", "Default"))
+    assert first == "Hello there"
+    assert engine.memory.log_interaction.call_args.kwargs["cached"] is False
+
+    reported = {}
+    with patch("calango.core.completion") as mock_completion:
+        second = list(engine.run_chat("openai", "gpt-4o-mini", messages, "sess-1", "Default", on_usage=reported.update))
+
+    mock_completion.assert_not_called()
+    assert "".join(second) == "Hello there"
+    assert reported["cached"] is True and reported["total_tokens"] == 0
+    assert engine.memory.log_interaction.call_args.kwargs["cached"] is True
+
+
+def test_run_chat_keeps_the_reply_when_the_cache_write_fails(engine, monkeypatch):
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    engine.response_cache = MagicMock()
+    engine.response_cache.get.return_value = None
+    engine.response_cache.put.side_effect = OSError("disk full")
+
+    with patch("calango.core.completion", return_value=[make_chunk("A perfectly good answer")]):
+        chunks = list(engine.run_chat("openai", "gpt-4o-mini", [{"role": "user", "content": "Hi"}], "s1", "Default"))
+
+    assert chunks == ["A perfectly good answer"]
+    logged = engine.memory.log_interaction.call_args.kwargs["response"]
+    assert logged.choices[0].message.content == "A perfectly good answer"
+
+
+@pytest.mark.asyncio
+async def test_run_chat_async_asks_the_provider_when_the_cache_read_fails(engine, monkeypatch):
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    engine.response_cache = MagicMock()
+    engine.response_cache.get.side_effect = Exception("database is locked")
+
+    async def fake_acompletion(**kwargs):
+        return AsyncStream([make_chunk("Fresh answer")])
+
+    messages = [{"role": "user", "content": "Hi"}]
+    with patch("calango.core.acompletion", side_effect=fake_acompletion) as mock_acompletion:
+        chunks = await collect(engine.run_chat_async("openai", "gpt-4o-mini", messages, "s1", "Default"))
+
+    assert chunks == ["Fresh answer"]
+    mock_acompletion.assert_called_once()
+    engine.response_cache.put.assert_called_once()
+
+
+def test_run_chat_serves_semantic_cache_hits(engine, monkeypatch, tmp_path):
+    from calango.semantic_cache import HashingEmbedder, SemanticCache
+
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    engine.semantic_cache = SemanticCache(tmp_path, embedder=HashingEmbedder(), threshold=0.9)
+
+    first = [{"role": "user", "content": "How do I reverse a list in Python?"}]
+    with patch("calango.core.completion", return_value=[make_chunk("Use reversed().")]):
+        "".join(engine.run_chat("openai", "gpt-4o-mini", first, "sess-1", "Default"))
+
+    similar = [{"role": "user", "content": "how do I reverse a list in python"}]
+    with patch("calango.core.completion") as mock_completion:
+        reply = "".join(engine.run_chat("openai", "gpt-4o-mini", similar, "sess-2", "Default"))
+        # Another persona never shares the cached reply
+        mock_completion.return_value = [make_chunk("Reversing...")]
+        other = "".join(engine.run_chat("openai", "gpt-4o-mini", similar, "sess-3", "Pirate"))
+
+    assert reply == "Use reversed()."
+    assert other == "Reversing..."
+    assert mock_completion.call_count == 1
+    assert engine.semantic_cache.get_stats()["hits"] == 1
+
+
+def test_run_chat_survives_a_failing_semantic_cache(engine, monkeypatch):
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    engine.semantic_cache = MagicMock()
+    engine.semantic_cache.lookup.side_effect = RuntimeError("embedder crashed")
+    engine.semantic_cache.add.side_effect = OSError("disk full")
+
+    question = [{"role": "user", "content": "How do I reverse a list in Python?"}]
+    with patch("calango.core.completion", return_value=[make_chunk("Use reversed().")]) as mock_completion:
+        chunks = list(engine.run_chat("openai", "gpt-4o-mini", question, "s1", "Default"))
+
+    assert chunks == ["Use reversed()."]
+    mock_completion.assert_called_once()
+    engine.semantic_cache.add.assert_called_once()
+
+
+def test_run_chat_skips_semantic_cache_for_trimmed_follow_ups(engine, monkeypatch):
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    engine.semantic_cache = MagicMock()
+
+    # Looks like an opening question, but the caller cut it from a longer conversation
+    follow_up = [{"role": "system", "content": "sys"}, {"role": "user", "content": "Now translate it to Portuguese"}]
+    with patch("calango.core.completion", return_value=[make_chunk("Agora...")]):
+        "".join(engine.run_chat("openai", "gpt-4o-mini", follow_up, "sess-1", "Default", opening_turn=False))
+
+    engine.semantic_cache.lookup.assert_not_called()
+    engine.semantic_cache.add.assert_not_called()
+
+
+def test_summarize_extends_previous_summary(engine, monkeypatch):
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    response = MagicMock()
+    response.choices[0].message.content = "Lizards, then snakes."
+    messages = [{"role": "user", "content": "And snakes?", "tokens": {"estimate": 3}}]
+
+    with patch("calango.core.completion", return_value=response) as mock_completion:
+        summary = engine.summarize("openai", "gpt-4o-mini", messages, "They talked about lizards.", max_tokens=100)
+
+    assert summary == "Lizards, then snakes."
+    kwargs = mock_completion.call_args.kwargs
+    assert kwargs["model"] == "openai/gpt-4o-mini"
+    assert kwargs["max_tokens"] == 100
+    assert "stream" not in kwargs
+    assert kwargs["messages"][1]["content"] == (
+        "Summary so far:\nThey talked about lizards.\n\nContinuation:\nuser: And snakes?"
+    )
+    engine.memory.log_interaction.assert_not_called()
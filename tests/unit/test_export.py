@@ -0,0 +1,73 @@
+import pytest
+
+from calango import export
+
+pa = pytest.importorskip("pyarrow")
+
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    import calango.database as database
+
+    monkeypatch.setattr(database, "APP_DIR", tmp_path)
+    monkeypatch.setattr(database, "STORAGE_BACKEND", "tinydb")
+    database.close_databases()
+    manager = database.InteractionManager(write_behind=False)
+    manager.history_table.insert_multiple(
+        [
+            {
+                "id": "a",
+                "session_id": "s1",
+                "timestamp": "2024-05-01 10:00:00",
+                "provider": "openai",
+                "model": "gpt-4o",
+                "persona": "P",
+                "messages": [{"role": "user", "content": "hi"}],
+                "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+                "cost_usd": 0.25,
+            },
+            {"id": "b", "timestamp": "not a date", "provider": "ollama", "usage": {"input_tokens": 3}},
+            {"id": "c", "timestamp": "2024-05-02T08:30:00", "provider": "ollama"},
+        ]
+    )
+    yield manager
+    database.close_databases()
+
+
+@pytest.mark.parametrize("fmt, suffix", [("parquet", ".parquet"), ("arrow", ".arrow")])
+def test_export_flattens_history_in_row_groups(manager, tmp_path, fmt, suffix):
+    target = tmp_path / f"history{suffix}"
+
+    assert export.export_history(target, fmt=fmt, row_group_size=2, manager=manager) == 3
+    assert not target.with_name(target.name + ".tmp").exists()
+
+    df = export.read_export(target)
+    assert list(df.columns) == export.history_schema().names
+    assert df["id"].tolist() == ["a", "b", "c"]
+    # Records never patched keep the usage they were logged with (input/output tokens)
+    assert df["prompt_tokens"].tolist() == [10, 3, 0]
+    assert df["total_tokens"].tolist() == [15, 3, 0]
+    assert df["cost_usd"].tolist() == [0.25, 0.0, 0.0]
+    assert df["timestamp"].isna().tolist() == [False, True, False]
+
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+
+        assert pq.ParquetFile(target).num_row_groups == 2
+
+
+def test_export_rejects_unknown_format(manager, tmp_path):
+    with pytest.raises(ValueError):
+        export.export_history(tmp_path / "history.csv", fmt="csv", manager=manager)
+
+
+def test_export_includes_archived_sessions(manager, tmp_path):
+    import calango.database as database
+
+    sessions = database.SessionManager()
+    sessions.sessions_table.insert({"id": "s1", "title": "Old", "created_at": "2024-05-01T09:00:00"})
+    assert sessions.archive_sessions(older_than_days=30) == 1
+    assert len(manager.history_table) == 2
+
+    assert export.export_history(tmp_path / "history.parquet", manager=manager) == 3
+    assert sorted(export.read_export(tmp_path / "history.parquet")["id"]) == ["a", "b", "c"]
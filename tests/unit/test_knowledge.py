@@ -0,0 +1,213 @@
+import os
+
+import numpy as np
+import pytest
+
+from calango.knowledge.base import KnowledgeBase, context_message, get_knowledge_base
+from calango.knowledge.chunking import chunk_stream
+from calango.knowledge.ivf import IVFIndex
+from calango.knowledge.store import VectorStore, writer_lock
+from calango.semantic_cache import HashingEmbedder
+
+
+def _unit_vectors(count, dim, seed=0):
+    vectors = np.random.default_rng(seed).normal(size=(count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def test_chunk_stream_overlaps_across_blocks():
+    text = " ".join(f"word{i}" for i in range(300))
+    blocks = [text[i : i + 97] for i in range(0, len(text), 97)]
+
+    chunks = list(chunk_stream(blocks, chunk_chars=120, overlap=20))
+
+    assert all(len(chunk) <= 120 for _, chunk in chunks)
+    for offset, chunk in chunks:
+        assert text[offset:].lstrip().startswith(chunk[:10])
+    # Every word survives chunking
+    assert {w for _, c in chunks for w in c.split()} >= set(text.split()[1:-1])
+
+
+def test_store_search_matches_brute_force(tmp_path):
+    vectors = _unit_vectors(500, 32)
+    store = VectorStore(tmp_path, 32)
+    for start in range(0, 500, 128):
+        batch = vectors[start : start + 128]
+        store.append(batch, [{"row": start + i} for i in range(len(batch))])
+
+    query = vectors[42]
+    rows, scores = store.search(query, 5)
+
+    expected = np.argsort(-(vectors @ query))[:5]
+    assert rows.tolist() == expected.tolist()
+    assert [m["row"] for m in store.metadata(rows.tolist())] == expected.tolist()
+    assert scores[0] == pytest.approx(1.0, abs=1e-5)
+
+
+def test_store_ignores_uncommitted_rows(tmp_path):
+    store = VectorStore(tmp_path, 4)
+    store.append(_unit_vectors(2, 4), [{"row": 0}, {"row": 1}])
+    # Simulate an ingestion that died after writing data but before the manifest
+    with open(store.vectors_path, "ab") as f:
+        f.write(b"\0" * 64)
+    with open(store.chunks_path, "ab") as f:
+        f.write(b'{"row": "garbage"}\n')
+
+    reopened = VectorStore(tmp_path, 4)
+    assert len(reopened) == 2
+    reopened.append(_unit_vectors(1, 4, seed=1), [{"row": 2}])
+
+    assert reopened.vectors.shape == (3, 4)
+    assert [m["row"] for m in reopened.metadata([0, 1, 2])] == [0, 1, 2]
+
+
+def test_store_rejects_other_dimensions(tmp_path):
+    VectorStore(tmp_path, 4).append(_unit_vectors(1, 4), [{}])
+    with pytest.raises(ValueError):
+        VectorStore(tmp_path, 8)
+
+
+def test_ivf_candidates_cover_probed_lists_and_new_rows():
+    vectors = _unit_vectors(400, 16)
+    index = IVFIndex.train(vectors, nlist=8)
+
+    assert sorted(index.order.tolist()) == list(range(400))
+    every_list = index.candidates(vectors[0], nprobe=8, count=410)
+    assert every_list.tolist() == list(range(410))
+    assert 0 in index.candidates(vectors[0], nprobe=1, count=400)
+
+
+def test_knowledge_base_ingests_and_retrieves(tmp_path):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "lizards.md").write_text("The calango is a small lizard from the Brazilian cerrado. " * 20)
+    (docs / "pasta.txt").write_text("Boil the pasta in salted water for nine minutes. " * 20)
+    (docs / "image.png").write_bytes(b"\x89PNG")
+
+    knowledge = KnowledgeBase(tmp_path / "kb", embedder=HashingEmbedder(), batch_size=4)
+    report = knowledge.sync([docs], workers=1)
+
+    assert report["added"] == [str((docs / "lizards.md").resolve()), str((docs / "pasta.txt").resolve())]
+    hits = knowledge.search("which lizard lives in the cerrado?", k=2)
+    assert hits[0]["source"].endswith("lizards.md")
+
+    knowledge.build_index(nlist=2)
+    reloaded = get_knowledge_base(tmp_path / "kb")
+    assert reloaded.ivf is not None
+    context = reloaded.context_for("how long to boil pasta", k=1)
+    assert context.startswith("[pasta.txt]")
+    assert context_message(context)["role"] == "system"
+    assert context_message(context)["content"].endswith(context)
+    assert context_message("") is None
+
+
+def test_get_knowledge_base_without_data(tmp_path):
+    assert get_knowledge_base(tmp_path) is None
+
+
+def _docs(tmp_path, **files):
+    docs = tmp_path / "docs"
+    docs.mkdir(exist_ok=True)
+    for name, text in files.items():
+        (docs / f"{name}.md").write_text(text)
+    return docs
+
+
+def test_sync_only_reembeds_changed_files(tmp_path):
+    docs = _docs(tmp_path, a="Lizards sunbathe on warm rocks. " * 40, b="Pasta needs salted water. " * 40)
+    knowledge = KnowledgeBase(tmp_path / "kb", embedder=HashingEmbedder())
+    knowledge.sync([docs], workers=1)
+    rows = knowledge.store.count
+
+    assert knowledge.sync([docs], workers=1)["unchanged"] == 2
+
+    # Same bytes, new mtime: hashed but not re-embedded
+    touched = (docs / "a.md").stat().st_mtime_ns + 10_000_000
+    os.utime(docs / "a.md", ns=(touched, touched))
+    report = knowledge.sync([docs], workers=1)
+    assert (report["updated"], report["unchanged"], report["chunks"]) == ([], 2, 0)
+    assert knowledge.store.count == rows
+
+    (docs / "b.md").write_text("Rice needs twice its volume of water. " * 40)
+    report = knowledge.sync([docs], workers=1)
+    assert report["updated"] == [str((docs / "b.md").resolve())]
+    assert knowledge.store.deleted_count > 0
+    assert all("Pasta" not in hit["text"] for hit in knowledge.search("pasta salted water", k=10))
+
+
+def test_sync_tombstones_deleted_files_only_under_synced_paths(tmp_path):
+    docs = _docs(tmp_path, a="Lizards sunbathe on warm rocks. " * 10)
+    other = tmp_path / "other"
+    other.mkdir()
+    (other / "c.txt").write_text("Cats sleep most of the day. " * 10)
+    knowledge = KnowledgeBase(tmp_path / "kb", embedder=HashingEmbedder())
+    knowledge.sync([docs, other], workers=1)
+
+    (docs / "a.md").unlink()
+    report = knowledge.sync([docs], workers=1)
+
+    assert report["removed"] == [str((docs / "a.md").resolve())]
+    assert list(knowledge.store.files) == [str((other / "c.txt").resolve())]
+    assert {hit["source"] for hit in knowledge.search("lizards rocks", k=10)} == {str((other / "c.txt").resolve())}
+
+
+def test_compaction_drops_tombstones_and_rebuilds_index(tmp_path):
+    docs = _docs(tmp_path, **{f"doc{i}": f"Topic {i} is about subject {i}. " * 60 for i in range(6)})
+    knowledge = KnowledgeBase(tmp_path / "kb", embedder=HashingEmbedder(), batch_size=8)
+    knowledge.sync([docs], workers=1)
+    knowledge.build_index(nlist=2)
+    for i in range(3):
+        (docs / f"doc{i}.md").unlink()
+    knowledge.sync([docs], workers=1)
+    live_before = len(knowledge)
+    expected = knowledge.search("Topic 4 is about subject 4", k=3)
+
+    assert knowledge.needs_compaction(threshold=0.2)
+    removed = knowledge.maybe_compact(threshold=0.2)
+
+    assert removed > 0 and knowledge.store.deleted_count == 0
+    assert knowledge.store.count == live_before
+    assert knowledge.ivf.generation == knowledge.store.generation == 1
+    reader = KnowledgeBase(tmp_path / "kb", embedder=HashingEmbedder())
+    assert [h["text"] for h in reader.search("Topic 4 is about subject 4", k=3)] == [h["text"] for h in expected]
+    for source, entry in reader.store.files.items():
+        rows = list(range(entry["first_row"], entry["first_row"] + entry["rows"]))
+        assert {meta["source"] for meta in reader.store.metadata(rows)} == {source}
+
+
+def test_background_compaction_is_picked_up_by_readers(tmp_path):
+    docs = _docs(tmp_path, a="Lizards sunbathe on warm rocks. " * 40, b="Pasta needs salted water. " * 40)
+    knowledge = KnowledgeBase(tmp_path / "kb", embedder=HashingEmbedder())
+    knowledge.sync([docs], workers=1)
+    (docs / "a.md").unlink()
+    knowledge.sync([docs], workers=1)
+
+    thread = knowledge.maybe_compact(threshold=0.2, background=True)
+    thread.join()
+
+    assert knowledge.search("pasta water", k=1)[0]["source"].endswith("b.md")
+    assert knowledge.store.generation == 1 and knowledge.store.deleted_count == 0
+
+
+def test_background_compaction_skips_busy_store(tmp_path):
+    docs = _docs(tmp_path, a="Lizards sunbathe on warm rocks. " * 40)
+    knowledge = KnowledgeBase(tmp_path / "kb", embedder=HashingEmbedder())
+    knowledge.sync([docs], workers=1)
+    (docs / "a.md").write_text("Changed. " * 40)
+    knowledge.sync([docs], workers=1)
+
+    with writer_lock(tmp_path / "kb"):
+        assert KnowledgeBase(tmp_path / "kb", embedder=HashingEmbedder()).compact(blocking=False) == 0
+
+
+def test_sync_chunks_in_worker_processes(tmp_path):
+    docs = _docs(tmp_path, **{f"doc{i}": f"Process pool document number {i}. " * 50 for i in range(4)})
+    knowledge = KnowledgeBase(tmp_path / "kb", embedder=HashingEmbedder())
+
+    report = knowledge.sync([docs], workers=2)
+    serial = KnowledgeBase(tmp_path / "serial", embedder=HashingEmbedder())
+    serial.sync([docs], workers=1)
+
+    assert len(report["added"]) == 4
+    assert knowledge.store.count == serial.store.count
+    assert np.array_equal(np.asarray(knowledge.store.vectors), np.asarray(serial.store.vectors))
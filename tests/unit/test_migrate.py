@@ -0,0 +1,50 @@
+import io
+import json
+
+from tinydb import TinyDB
+
+from calango.database import SQLiteDatabase
+from calango.migrate import TinyDBStreamReader, main, migrate_store
+
+
+def test_stream_reader_handles_chunk_boundaries():
+    data = {
+        "_default": {"1": {"prompt": "olá {\"quoted\"}", "results": [{"model": "m"}]}},
+        "history": {str(i): {"session_id": f"s{i % 3}", "reply": "x" * i} for i in range(1, 40)},
+        "empty": {},
+    }
+    raw = json.dumps(data)
+
+    # A tiny chunk size forces every token to be split across reads
+    rows = list(TinyDBStreamReader(io.StringIO(raw), chunk_size=7))
+
+    assert rows[0] == ("_default", 1, data["_default"]["1"])
+    assert len([r for r in rows if r[0] == "history"]) == 39
+    assert rows[-1] == ("history", 39, data["history"]["39"])
+
+
+def test_migrate_store_preserves_ids_and_verifies(tmp_path):
+    source = tmp_path / "calango.json"
+    tiny = TinyDB(source)
+    tiny.table("history").insert_multiple({"session_id": "s1", "n": i} for i in range(25))
+    tiny.table("config").insert({"name": "openai", "models": ["gpt-4o"]})
+    tiny.table("history").remove(doc_ids=[3])
+    tiny.close()
+
+    target = SQLiteDatabase(tmp_path / "calango.db")
+    stats = migrate_store(source, target, batch_size=10, log=lambda *_: None)
+
+    assert stats["history"]["rows"] == 24 and stats["history"]["verified"]
+    assert stats["config"]["verified"]
+    assert target.table("history").get(doc_id=3) is None
+    assert target.table("history").get(doc_id=25)["n"] == 24
+    target.close()
+
+
+def test_cli_refuses_to_overwrite_without_force(tmp_path, capsys):
+    TinyDB(tmp_path / "calango.json").table("personas").insert({"name": "Poet"})
+
+    assert main(["--source-dir", str(tmp_path)]) == 0
+    assert main(["--source-dir", str(tmp_path)]) == 1
+    assert "--force" in capsys.readouterr().out
+    assert main(["--source-dir", str(tmp_path), "--force"]) == 0
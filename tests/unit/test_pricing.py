@@ -0,0 +1,82 @@
+import json
+from unittest.mock import patch
+
+import pytest
+
+from calango import pricing
+
+
+@pytest.fixture(autouse=True)
+def fresh_catalog():
+    pricing.reload()
+    yield
+    pricing.reload()
+
+
+def write_catalog(path, data):
+    path.write_text(json.dumps(data), encoding="utf-8")
+    return path
+
+
+def test_lookup_order(tmp_path):
+    catalog_file = write_catalog(
+        tmp_path / "pricing.json",
+        {
+            "default": {"input_per_m": 1.0, "output_per_m": 2.0},
+            "models": {
+                "openai/gpt-x": {"input_per_m": 10.0, "output_per_m": 20.0},
+                "gpt-x": {"input_per_m": 5.0, "output_per_m": 6.0},
+                "ollama/*": {"input_per_m": 0.0, "output_per_m": 0.0},
+            },
+        },
+    )
+    catalog = pricing.build_catalog([catalog_file])
+
+    assert catalog.cost("OpenAI", "gpt-x", 1_000_000, 1_000_000) == pytest.approx(30.0)
+    assert catalog.cost("openai", "openai/gpt-x", 1_000_000, 0) == pytest.approx(10.0)
+    assert catalog.cost("azure", "gpt-x", 1_000_000, 0) == pytest.approx(5.0)
+    assert catalog.cost("ollama", "llama3", 1_000_000, 1_000_000) == 0.0
+    assert catalog.cost("anthropic", "unknown", 1_000_000, 1_000_000) == pytest.approx(3.0)
+
+
+def test_later_files_and_files_over_litellm_win(tmp_path):
+    bundled = write_catalog(tmp_path / "bundled.json", {"models": {"gpt-x": {"input_per_m": 1.0}}})
+    user = tmp_path / "user.yaml"
+    user.write_text("models:\n  openai/gpt-y:\n    input_per_m: 7.0\n", encoding="utf-8")
+    model_cost = {
+        "gpt-x": {"litellm_provider": "openai", "input_cost_per_token": 9e-6, "output_cost_per_token": 9e-6},
+        "gpt-y": {"litellm_provider": "openai", "input_cost_per_token": 9e-6, "output_cost_per_token": 9e-6},
+        "gpt-z": {"litellm_provider": "openai", "input_cost_per_token": 4e-6, "output_cost_per_token": 8e-6},
+        "embed": {"litellm_provider": "openai", "mode": "embedding", "input_cost_per_token": 1.0},
+    }
+
+    with patch("litellm.model_cost", model_cost):
+        catalog = pricing.build_catalog([bundled, user], use_litellm=True)
+
+    assert catalog.price("openai", "gpt-x").input_per_token == pytest.approx(1e-6)
+    assert catalog.price("openai", "gpt-y").input_per_token == pytest.approx(7e-6)
+    assert catalog.price("openai", "gpt-z") == pricing.ModelPrice(4e-6, 8e-6)
+    assert catalog.price("openai", "embed") == catalog.default
+
+
+def test_missing_or_broken_files_fall_back_to_defaults(tmp_path):
+    broken = tmp_path / "broken.yaml"
+    broken.write_text("models: [unclosed", encoding="utf-8")
+
+    catalog = pricing.build_catalog([tmp_path / "missing.yaml", broken])
+
+    assert catalog.cost("openai", "gpt-x", 1_000_000, 1_000_000) == pytest.approx(
+        pricing.FALLBACK_INPUT_PER_M + pricing.FALLBACK_OUTPUT_PER_M
+    )
+
+
+def test_catalog_is_built_once_per_process():
+    with patch("calango.pricing.build_catalog", wraps=pricing.build_catalog) as build:
+        pricing.cost_usd("openai", "gpt-4o-mini", 10, 20)
+        pricing.cost_usd("anthropic", "claude-haiku-4-5", 10, 20)
+
+    build.assert_called_once()
+
+
+def test_bundled_catalog_prices_local_models_at_zero():
+    assert pricing.cost_usd("ollama", "llama3", 1_000, 1_000) == 0.0
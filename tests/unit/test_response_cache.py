@@ -0,0 +1,76 @@
+import sqlite3
+
+import pytest
+
+from calango.response_cache import ResponseCache, cache_key, replay_chunks
+
+
+def test_cache_key_normalizes_messages():
+    a = cache_key("OpenAI", "gpt-4o-mini", [{"role": "user", "content": " Hi \n", "extra": 1}], {"stream": True})
+    b = cache_key("openai", "gpt-4o-mini", [{"role": "user", "content": "Hi"}], {"stream": True})
+    assert a == b
+    assert a != cache_key("openai", "gpt-4o", [{"role": "user", "content": "Hi"}], {"stream": True})
+    assert a != cache_key("openai", "gpt-4o-mini", [{"role": "system", "content": "Hi"}], {"stream": True})
+    assert a != cache_key("openai", "gpt-4o-mini", [{"role": "user", "content": "Hi"}], {"stream": False})
+
+
+def test_get_and_put_roundtrip(tmp_path):
+    cache = ResponseCache(tmp_path / "cache.db")
+    assert cache.get("k") is None
+
+    cache.put("k", "openai", "gpt-4o-mini", "Hello", {"prompt_tokens": 3})
+
+    assert cache.get("k") == {"content": "Hello", "usage": {"prompt_tokens": 3}}
+    assert len(cache) == 1
+
+
+def test_expired_entries_are_dropped(tmp_path, monkeypatch):
+    cache = ResponseCache(tmp_path / "cache.db", ttl=10)
+    now = 1_000_000.0
+    monkeypatch.setattr("calango.response_cache.time.time", lambda: now)
+    cache.put("k", "openai", "gpt-4o-mini", "Hello")
+
+    now += 11
+    assert cache.get("k") is None
+    assert len(cache) == 0
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, monkeypatch):
+    cache = ResponseCache(tmp_path / "cache.db", ttl=0, max_entries=2)
+    clock = iter(range(1, 100))
+    monkeypatch.setattr("calango.response_cache.time.time", lambda: float(next(clock)))
+
+    cache.put("a", "openai", "m", "A")
+    cache.put("b", "openai", "m", "B")
+    assert cache.get("a")  # "a" is now more recent than "b"
+    cache.put("c", "openai", "m", "C")
+
+    assert cache.get("b") is None
+    assert cache.get("a")["content"] == "A"
+    assert cache.get("c")["content"] == "C"
+
+
+def test_replay_chunks_rebuilds_content():
+    text = "The quick brown fox jumps over the lazy dog " * 5
+    chunks = list(replay_chunks(text, chunk_size=10))
+
+    assert "".join(chunks) == text
+    assert all(len(chunk) <= 10 for chunk in chunks)
+    assert list(replay_chunks("")) == []
+
+
+def test_caches_share_one_connection_per_file(tmp_path):
+    from calango.database import close_databases
+
+    first = ResponseCache(tmp_path / "cache.db")
+    first.put("k", "openai", "m", "Hello")
+    # Streamlit builds a new engine (and cache) on every rerun
+    second = ResponseCache(tmp_path / "cache.db")
+
+    assert second.conn is first.conn
+    assert second.get("k")["content"] == "Hello"
+    assert ResponseCache(tmp_path / "other.db").conn is not first.conn
+
+    close_databases()
+    with pytest.raises(sqlite3.ProgrammingError):
+        first.conn.execute("SELECT 1")
@@ -0,0 +1,51 @@
+from calango.search import HistorySearchIndex, match_expression
+
+
+def test_match_expression_quotes_terms_and_prefixes_the_last():
+    assert match_expression('lagarto "verde" OR NEAR(') == '"lagarto" "verde" "OR" "NEAR"*'
+    assert match_expression("  ?! ") is None
+
+
+def test_search_ranks_and_ignores_diacritics(tmp_path):
+    index = HistorySearchIndex(tmp_path / "search.db")
+    index.add(
+        [
+            ("r1", "user", "s1", "2024-05-01 10:00:00", "Qual é a ação do calango no cerrado?"),
+            ("r1", "assistant", "s1", "2024-05-01 10:00:00", "O calango caça insetos."),
+            ("r2", "user", "s2", "2024-05-02 10:00:00", "Receita de macarrão"),
+        ]
+    )
+
+    hits = index.search("acao calan")
+    assert [(h["record_id"], h["role"]) for h in hits] == [("r1", "user")]
+    assert "**ação**" in hits[0]["snippet"]
+    assert {h["session_id"] for h in index.search("calango")} == {"s1"}
+    assert index.search("") == []
+
+
+def test_adds_are_idempotent_and_sessions_removable(tmp_path):
+    index = HistorySearchIndex(tmp_path / "search.db")
+    entry = ("r1", "user", "s1", "2024-05-01 10:00:00", "hello lizard")
+    index.add([entry])
+    index.add([entry, ("r2", "user", "s2", "2024-05-01 10:00:00", "hello world")])
+
+    assert len(index) == 2
+    index.remove_sessions(["s1"])
+    assert [h["record_id"] for h in index.search("hello")] == ["r2"]
+
+    assert not index.is_built()
+    index.rebuild(iter([entry]))
+    assert index.is_built()
+    assert [h["record_id"] for h in index.search("hello")] == ["r1"]
+
+
+def test_a_dirty_index_reports_itself_unbuilt_until_rebuilt(tmp_path):
+    index = HistorySearchIndex(tmp_path / "search.db")
+    index.rebuild(iter([("r1", "user", "s1", "2024-05-01 10:00:00", "hello lizard")]))
+
+    index.mark_dirty()
+    assert not index.is_built()
+    assert not HistorySearchIndex(tmp_path / "search.db").is_built()
+
+    index.rebuild(iter([("r1", "user", "s1", "2024-05-01 10:00:00", "hello lizard")]))
+    assert index.is_built()
@@ -0,0 +1,153 @@
+import numpy as np
+import pytest
+
+from calango import semantic_cache
+from calango.semantic_cache import (
+    HashingEmbedder,
+    SemanticCache,
+    cache_scope,
+    embedder_problem,
+    get_embedder,
+    get_semantic_cache,
+    read_stats,
+    same_terms,
+    semantic_query,
+)
+
+SCOPE = cache_scope("openai", "gpt-4o-mini", "Default")
+
+
+def test_hashing_embedder_is_normalized_and_similarity_aware():
+    embedder = HashingEmbedder(dim=256)
+    a, b, c, empty = embedder.embed(
+        ["How do I reverse a list in Python?", "how do I reverse a list in python", "Best pizza in São Paulo", ""]
+    )
+
+    assert np.isclose(np.linalg.norm(a), 1.0)
+    assert float(a @ b) > 0.99
+    assert float(a @ c) < 0.5
+    assert not empty.any()
+
+
+def test_get_embedder_rejects_unknown_specs():
+    assert get_embedder("hashing:64").dim == 64
+    with pytest.raises(ValueError):
+        get_embedder("word2vec")
+
+
+def test_semantic_query_only_for_opening_questions():
+    system = {"role": "system", "content": "Be brief."}
+    assert semantic_query([system, {"role": "user", "content": " Hi "}]) == "Hi"
+    assert semantic_query([{"role": "user", "content": "Hi"}, {"role": "assistant", "content": "Hello"}]) is None
+    assert semantic_query([system]) is None
+
+
+def test_lookup_serves_similar_questions_within_scope(tmp_path):
+    cache = SemanticCache(tmp_path, embedder=HashingEmbedder(), threshold=0.9)
+    cache.add(SCOPE, "How do I reverse a list in Python?", "Use reversed().", saved_tokens=40)
+
+    hit = cache.lookup(SCOPE, "how do i reverse a list in python")
+    assert hit["content"] == "Use reversed()."
+    assert cache.lookup(SCOPE, "What is the capital of France?") is None
+    assert cache.lookup(cache_scope("openai", "gpt-4o", "Default"), "How do I reverse a list in Python?") is None
+
+    stats = cache.get_stats()
+    assert (stats["hits"], stats["misses"], stats["saved_tokens"]) == (1, 2, 40)
+    cache.flush_stats()
+    assert read_stats(tmp_path)["hit_rate"] == pytest.approx(1 / 3)
+
+
+def test_index_persists_and_evicts_oldest(tmp_path):
+    cache = SemanticCache(tmp_path, embedder=HashingEmbedder(), max_entries=2)
+    cache.add(SCOPE, "first question", "1")
+    cache.add(SCOPE, "second question", "2")
+    cache.add(SCOPE, "third question", "3")
+    assert [e["content"] for e in cache.entries] == ["2", "3"]
+    assert cache.lookup(SCOPE, "first question") is None
+
+    reloaded = SemanticCache(tmp_path, embedder=HashingEmbedder(), max_entries=2)
+    assert [e["content"] for e in reloaded.entries] == ["2", "3"]
+    assert reloaded.lookup(SCOPE, "third question")["content"] == "3"
+
+    # Once evicted entries fill half the file it is rewritten without them
+    cache.add(SCOPE, "fourth question", "4")
+    assert len((tmp_path / semantic_cache.ENTRIES_FILE).read_text().splitlines()) == 2
+    assert [e["content"] for e in SemanticCache(tmp_path, embedder=HashingEmbedder()).entries] == ["3", "4"]
+
+    # Vectors from another embedder dimension are discarded
+    assert len(SemanticCache(tmp_path, embedder=HashingEmbedder(dim=64))) == 0
+
+
+def test_instances_on_one_directory_never_drop_each_others_entries(tmp_path):
+    home = SemanticCache(tmp_path, embedder=HashingEmbedder())
+    rinha = SemanticCache(tmp_path, embedder=HashingEmbedder())
+
+    home.add(SCOPE, "How do I reverse a list in Python?", "Use reversed().")
+    rinha.add(SCOPE, "What is the capital of France?", "Paris.")
+
+    assert home.lookup(SCOPE, "what is the capital of france")["content"] == "Paris."
+    assert rinha.lookup(SCOPE, "how do i reverse a list in python")["content"] == "Use reversed()."
+    assert len(SemanticCache(tmp_path, embedder=HashingEmbedder())) == 2
+
+
+def test_stats_are_written_at_most_once_per_interval(tmp_path, monkeypatch):
+    monkeypatch.setattr(semantic_cache, "STATS_WRITE_INTERVAL", 3600)
+    cache = SemanticCache(tmp_path, embedder=HashingEmbedder(), threshold=0.9)
+    cache.add(SCOPE, "How do I reverse a list in Python?", "Use reversed().")
+
+    for _ in range(3):
+        cache.lookup(SCOPE, "how do i reverse a list in python")
+    assert read_stats(tmp_path)["hits"] == 1
+
+    cache.flush_stats()
+    assert read_stats(tmp_path)["hits"] == 3
+
+
+def test_semantic_cache_is_shared_per_directory(tmp_path, monkeypatch):
+    monkeypatch.setattr(semantic_cache, "embedder_problem", lambda spec=None: None)
+    monkeypatch.setattr(semantic_cache, "get_embedder", lambda spec=None: HashingEmbedder())
+    monkeypatch.setattr(semantic_cache, "_CACHES", {})
+
+    assert get_semantic_cache(tmp_path) is get_semantic_cache(tmp_path)
+    assert get_semantic_cache(tmp_path / "other") is not get_semantic_cache(tmp_path)
+
+
+NEAR_MISSES = [
+    (
+        "Can you write a detailed step by step Python function that parses ISO 8601 timestamps with offsets?",
+        "Can you write a detailed step by step Rust function that parses ISO 8601 timestamps with offsets?",
+    ),
+    (
+        "I have type 2 diabetes and I am taking metformin. Is it safe to take ibuprofen for a headache?",
+        "I have type 2 diabetes and I am taking warfarin. Is it safe to take ibuprofen for a headache?",
+    ),
+]
+
+
+@pytest.mark.parametrize(("cached", "asked"), NEAR_MISSES)
+def test_questions_differing_in_a_key_word_never_share_a_reply(tmp_path, cached, asked):
+    cache = SemanticCache(tmp_path, embedder=HashingEmbedder(), threshold=0.9)
+    cache.add(SCOPE, cached, "cached answer")
+
+    # The vectors alone would match: only the term check tells the questions apart
+    a, b = cache.embedder.embed([cached, asked])
+    assert float(a @ b) >= 0.9
+    assert cache.lookup(SCOPE, asked) is None
+
+
+def test_same_terms_tolerates_form_but_not_content():
+    assert same_terms("How do I reverse a list in Python?", "how do i reverse a list in python")
+    assert same_terms("How do I reverse lists in Python?", "reverse a list in Python, please")
+    assert not same_terms("How do I reverse a list in Python?", "How do I reverse a list in Python quickly?")
+    assert not same_terms("Is 2 + 2 = 4?", "Is 2 + 3 = 4?")
+    assert not same_terms("What changed in ISO 8601?", "What changed in ISO 8602?")
+
+
+def test_semantic_cache_requires_an_embedding_model(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(semantic_cache, "embedder_problem", lambda spec=None: embedder_problem("hashing"))
+    monkeypatch.setattr(semantic_cache, "_CACHES", {})
+    assert get_semantic_cache(tmp_path) is None
+    assert "Semantic cache disabled: it needs an embedding model" in capsys.readouterr().out
+
+    monkeypatch.setattr(semantic_cache.importlib.util, "find_spec", lambda name: None)
+    assert "pip install 'calango-ai[semantic]'" in embedder_problem("sentence-transformers:all-MiniLM-L6-v2")
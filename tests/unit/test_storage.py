@@ -0,0 +1,630 @@
+import json
+from unittest.mock import MagicMock, patch
+
+import pytest
+from tinydb import Query
+
+from calango.database import SQLiteDatabase, TranscriptCache
+
+
+@pytest.fixture
+def sqlite_db(tmp_path):
+    db = SQLiteDatabase(tmp_path / "calango.db")
+    yield db
+    db.close()
+
+
+def test_sqlite_table_crud(sqlite_db):
+    history = sqlite_db.table("history")
+    Log = Query()
+
+    first = history.insert({"session_id": "s1", "model": "gpt-4o", "reply": "a"})
+    history.insert({"session_id": "s2", "model": "gpt-4o", "reply": "b"})
+    history.insert({"session_id": "s1", "model": "llama3", "reply": "c"})
+
+    assert len(history) == 3
+    assert [r["reply"] for r in history.search(Log.session_id == "s1")] == ["a", "c"]
+    assert [r["reply"] for r in history.search((Log.session_id == "s1") & (Log.model == "llama3"))] == ["c"]
+    assert history.get(doc_id=first)["reply"] == "a"
+
+    history.update({"reply": "patched"}, doc_ids=[first])
+    assert history.get(doc_id=first)["reply"] == "patched"
+
+    assert history.remove(Log.session_id == "s1") == [first, 3]
+    assert [r["session_id"] for r in history.all()] == ["s2"]
+
+
+def test_sqlite_queries_fall_back_to_python(sqlite_db):
+    personas = sqlite_db.table("personas")
+    Persona = Query()
+    personas.insert({"name": "Pirate", "prompt": "Arr"})
+    personas.insert({"name": "Poet", "prompt": "Verse"})
+
+    # .test() can't be translated to SQL and must still be honoured
+    found = personas.search(Persona.prompt.test(lambda p: p.startswith("V")))
+    assert [p["name"] for p in found] == ["Poet"]
+
+    personas.upsert({"name": "Pirate", "prompt": "Yo ho"}, Persona.name == "Pirate")
+    personas.upsert({"name": "Chef", "prompt": "Bon"}, Persona.name == "Chef")
+    assert personas.get(Persona.name == "Pirate")["prompt"] == "Yo ho"
+    assert len(personas) == 3
+
+
+def test_sqlite_history_indexes_are_used(sqlite_db):
+    sqlite_db.table("history")
+    plan = sqlite_db.conn.execute(
+        "EXPLAIN QUERY PLAN SELECT doc_id FROM history WHERE json_extract(data, '$.session_id') = ?", ("s1",)
+    ).fetchall()
+    assert any("ix_history_session_id" in row[-1] for row in plan)
+    assert sqlite_db.conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_sqlite_search_page(sqlite_db, monkeypatch):
+    history = sqlite_db.table("history")
+    history.insert_multiple(
+        {"session_id": f"s{i % 2}", "model": "m", "n": i, "created_at": f"2024-05-{i % 5 + 1:02d}"} for i in range(20)
+    )
+    Log = Query()
+
+    def page(cond, **kwargs):
+        return [doc["n"] for doc in history.search_page(cond, order_by="created_at", descending=True, **kwargs)]
+
+    newest_first = sorted(range(0, 20, 2), key=lambda n: (n % 5, n), reverse=True)
+    assert page(Log.session_id == "s0", limit=3, offset=2) == newest_first[2:5]
+    assert page(Log.session_id == "s0", offset=8) == newest_first[8:]
+    # Partly translatable conditions are still checked in Python
+    assert page((Log.session_id == "s0") & Log.n.test(lambda n: n >= 10), limit=2) == [14, 18]
+
+    # Exact conditions leave the skipped rows to SQL instead of decoding them
+    decoded = []
+    loads = json.loads
+    monkeypatch.setattr(json, "loads", lambda data: decoded.append(data) or loads(data))
+    page(Log.session_id == "s0", limit=3, offset=5)
+    assert len(decoded) == 3
+
+
+def test_sqlite_default_table_forwarding(sqlite_db):
+    sqlite_db.insert({"prompt": "round 1"})
+    sqlite_db.table("config").insert({"fighter_count": 3})
+
+    assert [r["prompt"] for r in sqlite_db.all()] == ["round 1"]
+    assert sqlite_db.table("config").get(doc_id=1)["fighter_count"] == 3
+    assert {"_default", "config"} <= sqlite_db.tables()
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    import calango.database as database
+
+    monkeypatch.setattr(database, "APP_DIR", tmp_path)
+    monkeypatch.setattr(database, "STORAGE_BACKEND", "tinydb")
+    database.close_databases()
+    yield database
+    database.close_databases()
+
+
+def test_open_database_shares_one_handle(registry):
+    assert registry.open_database() is registry.open_database()
+    assert registry.open_database("rinha_store") is not registry.open_database()
+
+    session_mgr = registry.SessionManager()
+    interaction_mgr = registry.InteractionManager()
+    assert session_mgr.db is interaction_mgr.db
+
+
+def test_shared_tinydb_parses_file_once(registry, monkeypatch):
+    from tinydb.storages import JSONStorage
+
+    db = registry.open_database()
+    db.table("history").insert({"session_id": "s1"})
+
+    parses = []
+    original_read = JSONStorage.read
+    monkeypatch.setattr(JSONStorage, "read", lambda self: parses.append(1) or original_read(self))
+
+    for _ in range(5):
+        registry.SessionManager().get_messages("s1")
+    assert parses == []
+
+
+def test_shared_tinydb_sees_writes_from_other_processes(registry, tmp_path):
+    from tinydb import TinyDB
+
+    shared = registry.open_database().table("sessions")
+    shared.insert({"id": "a"})
+
+    # A separate handle plays the role of another process writing the same file
+    other = TinyDB(tmp_path / "calango.json")
+    other.table("sessions").insert({"id": "b"})
+    other.close()
+
+    shared.insert({"id": "c"})
+    assert sorted(s["id"] for s in shared.all()) == ["a", "b", "c"]
+
+
+def test_shared_tinydb_concurrent_inserts(registry):
+    from concurrent.futures import ThreadPoolExecutor
+
+    history = registry.open_database().table("history")
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda i: history.insert({"n": i}), range(200)))
+
+    assert sorted(doc["n"] for doc in history.all()) == list(range(200))
+
+
+def test_shared_tinydb_insert_multiple_into_fresh_file(registry):
+    table = registry.open_database().table("fresh")
+
+    assert table.insert_multiple([{"n": 1}, {"n": 2}, {"n": 3}]) == [1, 2, 3]
+    assert len(table) == 3
+
+
+def test_write_behind_batches_records_and_patches(registry):
+    manager = registry.InteractionManager(write_behind=True)
+    response = MagicMock()
+    response.usage.prompt_tokens = 0
+    response.usage.completion_tokens = 0
+    response.choices[0].message.content = "reply"
+
+    messages = [{"role": "user", "content": "hi"}]
+    record = manager.log_interaction("openai", "gpt-4o", messages, response, "s1", "P", record_id="rec-1")
+    assert record["id"] == "rec-1"
+    manager.update_interaction("rec-1", {"cost_usd": 0.5})
+
+    manager.flush()
+    stored = manager.history_table.all()
+    assert len(stored) == 1
+    assert stored[0]["cost_usd"] == 0.5
+
+    # Patches for records that already reached the storage are applied by the writer too
+    manager.update_interaction("rec-1", {"cost_usd": 0.75})
+    assert registry.SessionManager().get_messages("s1")[-1]["content"] == "reply"
+    assert manager.history_table.all()[0]["cost_usd"] == 0.75
+
+
+def _flaky_inserts(table, failing):
+    """Batch inserts always fail; single inserts fail for the ids in `failing`."""
+    insert = table.insert
+
+    def insert_one(record):
+        if record["id"] in failing:
+            raise OSError("disk full")
+        return insert(record)
+
+    return patch.multiple(table, insert_multiple=MagicMock(side_effect=OSError("disk full")), insert=insert_one)
+
+
+def test_write_behind_keeps_records_whose_write_failed(registry):
+    table = registry.open_database().table("history")
+    writer = registry.InteractionWriter(table)
+    failing = {"b"}
+
+    with _flaky_inserts(table, failing):
+        for record_id in "abc":
+            writer.submit_record({"id": record_id, "n": 0})
+        writer.flush()
+        assert sorted(doc["id"] for doc in table.all()) == ["a", "c"]
+        # Still buffered, so patches are folded into it
+        writer.submit_patch("b", {"n": 1})
+
+    writer.flush()
+    assert {doc["id"]: doc["n"] for doc in table.all()} == {"a": 0, "b": 1, "c": 0}
+    writer.close()
+
+
+def test_write_behind_gives_up_on_records_that_keep_failing(registry, monkeypatch, capsys):
+    monkeypatch.setattr(registry, "WRITE_BEHIND_ATTEMPTS", 2)
+    table = registry.open_database().table("history")
+    writer = registry.InteractionWriter(table)
+
+    with _flaky_inserts(table, {"bad"}):
+        writer.submit_record({"id": "bad"})
+        writer.submit_record({"id": "good"})
+        # The flush retries once, which is the last attempt
+        writer.flush()
+
+    assert [doc["id"] for doc in table.all()] == ["good"]
+    assert "bad dropped after 2 failed writes" in capsys.readouterr().out
+    writer.flush()
+    assert [doc["id"] for doc in table.all()] == ["good"]
+    writer.close()
+
+
+def _response(reply="reply", prompt_tokens=0, completion_tokens=0):
+    response = MagicMock()
+    response.usage.prompt_tokens = prompt_tokens
+    response.usage.completion_tokens = completion_tokens
+    response.choices[0].message.content = reply
+    return response
+
+
+@pytest.mark.parametrize("write_behind", [True, False])
+def test_usage_rollups_follow_writes_patches_and_deletes(registry, write_behind):
+    manager = registry.InteractionManager(write_behind=write_behind)
+    messages = [{"role": "user", "content": "hi"}]
+    usage = {"usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15}, "cost_usd": 0.25}
+
+    manager.log_interaction("openai", "gpt-4o", messages, _response(), "s1", "P", record_id="a")
+    manager.log_interaction("openai", "gpt-4o", messages, _response(), "s1", "P", record_id="b")
+    # Never patched (e.g. a local provider): the usage reported at logging time counts
+    manager.log_interaction("ollama", "llama3", messages, _response("", 7, 3), "s2", "P", record_id="c")
+    manager.flush()
+    manager.update_interaction("a", usage)
+    manager.update_interaction("b", usage)
+
+    rows = {row["model"]: row for row in manager.get_usage_rollups()}
+    assert rows["gpt-4o"]["count"] == 2
+    assert rows["gpt-4o"]["total_tokens"] == 30
+    assert rows["gpt-4o"]["cost_usd"] == pytest.approx(0.5)
+    assert rows["llama3"]["count"] == 1
+    assert (rows["llama3"]["prompt_tokens"], rows["llama3"]["total_tokens"]) == (7, 10)
+
+    registry.SessionManager().delete_session("s2")
+    assert [row["model"] for row in manager.get_usage_rollups()] == ["gpt-4o"]
+
+
+def test_usage_rollups_backfill_existing_history(registry):
+    history = registry.open_database().table("history")
+    history.insert_multiple(
+        [
+            {"timestamp": "2024-05-01 10:00:00", "provider": "openai", "model": "m", "persona": "P", "cost_usd": 1.0},
+            {"timestamp": "2024-05-01 11:00:00", "provider": "openai", "model": "m", "persona": "P", "cost_usd": 2.0},
+            {"timestamp": "2024-05-02 09:00:00", "provider": "openai", "model": "m", "persona": "P", "cost_usd": 4.0},
+            # Logged before the usage was stored under the prompt/completion names
+            {
+                "timestamp": "2024-05-02 10:00:00",
+                "provider": "openai",
+                "model": "m",
+                "persona": "P",
+                "usage": {"input_tokens": 3, "output_tokens": 2},
+            },
+        ]
+    )
+
+    rows = registry.InteractionManager(write_behind=False).get_usage_rollups()
+
+    assert sorted((row["day"], row["count"], row["cost_usd"], row["total_tokens"]) for row in rows) == [
+        ("2024-05-01", 2, 3.0, 0),
+        ("2024-05-02", 2, 4.0, 5),
+    ]
+
+
+@pytest.mark.parametrize("backend", ["tinydb", "sqlite"])
+def test_query_interactions_pages_filtered_history(registry, monkeypatch, backend):
+    monkeypatch.setattr(registry, "STORAGE_BACKEND", backend)
+    history = registry.open_database().table("history")
+    history.insert_multiple(
+        {"timestamp": f"2024-05-{day:02d} 10:00:00", "provider": provider, "model": "m", "persona": "P"}
+        for day in range(1, 11)
+        for provider in ("openai", "ollama")
+    )
+    manager = registry.InteractionManager(write_behind=False)
+
+    assert manager.count_interactions() == 20
+    assert manager.count_interactions(providers=["ollama"], personas=["P"]) == 10
+
+    page = manager.query_interactions(providers=["ollama"], limit=3, offset=3)
+    assert [r["timestamp"][:10] for r in page] == ["2024-05-07", "2024-05-06", "2024-05-05"]
+    assert {r["provider"] for r in page} == {"ollama"}
+
+    oldest = manager.query_interactions(models=["m"], limit=2, newest_first=False)
+    assert [r["timestamp"][:10] for r in oldest] == ["2024-05-01", "2024-05-01"]
+    assert manager.query_interactions(providers=["nobody"]) == []
+
+
+@pytest.mark.parametrize("backend", ["tinydb", "sqlite"])
+def test_list_sessions_pages_newest_first(registry, monkeypatch, backend):
+    monkeypatch.setattr(registry, "STORAGE_BACKEND", backend)
+    sessions = registry.open_database().table("sessions")
+    sessions.insert_multiple(
+        {"id": f"s{i}", "title": f"Chat {i}", "created_at": f"2024-05-{i:02d}T10:00:00"} for i in range(1, 8)
+    )
+    manager = registry.SessionManager()
+
+    page, cursor = manager.list_sessions(limit=3)
+    assert [s["id"] for s in page] == ["s7", "s6", "s5"]
+
+    page, cursor = manager.list_sessions(limit=3, before=cursor)
+    assert [s["id"] for s in page] == ["s4", "s3", "s2"]
+
+    page, cursor = manager.list_sessions(limit=3, before=cursor)
+    assert [s["id"] for s in page] == ["s1"]
+    assert cursor is None
+
+
+def test_transcripts_are_cached_and_extended_by_new_interactions(registry, monkeypatch):
+    sessions = registry.SessionManager()
+    interactions = registry.InteractionManager(write_behind=True)
+    messages = [{"role": "user", "content": "first"}]
+    interactions.log_interaction("openai", "gpt-4o", messages, _response("one"), "s1", "P", record_id="a")
+
+    assert [m["content"] for m in sessions.get_messages("s1")] == ["first", "one"]
+
+    # Served from the cache from now on, including turns logged afterwards
+    monkeypatch.setattr(sessions.history_table, "search", MagicMock(side_effect=AssertionError("not cached")))
+    interactions.log_interaction(
+        "openai", "gpt-4o", [{"role": "user", "content": "second"}], _response("two"), "s1", "P", record_id="b"
+    )
+    interactions.update_interaction("b", {"reply_tokens": {"estimate": 1}})
+    transcript = sessions.get_messages("s1")
+    assert [m["content"] for m in transcript] == ["first", "one", "second", "two"]
+    assert transcript[-1]["tokens"] == {"estimate": 1}
+
+    # Callers get copies
+    transcript.append({"role": "user", "content": "local only"})
+    assert len(sessions.get_messages("s1")) == 4
+
+    monkeypatch.undo()
+    sessions.delete_session("s1")
+    assert sessions.get_messages("s1") == []
+
+
+def test_transcript_cache_skips_stale_fills():
+    cache = TranscriptCache(maxsize=1)
+
+    version = cache.version("s1")
+    cache.append({"id": "a", "session_id": "s1", "reply": "new"})
+    cache.put("s1", [], version)
+    assert cache.get("s1") is None
+
+    cache.put("s1", [], cache.version("s1"))
+    cache.put("s2", [], cache.version("s2"))
+    assert cache.get("s1") is None  # evicted
+    assert cache.get("s2") == []
+
+
+def test_transcript_cache_bounds_its_change_log():
+    cache = TranscriptCache(maxsize=2)
+
+    version = cache.version("s1")
+    for i in range(1000):
+        cache.append({"id": str(i), "session_id": f"s{i}", "reply": "r"})
+
+    assert len(cache._changes) == 2
+    # s1 changed after the read began; forgotten since, it still can't be filled stale
+    cache.put("s1", [], version)
+    assert cache.get("s1") is None
+    cache.put("s1", [], cache.version("s1"))
+    assert cache.get("s1") == []
+
+
+def test_turn_token_counts_patched_after_logging_survive_a_reload(registry):
+    sessions = registry.SessionManager()
+    interactions = registry.InteractionManager(write_behind=True)
+    assert sessions.get_messages("s1") == []  # cached from now on
+
+    messages = [{"role": "user", "content": "hi"}]
+    record = interactions.log_interaction("openai", "gpt-4o", messages, _response("yo"), "s1", "P")
+    interactions.update_interaction(record["id"], {"user_tokens": {"estimate": 4}, "reply_tokens": {"estimate": 2}})
+    assert [m["tokens"] for m in sessions.get_messages("s1")] == [{"estimate": 4}, {"estimate": 2}]
+
+    interactions.flush()
+    registry.close_databases()
+    assert [m["tokens"] for m in registry.SessionManager().get_messages("s1")] == [{"estimate": 4}, {"estimate": 2}]
+
+
+def test_history_records_store_only_the_new_turn(registry):
+    interactions = registry.InteractionManager(write_behind=False)
+    system = {"role": "system", "content": "You are a lizard."}
+    first = [system, {"role": "user", "content": "hi"}]
+    interactions.log_interaction("openai", "gpt-4o", first, _response("hello"), "s1", "P", record_id="a")
+    second = [*first, {"role": "assistant", "content": "hello"}, {"role": "user", "content": "again"}]
+    interactions.log_interaction("openai", "gpt-4o", second, _response("hi again"), "s1", "P", record_id="b")
+
+    stored = interactions.history_table.all()
+    assert all("messages" not in record for record in stored)
+    assert stored[1]["user_message"] == {"role": "user", "content": "again"}
+    assert stored[1]["context"]["turns"] == 2
+    assert len(interactions.blobs.table) == 1
+
+    assert interactions.get_request_messages(stored[1]) == second
+    assert [m["content"] for m in registry.SessionManager().get_messages("s1")] == ["hi", "hello", "again", "hi again"]
+
+
+def test_retrieved_context_is_stored_apart_from_the_system_prompt(registry):
+    interactions = registry.InteractionManager(write_behind=False)
+    system = {"role": "system", "content": "You are a lizard."}
+    for i, question in enumerate(("Where do calangos live?", "What do calangos eat?")):
+        retrieved = {"role": "system", "content": f"Context: notes on {question}"}
+        messages = [system, retrieved, {"role": "user", "content": question}]
+        interactions.log_interaction("openai", "gpt-4o", messages, _response("yes"), f"s{i}", "P", record_id=str(i))
+
+    stored = interactions.history_table.all()
+    assert stored[0]["context"]["system_prompt_id"] == stored[1]["context"]["system_prompt_id"]
+    assert stored[0]["context"]["turns"] == 0
+    assert interactions.get_request_messages(stored[1]) == messages
+
+
+def test_legacy_history_records_are_still_readable(registry):
+    legacy = {
+        "id": "old",
+        "session_id": "s1",
+        "timestamp": "2024-05-01 10:00:00",
+        "messages": [{"role": "system", "content": "sys"}, {"role": "user", "content": "legacy question"}],
+        "reply": "legacy answer",
+    }
+    registry.open_database().table("history").insert(legacy)
+    interactions = registry.InteractionManager(write_behind=False)
+
+    assert [m["content"] for m in registry.SessionManager().get_messages("s1")] == ["legacy question", "legacy answer"]
+    assert interactions.get_request_messages(interactions.history_table.all()[0]) == legacy["messages"]
+
+
+def test_repeated_prompts_are_stored_once_and_rehydrated(registry):
+    interactions = registry.InteractionManager(write_behind=True)
+    system = {"role": "system", "content": "You are a lizard. " * 20}
+    long_prompt = "Explain the mating dance of the tegu lizard in detail. " * 10
+
+    # A Rinha round: every fighter logs the same prompt
+    for fighter in ("a", "b", "c"):
+        messages = [system, {"role": "user", "content": long_prompt}]
+        interactions.log_interaction("openai", fighter, messages, _response(fighter), "rinha", "P", record_id=fighter)
+    interactions.flush()
+
+    stored = interactions.history_table.all()
+    assert {record["user_message"]["content_ref"] for record in stored} == {registry.blob_id(long_prompt)}
+    assert all("content" not in record["user_message"] for record in stored)
+    assert len(interactions.blobs.table) == 2
+
+    registry.close_databases()
+    transcript = registry.SessionManager().get_messages("rinha")
+    assert [m["content"] for m in transcript if m["role"] == "user"] == [long_prompt] * 3
+    fresh = registry.InteractionManager(write_behind=False)
+    assert fresh.get_request_messages(fresh.history_table.all()[0])[0] == system
+
+
+def test_old_sessions_are_archived_and_loaded_lazily(registry):
+    sessions = registry.SessionManager()
+    interactions = registry.InteractionManager(write_behind=False)
+    old_id = sessions.create_session("Old chat")
+    new_id = sessions.create_session("New chat")
+    sessions.sessions_table.update({"created_at": "2020-01-15T10:00:00"}, doc_ids=[1])
+    for session_id, text in ((old_id, "ancient"), (new_id, "recent")):
+        messages = [{"role": "user", "content": text}]
+        interactions.log_interaction("openai", "gpt-4o", messages, _response(text), session_id, "P")
+    interactions.history_table.update({"timestamp": "2020-01-15 10:05:00"}, Query().session_id == old_id)
+    rollups_before = interactions.get_usage_rollups()
+
+    assert sessions.archive_sessions(older_than_days=30) == 1
+
+    assert [s["id"] for s in sessions.sessions_table.all()] == [new_id]
+    assert {ix["session_id"] for ix in interactions.history_table.all()} == {new_id}
+    assert (registry.APP_DIR / "archive" / "2020-01.jsonl.gz").exists()
+
+    listed, _ = sessions.list_sessions()
+    assert [(s["id"], s.get("archived", False)) for s in listed] == [(new_id, False), (old_id, True)]
+    assert [m["content"] for m in sessions.get_messages(old_id)] == ["ancient", "ancient"]
+
+    # Archived usage still counts, also when the rollups are rebuilt
+    interactions.rollup.rebuild(interactions.history_table)
+    assert sum(r["count"] for r in interactions.get_usage_rollups()) == sum(r["count"] for r in rollups_before)
+
+    sessions.delete_session(old_id)
+    assert sessions.get_messages(old_id) == []
+    assert len(sessions.archive_index) == 0
+    assert not (registry.APP_DIR / "archive" / "2020-01.jsonl.gz").exists()
+
+
+def test_archival_follows_last_activity_and_picks_up_stragglers(registry):
+    sessions = registry.SessionManager()
+    interactions = registry.InteractionManager(write_behind=False)
+    History = Query()
+    quiet, busy = sessions.create_session("Quiet"), sessions.create_session("Busy")
+    sessions.sessions_table.update({"created_at": "2020-01-15T10:00:00"}, doc_ids=[1, 2])
+    for session_id, persona in ((quiet, "P"), (busy, "Q")):
+        messages = [{"role": "user", "content": f"hello from {persona}"}]
+        interactions.log_interaction("openai", "gpt-4o", messages, _response("hi"), session_id, persona)
+    interactions.history_table.update({"timestamp": "2020-01-15 10:05:00"}, History.session_id == quiet)
+
+    # Created long ago, but still in use
+    assert sessions.archive_sessions(older_than_days=30) == 1
+    assert [s["id"] for s in sessions.sessions_table.all()] == [busy]
+
+    # A reply lands in the archived session after its archival
+    messages = [{"role": "user", "content": "one more"}]
+    interactions.log_interaction("openai", "gpt-4o", messages, _response("late"), quiet, "P")
+    assert interactions.count_interactions(personas=["P"]) == 2
+    assert sessions.archive_sessions(older_than_days=30) == 0
+    assert interactions.history_table.count(History.session_id == quiet) == 1
+
+    interactions.history_table.update({"timestamp": "2020-02-01 09:00:00"}, History.session_id == quiet)
+    sessions.archive_sessions(older_than_days=30)
+
+    assert interactions.history_table.count(History.session_id == quiet) == 0
+    assert [m["content"] for m in sessions.get_messages(quiet)] == ["hello from P", "hi", "one more", "late"]
+    assert interactions.count_interactions() == 3
+    assert interactions.count_interactions(personas=["P"]) == 2
+    assert interactions.count_interactions(models=["llama3"]) == 0
+    page = interactions.query_interactions(personas=["P"], newest_first=False)
+    assert [ix["reply"] for ix in page] == ["hi", "late"]
+    assert [ix["session_id"] for ix in interactions.query_interactions(limit=2)] == [busy, quiet]
+    assert [ix["session_id"] for ix in interactions.query_interactions(limit=1)] == [busy]
+
+    # Index rows written before the counts were kept get them from the segment
+    sessions.archive_index.update(lambda row: (row.pop("dimensions"), row.pop("last_activity")))
+    assert interactions.count_interactions(personas=["P"]) == 2
+    assert sessions.archive_index.all()[0]["last_activity"] == "2020-02-01 09:00:00"
+
+
+@pytest.mark.parametrize("backend", ["tinydb", "sqlite"])
+def test_search_sessions_over_prompts_and_replies(registry, monkeypatch, backend):
+    monkeypatch.setattr(registry, "STORAGE_BACKEND", backend)
+    sessions = registry.SessionManager()
+    interactions = registry.InteractionManager(write_behind=True)
+    lizard = sessions.create_session("Lizards")
+    pasta = sessions.create_session("Pasta")
+    long_prompt = "Tell me about the calango lizard. " + "x" * registry.BLOB_MIN_CHARS
+    interactions.log_interaction(
+        "openai", "gpt-4o", [{"role": "user", "content": long_prompt}], _response("It basks in the sun."), lizard, "P"
+    )
+    pasta_question = [{"role": "user", "content": "How long to boil pasta?"}]
+    interactions.log_interaction("openai", "gpt-4o", pasta_question, _response("Nine minutes."), pasta, "P")
+
+    results = sessions.search_sessions("calango")
+    assert [(r["id"], r["title"]) for r in results] == [(lizard, "Lizards")]
+    assert "**calango**" in results[0]["snippet"]
+    assert [r["id"] for r in sessions.search_sessions("nine min")] == [pasta]
+    assert {h["role"] for h in interactions.search_history("basks")} == {"assistant"}
+
+    sessions.delete_session(lizard)
+    assert sessions.search_sessions("calango") == []
+
+
+def test_search_index_is_built_from_existing_history_and_archive(registry):
+    sessions = registry.SessionManager()
+    interactions = registry.InteractionManager(write_behind=False)
+    old_id = sessions.create_session("Old chat")
+    sessions.sessions_table.update({"created_at": "2020-01-15T10:00:00"}, doc_ids=[1])
+    interactions.log_interaction(
+        "openai", "gpt-4o", [{"role": "user", "content": "ancient lizard"}], _response("yes"), old_id, "P"
+    )
+    interactions.history_table.update({"timestamp": "2020-01-15 10:05:00"}, Query().session_id == old_id)
+    sessions.archive_sessions(older_than_days=30)
+    # History written before the index existed
+    interactions.history_table.insert(
+        {"id": "legacy", "session_id": "s-legacy", "messages": [{"role": "user", "content": "legacy lizard"}]}
+    )
+    sessions.sessions_table.insert({"id": "s-legacy", "title": "Legacy", "created_at": "2024-01-01T00:00:00"})
+
+    assert not sessions.search_index.is_built()
+    results = sessions.search_sessions("lizard")
+
+    assert {(r["id"], r["archived"]) for r in results} == {(old_id, True), ("s-legacy", False)}
+
+
+@pytest.mark.parametrize("write_behind", [True, False])
+def test_failed_search_index_update_triggers_a_rebuild(registry, capsys, write_behind):
+    sessions = registry.SessionManager()
+    interactions = registry.InteractionManager(write_behind=write_behind)
+    session_id = sessions.create_session("Lizards")
+    sessions.search_sessions("warmup")
+
+    with patch.object(interactions.search_index, "add", side_effect=OSError("disk I/O error")):
+        messages = [{"role": "user", "content": "Where does the calango live?"}]
+        interactions.log_interaction("openai", "gpt-4o", messages, _response("In the cerrado."), session_id, "P")
+        interactions.flush()
+
+    assert "Search index update failed" in capsys.readouterr().out
+    assert interactions.count_interactions() == 1
+    assert [r["id"] for r in sessions.search_sessions("cerrado")] == [session_id]
+
+
+def test_each_database_gets_its_own_search_index(registry, monkeypatch):
+    chats = registry.get_search_index(registry.open_database())
+    rinha = registry.get_search_index(registry.open_database("rinha_store"))
+    monkeypatch.setattr(registry, "STORAGE_BACKEND", "sqlite")
+    sqlite_chats = registry.get_search_index(registry.open_database())
+
+    assert len({chats.path, rinha.path, sqlite_chats.path}) == 3
+    assert chats.path == registry.APP_DIR / "calango.json.search.db"
+
+
+def test_context_summary_is_kept_on_the_session(registry):
+    session_mgr = registry.SessionManager()
+    session_id = session_mgr.create_session("Long chat")
+    assert session_mgr.get_context_summary(session_id) is None
+
+    summary = {"covered": 8, "anchor": "abc", "text": "They talked about lizards."}
+    session_mgr.save_context_summary(session_id, summary)
+    assert registry.SessionManager().get_context_summary(session_id) == summary
+    assert session_mgr.get_context_summary("missing") is None
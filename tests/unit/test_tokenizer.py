@@ -0,0 +1,56 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from calango import tokenizer
+
+
+@pytest.fixture(autouse=True)
+def fresh_registry():
+    tokenizer.clear_cache()
+    yield
+    tokenizer.clear_cache()
+
+
+def test_encodings_are_loaded_once_per_encoding():
+    with patch("calango.tokenizer.tiktoken") as mock_tik:
+        mock_tik.encoding_name_for_model.return_value = "o200k_base"
+        mock_tik.get_encoding.return_value.encode.side_effect = lambda text, **_: text.split()
+
+        assert tokenizer.count_tokens("one two three", "gpt-4o") == 3
+        assert tokenizer.count_tokens("four five", "gpt-4o-mini") == 2
+        assert tokenizer.count_tokens("six", "gpt-4o") == 1
+
+    mock_tik.get_encoding.assert_called_once_with("o200k_base")
+    assert mock_tik.encoding_name_for_model.call_count == 2
+
+
+def test_unknown_models_use_default_encoding():
+    with patch("calango.tokenizer.tiktoken") as mock_tik:
+        mock_tik.encoding_name_for_model.side_effect = KeyError("unknown")
+        tokenizer.count_tokens("hello", "llama3")
+
+    mock_tik.get_encoding.assert_called_once_with(tokenizer.DEFAULT_ENCODING)
+
+
+def test_long_texts_are_estimated_from_a_sample():
+    encoding = MagicMock()
+    encoding.encode.side_effect = lambda text, **_: range(len(text) // 2)
+
+    with patch("calango.tokenizer.tiktoken") as mock_tik:
+        mock_tik.get_encoding.return_value = encoding
+        count = tokenizer.count_tokens("x" * (tokenizer.LONG_TEXT_CHARS * 3), "gpt-4o")
+
+    assert count == tokenizer.LONG_TEXT_CHARS * 3 // 2
+    encoding.encode.assert_called_once()
+    assert len(encoding.encode.call_args.args[0]) == tokenizer.SAMPLE_CHARS
+
+
+def test_unavailable_encoding_falls_back_to_estimate():
+    with patch("calango.tokenizer.tiktoken") as mock_tik:
+        mock_tik.get_encoding.side_effect = OSError("offline")
+        assert tokenizer.count_tokens("a" * 40, "gpt-4o") == 10
+        assert tokenizer.count_tokens("a" * 80, "gpt-4o") == 20
+
+    # The failed load is remembered instead of retried on every call
+    mock_tik.get_encoding.assert_called_once()